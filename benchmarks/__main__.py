@@ -0,0 +1,40 @@
+"""Run the benchmark suite: python -m benchmarks [--json out.json] [--baseline old.json]"""
+import argparse
+import json
+import sys
+
+from benchmarks import bench_app, bench_layout, bench_mapping, bench_pipeline, bench_sensor
+from benchmarks.harness import Runner, compare, write_json
+
+SUITES = (bench_mapping, bench_pipeline, bench_sensor, bench_layout, bench_app)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bluetooth RC benchmarks')
+    parser.add_argument('--json', default='benchmark_results.json', help='where to write the results')
+    parser.add_argument('--filter', default=None, help='only run benchmarks whose name contains this')
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--quick', action='store_true', help='a tenth of the rounds, for smoke runs')
+    parser.add_argument('--baseline', default=None, help='fail if p50 regressed against this result file')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown, 0.25 = 25%%')
+    args = parser.parse_args(argv)
+
+    runner = Runner(rounds=args.rounds, name_filter=args.filter, quick=args.quick)
+    for suite in SUITES:
+        suite.run(runner)
+
+    report = runner.report()
+    print(f"💾 Results: {write_json(report, args.json)}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for name, info in regressions.items():
+            print(f"❌ {name}: {info['baseline']:.2f} -> {info['current']:.2f} µs (x{info['ratio']:.2f})")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""App-level paths that need Kivy: settings store, UI layout, battery canvas, send_command.
+
+Importing main opens a Kivy window, so on a headless Linux box run the
+suite under a virtual display (``xvfb-run python -m benchmarks``).
+"""
+import os
+import tempfile
+
+from benchmarks.harness import HAS_KIVY
+
+WINDOW_SIZES = [(w, h) for w in (800, 1280, 1920, 2400, 2960) for h in (480, 720, 1080, 1440)]
+
+NAMES = ('app.settings', 'app.ui', 'app.battery', 'app.send_command', 'app.accelerometer')
+
+
+class _FixedWindow:
+    """Stands in for kivy Window while the layout runs against a list of sizes"""
+
+    def __init__(self, size):
+        self.size = size
+
+
+def run(runner):
+    if not HAS_KIVY:
+        for name in NAMES:
+            runner.skip(name, 'kivy is not installed')
+        return
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+    os.environ.setdefault('KIVY_NO_CONSOLELOG', '1')
+
+    _bench_settings(runner)
+    try:
+        import main
+    except Exception as e:
+        for name in NAMES[1:]:
+            runner.skip(name, f'main.py could not be imported: {e}')
+        return
+    root = main.CombinedAppRoot()
+    try:
+        _bench_ui(runner, main, root)
+        _bench_send_command(runner, root)
+    finally:
+        root.control_loop.stop()
+        root.vehicle_pool.shutdown()
+
+
+def _bench_settings(runner):
+    from settings_manager import SettingsManager
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # flush_delay بزرگ: کشیدن اسلایدر فقط حافظه را تغییر می‌دهد، نوشتن دیسک جدا اندازه‌گیری می‌شود
+        manager = SettingsManager(os.path.join(tmp, 'settings.json'), flush_delay=60.0)
+        state = {'i': 0}
+
+        def drag():
+            state['i'] = (state['i'] + 1) % 150
+            manager.set('sensitivity', 0.5 + state['i'] / 100.0)
+
+        runner.measure('app.settings.get_flat', lambda: manager.get('steering_deadzone'), batch=500)
+        runner.measure('app.settings.snapshot', lambda: manager.snapshot('control_settings').sensitivity, batch=500)
+        runner.measure('app.settings.set_slider_drag', drag, batch=100)
+
+        def flush():
+            drag()
+            manager.flush()
+
+        runner.measure('app.settings.flush', flush, rounds=max(20, runner.rounds // 5))
+
+
+def _bench_ui(runner, main, root):
+    original_window = main.Window
+    try:
+        main.Window = _FixedWindow(WINDOW_SIZES[0])
+        root._build_ui(0)
+        state = {'i': 0}
+
+        def relayout():
+            state['i'] = (state['i'] + 1) % len(WINDOW_SIZES)
+            main.Window.size = WINDOW_SIZES[state['i']]
+            root._update_ui_positions()
+
+        runner.measure('app.ui.update_positions', relayout, batch=len(WINDOW_SIZES),
+                       rounds=max(20, runner.rounds // 2))
+    finally:
+        main.Window = original_window
+
+    battery = main.BatteryIndicator(size=(120, 48), pos=(10, 10))
+
+    def redraw():
+        battery.level = (battery.level + 7) % 101
+        battery._update_canvas()
+
+    runner.measure('app.battery.update_canvas', redraw, batch=50)
+
+    manager = root.accelerometer_manager
+    state = {'i': 0}
+
+    def sample():
+        state['i'] += 1
+        manager.update_values(0.3, 0.1 * (state['i'] % 20), 9.7)
+        if state['i'] % 4 == 0:
+            manager.worker.run_once()
+
+    runner.measure('app.accelerometer.update_values_200hz', sample, batch=200)
+
+
+def _bench_send_command(runner, root):
+    # لینک «وصل» به شبیه‌ساز؛ نویسنده اجرا می‌شود ولی سرور GATT ندارد و فقط صف را خالی می‌کند
+    link = root.ble
+    link.connected = True
+    link.characteristic_found = True
+    commands = ['D', 'LED', 'N', 'HOR', 'HOF', 'T10', 'T90', 'S40', 'S00']
+    state = {'i': 0}
+
+    def send():
+        state['i'] = (state['i'] + 1) % len(commands)
+        root.send_command(commands[state['i']])
+
+    runner.measure('app.send_command', send, batch=50)
+
+    def steer():
+        state['i'] = (state['i'] + 1) % 100
+        root.send_control('T', state['i'])
+
+    runner.measure('app.send_control', steer, batch=100)
@@ -0,0 +1,43 @@
+"""Layout engine: per-size frame tables and the batch apply pass"""
+from layout_engine import LayoutEngine, LayoutItem, FIT_SQUARE
+
+DESIGN_SIZE = (2340, 1080)
+# همان تعداد و اندازه کنترل‌های صفحه اصلی
+ITEMS = [LayoutItem(f'item{i}', 80 + 100 * i, 160 + 40 * (i % 20), 150, 150, fit=FIT_SQUARE if i == 0 else 'stretch')
+         for i in range(22)]
+ROTATION = [(2340, 1080), (1080, 2340)]
+RESIZE = [(1024 + 8 * i, 600 + 4 * i) for i in range(64)]
+
+
+class _Box:
+    """Stands in for a widget: just pos and size"""
+
+    def __init__(self):
+        self.pos = (0, 0)
+        self.size = (100, 100)
+
+
+def run(runner):
+    state = {'i': 0}
+
+    def next_size(sizes):
+        i = state['i'] = (state['i'] + 1) % len(sizes)
+        return sizes[i]
+
+    # هر رویداد اندازه یک اندازه تازه است (کشیدن لبه پنجره)
+    cold = LayoutEngine(ITEMS, DESIGN_SIZE, cache_size=1)
+    runner.measure('layout.frames.new_size', lambda: cold.layout(next_size(RESIZE)), batch=64)
+
+    # چرخش بین افقی و عمودی: هر دو اندازه در LRU هستند
+    engine = LayoutEngine(ITEMS, DESIGN_SIZE)
+    runner.measure('layout.frames.rotation', lambda: engine.layout(next_size(ROTATION)), batch=200)
+
+    widgets = {item.name: _Box() for item in ITEMS}
+
+    def rotate():
+        _, frames = engine.layout(next_size(ROTATION))
+        engine.apply(widgets, frames)
+
+    runner.measure('layout.apply.rotation', rotate, batch=50)
+    _, frames = engine.layout(ROTATION[0])
+    runner.measure('layout.apply.unchanged', lambda: engine.apply(widgets, frames), batch=200)
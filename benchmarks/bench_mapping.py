@@ -0,0 +1,29 @@
+"""Steering / pedal value mapping"""
+from command_scheduler import split_command
+from steering_curve import SteeringCurve, CURVE_EXPO
+from throttle_engine import ThrottleEngine
+
+
+def run(runner):
+    curve = SteeringCurve(CURVE_EXPO, 0.4, 60)
+    angles = [a / 7.0 for a in range(-630, 631)]
+    state = {'i': 0}
+
+    def next_angle():
+        i = state['i'] = (state['i'] + 1) % len(angles)
+        return angles[i]
+
+    runner.measure('mapping.steering_curve.value', lambda: curve.value(next_angle()), batch=500)
+    runner.measure('mapping.steering_curve.payload', lambda: curve.payload(next_angle()), batch=500)
+    runner.measure('mapping.steering_curve.build', lambda: SteeringCurve(CURVE_EXPO, 0.4, 60), rounds=50)
+
+    engine = ThrottleEngine(acceleration_rate=2.0, deceleration_rate=3.0)
+    engine.set_gear('D')
+
+    def pedal_tick():
+        i = state['i'] = (state['i'] + 1) % 100
+        engine.set_pedal(i)
+        engine.step(0.01)
+
+    runner.measure('mapping.throttle.pedal_step', pedal_tick, batch=500)
+    runner.measure('mapping.split_command', lambda: split_command('T57'), batch=500)
@@ -0,0 +1,77 @@
+"""Command path: scheduler, payload encoding, writer queue and the simulated link"""
+import threading
+import time
+
+from ble_writer import BLEWriter, PRIORITY_CONTINUOUS
+from command_scheduler import CommandScheduler
+from control_frame import VehicleState, encode_frame
+from session_recorder import ReplayPipeline
+from sim_transport import SimTransport, VirtualCar
+from steering_curve import PAYLOAD_BY_TEXT, COMMAND_TEXT
+
+
+def run(runner):
+    # زمان‌بند بدون فرستنده: فقط هزینه ادغام مقدارها
+    scheduler = CommandScheduler(lambda command: True)
+    values = [(channel, v) for v in range(100) for channel in ('T', 'S')]
+    state = {'i': 0}
+
+    def submit_value():
+        i = state['i'] = (state['i'] + 1) % len(values)
+        scheduler.submit_value(*values[i])
+
+    runner.measure('pipeline.scheduler.submit_value', submit_value, batch=200)
+
+    # مسیر کامل تا صف نویسنده (نویسنده اجرا نمی‌شود، کلیدها صف را ثابت نگه می‌دارند)
+    writer = BLEWriter(lambda payload, with_response: True)
+
+    def transmit(command):
+        return writer.submit(PAYLOAD_BY_TEXT[command], PRIORITY_CONTINUOUS, False, command[0], command)
+
+    dispatch = CommandScheduler(transmit)
+
+    def submit_and_flush():
+        i = state['i'] = (state['i'] + 1) % len(values)
+        dispatch.submit_value(*values[i])
+        dispatch.flush()
+
+    runner.measure('pipeline.dispatch.submit_flush', submit_and_flush, batch=100)
+
+    vehicle = VehicleState()
+
+    def frame():
+        vehicle.steering = state['i'] % 100
+        encode_frame(vehicle, state['i'])
+
+    runner.measure('pipeline.encode_frame', frame, batch=200)
+
+    texts = COMMAND_TEXT['T']
+    runner.measure('pipeline.text_payload', lambda: PAYLOAD_BY_TEXT[texts[state['i'] % 100]], batch=500)
+
+    if runner.wants('pipeline.sim_link.write_to_car'):
+        runner.record('pipeline.sim_link.write_to_car', _end_to_end(runner.rounds), unit='submit -> car firmware')
+
+
+def _end_to_end(rounds):
+    """Latency from a T value entering the scheduler to the virtual car parsing it"""
+    car = VirtualCar('Bench_Car', 'BE:NC:H0:00:00:01')
+    pipeline = ReplayPipeline(SimTransport(cars=[car], connect_delay=0.01))
+    if not pipeline.connect(car.address):
+        return []
+
+    arrived = {}
+    done = threading.Event()
+    car.log = lambda line: (arrived.setdefault(line, time.perf_counter()), done.set())
+
+    samples = []
+    for i in range(rounds):
+        command = COMMAND_TEXT['T'][i % 100]
+        arrived.pop(command, None)
+        done.clear()
+        sent = time.perf_counter()
+        pipeline.scheduler.submit_value('T', i % 100)
+        pipeline.scheduler.flush()
+        if done.wait(1.0) and command in arrived:
+            samples.append((arrived[command] - sent) * 1e6)
+    pipeline.close()
+    return samples
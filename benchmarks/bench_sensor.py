@@ -0,0 +1,53 @@
+"""Tilt steering: filter pipeline and the 200 Hz sample ring"""
+import math
+
+from sensor_worker import SampleRing, SensorWorker, SAMPLE_ACCEL
+from settings_schema import build_snapshot
+from steering_filters import SteeringPipeline
+
+RATE_HZ = 200
+
+
+def _samples(n):
+    return [(SAMPLE_ACCEL, 3.0 * math.sin(i / 40.0), 0.2, 9.6, 0.0, i / RATE_HZ) for i in range(n)]
+
+
+def run(runner):
+    controls = build_snapshot('control_settings', {})
+    for name in ('ema', 'one_euro'):
+        accel = build_snapshot('accelerometer_settings', {'steering_filter': name})
+        pipeline = SteeringPipeline.from_settings(controls, accel)
+        samples = _samples(RATE_HZ)
+        state = {'i': 0, 't': 0.0}
+
+        def process():
+            i = state['i'] = (state['i'] + 1) % RATE_HZ
+            state['t'] += 1.0 / RATE_HZ
+            _, x, y, z, _, _ = samples[i]
+            pipeline.process(x, y, z, state['t'])
+
+        runner.measure(f'sensor.pipeline.process.{name}', process, batch=200)
+
+    # یک ثانیه داده 200 هرتز: push روی ترد سنسور، drain در تیک‌های 20 میلی‌ثانیه‌ای worker
+    accel = build_snapshot('accelerometer_settings', {})
+    pipeline = SteeringPipeline.from_settings(controls, accel)
+    ring = SampleRing()
+
+    def process_batch(batch):
+        angle = None
+        for _, x, y, z, _, t in batch:
+            angle = pipeline.process(x, y, z, t)
+        return angle
+
+    worker = SensorWorker(ring, process_batch, lambda angle: None, tick=0.02)
+    second = _samples(RATE_HZ)
+    per_tick = RATE_HZ // 50
+
+    def one_second():
+        for start in range(0, RATE_HZ, per_tick):
+            for sample in second[start:start + per_tick]:
+                ring.push(sample)
+            worker.run_once()
+
+    runner.measure('sensor.ring_worker_200hz.per_sample', one_second, rounds=max(20, runner.rounds // 5),
+                   unit_ops=RATE_HZ)
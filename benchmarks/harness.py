@@ -0,0 +1,134 @@
+import gc
+import json
+import platform
+import subprocess
+import time
+
+from latency_probe import percentile
+
+try:
+    import kivy  # noqa: F401
+    HAS_KIVY = True
+except ImportError:
+    HAS_KIVY = False
+
+
+class Runner:
+    """Times operations and collects per-operation latency percentiles.
+
+    ``measure(name, op)`` calls ``op()`` ``rounds`` times in batches of
+    ``batch`` calls (batching keeps timer overhead out of sub-microsecond
+    operations) and records the per-call time of every batch. The GC is
+    disabled while a batch runs.
+    """
+
+    def __init__(self, rounds=200, warmup=20, name_filter=None, quick=False):
+        self.rounds = max(10, rounds // 10) if quick else rounds
+        self.warmup = warmup
+        self.name_filter = name_filter
+        self.results = {}
+        self.skipped = {}
+
+    def wants(self, name):
+        return not self.name_filter or self.name_filter in name
+
+    def skip(self, name, reason):
+        self.skipped[name] = reason
+        print(f"⏭️ {name}: {reason}")
+
+    def measure(self, name, op, batch=1, rounds=None, unit_ops=1):
+        """Time ``op``; ``unit_ops`` is how many logical operations one call performs"""
+        if not self.wants(name):
+            return None
+        rounds = rounds or self.rounds
+        for _ in range(self.warmup):
+            op()
+
+        samples = []
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for _ in range(rounds):
+                start = time.perf_counter_ns()
+                for _ in range(batch):
+                    op()
+                elapsed = time.perf_counter_ns() - start
+                samples.append(elapsed / 1000.0 / (batch * unit_ops))
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        result = summarize(samples)
+        result['batch'] = batch
+        self.results[name] = result
+        print(f"⏱️ {name}: p50 {result['p50_us']:.2f} µs  p99 {result['p99_us']:.2f} µs  "
+              f"({result['ops_per_s']:.0f} ops/s)")
+        return result
+
+    def record(self, name, samples_us, **extra):
+        """Add externally timed samples (e.g. end-to-end latencies)"""
+        if not self.wants(name) or not samples_us:
+            return None
+        result = summarize(samples_us)
+        result.update(extra)
+        self.results[name] = result
+        print(f"⏱️ {name}: p50 {result['p50_us']:.1f} µs  p99 {result['p99_us']:.1f} µs")
+        return result
+
+    def report(self):
+        return {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'environment': environment(),
+            'results': self.results,
+            'skipped': self.skipped,
+        }
+
+
+def summarize(samples_us):
+    ordered = sorted(samples_us)
+    mean = sum(ordered) / len(ordered)
+    return {
+        'n': len(ordered),
+        'mean_us': mean,
+        'min_us': ordered[0],
+        'p50_us': percentile(ordered, 50),
+        'p95_us': percentile(ordered, 95),
+        'p99_us': percentile(ordered, 99),
+        'max_us': ordered[-1],
+        'ops_per_s': 1e6 / mean if mean > 0 else None,
+    }
+
+
+def environment():
+    env = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'system': platform.system(),
+        'kivy': HAS_KIVY,
+    }
+    try:
+        env['commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                       text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        env['commit'] = None
+    return env
+
+
+def compare(current, baseline, threshold=0.25, metric='p50_us'):
+    """Benchmarks whose ``metric`` got slower than ``baseline`` by more than ``threshold``"""
+    regressions = {}
+    for name, result in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if not old or not old.get(metric):
+            continue
+        ratio = result[metric] / old[metric]
+        if ratio > 1.0 + threshold:
+            regressions[name] = {'baseline': old[metric], 'current': result[metric], 'ratio': ratio}
+    return regressions
+
+
+def write_json(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
@@ -0,0 +1,382 @@
+import heapq
+import threading
+import time
+
+from telemetry import record, EVT_WRITE_ERROR
+
+# اولویت‌ها: عدد کمتر یعنی زودتر ارسال می‌شود
+PRIORITY_SAFETY = 0
+PRIORITY_DISCRETE = 1
+PRIORITY_CONTINUOUS = 2
+
+
+def command_priority(command):
+    """Default priority of a text command: T/S values are continuous, the rest discrete"""
+    if len(command) == 3 and command[0] in 'TS' and command[1:].isdigit():
+        return PRIORITY_CONTINUOUS
+    return PRIORITY_DISCRETE
+
+
+# فاصله اتصال تقریبی اندروید برای هر سطح اولویت (میلی‌ثانیه)
+CONNECTION_INTERVALS_MS = {
+    'high': 15.0,
+    'balanced': 45.0,
+    'low_power': 125.0,
+}
+
+ATT_DEFAULT_MTU = 23
+ATT_HEADER_SIZE = 3
+
+
+class ConnectionParameters:
+    """Link parameters negotiated after connect (MTU, connection priority)"""
+
+    def __init__(self, mtu=ATT_DEFAULT_MTU, priority='balanced'):
+        self.mtu = mtu
+        self.priority = priority
+
+    @property
+    def max_payload(self):
+        """Largest value that fits in a single ATT write"""
+        return self.mtu - ATT_HEADER_SIZE
+
+    @property
+    def interval_ms(self):
+        return CONNECTION_INTERVALS_MS.get(self.priority, CONNECTION_INTERVALS_MS['balanced'])
+
+    def reset(self):
+        self.mtu = ATT_DEFAULT_MTU
+        self.priority = 'balanced'
+
+    def __repr__(self):
+        return f"ConnectionParameters(mtu={self.mtu}, priority={self.priority!r}, interval={self.interval_ms}ms)"
+
+
+class TokenBucket:
+    """Paces write-without-response writes to ``rate`` per second with bursts of ``burst``"""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def delay(self):
+        """Seconds to wait before the next token is available (0 = take it now)"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class _WriteItem:
+    __slots__ = ('priority', 'seq', 'payload', 'with_response', 'key', 'label', 'retries', 'parts')
+
+    def __init__(self, priority, seq, payload, with_response, key, label, retries=0):
+        self.priority = priority
+        self.seq = seq
+        self.payload = payload
+        self.with_response = with_response
+        self.key = key
+        self.label = label
+        self.retries = retries
+        # فرمان‌های جداگانه‌ای که در یک نوشتن بسته‌بندی شده‌اند (برای تلاش دوباره)
+        self.parts = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class BLEWriter:
+    """Owns the GATT write path on a dedicated thread.
+
+    Commands are queued by priority (safety > discrete > continuous) in a
+    bounded queue. Items sharing a ``key`` replace each other in place, so a
+    stale steering value never waits in front of a fresh one. A write with
+    response is not followed by the next write until ``on_write_complete``
+    is called (or ``write_timeout`` expires); writes without response are
+    paced by a token bucket. Safety writes skip the token bucket.
+
+    Queued text commands (newline-terminated) are packed into one write as
+    long as they fit in ``params.max_payload``.
+
+    A write the stack refuses is queued again, up to ``max_retries`` times
+    (safety writes until the queue is cleared), unless a newer item with
+    the same key is already waiting. When a keyed item is finally given up
+    on, ``on_dropped(key)`` is called so the sender can forget that value
+    and send it again.
+
+    ``write_fn(payload, with_response)`` performs the actual write and
+    returns True if the stack accepted it. It is only ever called from the
+    writer thread, and so is ``on_dropped``.
+    """
+
+    def __init__(self, write_fn, max_queue=32, write_timeout=0.5, rate=60, burst=4,
+                 thread_exit_fn=None, params=None, clock=time.monotonic, max_retries=3, on_dropped=None):
+        self.write_fn = write_fn
+        self.max_retries = max_retries
+        self.on_dropped = on_dropped
+        self.params = params or ConnectionParameters()
+        self.max_queue = max_queue
+        self.write_timeout = write_timeout
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.thread_exit_fn = thread_exit_fn
+        self.clock = clock
+        self._heap = []
+        self._keyed = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._write_done = threading.Event()
+        self._write_ok = False
+        self._running = False
+        self._thread = None
+        self._in_flight = False
+        self._busy_since = None
+        # از آخرین نوشتن موفق، نوشتنی رد شده یا بی‌پاسخ مانده است
+        self._failing = False
+        self.last_success = None
+        self.last_safety_write = None
+        self.stats = {
+            'queued': 0,
+            'written': 0,
+            'failed': 0,
+            'retried': 0,
+            'dropped': 0,
+            'timeouts': 0,
+            'coalesced': 0,
+            'evicted': 0,
+            'rejected': 0,
+            'max_depth': 0,
+            'batched': 0,
+            'bytes': 0,
+        }
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='ble-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._write_done.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, payload, priority=PRIORITY_DISCRETE, with_response=False, key=None, label=None):
+        """Queue a write; returns False if the queue is full of more important work"""
+        with self._cond:
+            if key is not None and key in self._keyed:
+                item = self._keyed[key]
+                item.payload = payload
+                item.with_response = with_response
+                item.label = label
+                if priority < item.priority:
+                    item.priority = priority
+                    heapq.heapify(self._heap)
+                self.stats['coalesced'] += 1
+                return True
+
+            if len(self._heap) >= self.max_queue and not self._evict_for(priority):
+                self.stats['rejected'] += 1
+                return False
+
+            if not self._heap and not self._in_flight and not self._failing:
+                self._busy_since = self.clock()
+            self._seq += 1
+            item = _WriteItem(priority, self._seq, payload, with_response, key, label)
+            heapq.heappush(self._heap, item)
+            if key is not None:
+                self._keyed[key] = item
+            self.stats['queued'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], len(self._heap))
+            self._cond.notify()
+            return True
+
+    def _evict_for(self, priority):
+        """Drop the least important queued item to make room; caller holds the lock"""
+        # کم‌اهمیت‌ترین اولویت، و در آن قدیمی‌ترین (کهنه‌ترین) مقدار
+        victim = max(self._heap, key=lambda item: (item.priority, -item.seq))
+        if victim.priority <= priority:
+            return False
+        self._heap.remove(victim)
+        heapq.heapify(self._heap)
+        if victim.key is not None:
+            self._keyed.pop(victim.key, None)
+        self.stats['evicted'] += 1
+        return True
+
+    def clear(self, min_priority=PRIORITY_SAFETY + 1):
+        """Drop queued items at or below ``min_priority`` importance (default: all but safety)"""
+        with self._cond:
+            kept = [item for item in self._heap if item.priority < min_priority]
+            for item in self._heap:
+                if item.priority >= min_priority and item.key is not None:
+                    self._keyed.pop(item.key, None)
+            self._heap = kept
+            heapq.heapify(self._heap)
+        # یک نوشتن در حال انتظار را هم آزاد کن
+        self._write_done.set()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def stalled_for(self):
+        """Seconds the writer has had work without completing a write.
+
+        0 when idle, unless a write failed since the last successful one: a
+        link that refuses every write stays stalled even when the queue
+        drains in between.
+        """
+        with self._cond:
+            if not self._heap and not self._in_flight and not self._failing:
+                return 0.0
+            progress = max(t for t in (self._busy_since, self.last_success, 0.0) if t is not None)
+        return max(0.0, self.clock() - progress)
+
+    def reset_progress(self):
+        """Forget failed writes of a previous link (new connection)"""
+        with self._cond:
+            self._failing = False
+            self._busy_since = None
+
+    def wait_idle(self, timeout=0.2):
+        """Block until the queue is empty and nothing is in flight; returns False on timeout"""
+        deadline = self.clock() + timeout
+        while self.clock() < deadline:
+            with self._cond:
+                if not self._heap and not self._in_flight:
+                    return True
+            time.sleep(0.005)
+        return False
+
+    def on_write_complete(self, success=True):
+        """Called from onCharacteristicWrite"""
+        self._write_ok = success
+        self._write_done.set()
+
+    def _next_item(self):
+        with self._cond:
+            while self._running and not self._heap:
+                self._cond.wait()
+            if not self._running:
+                return None
+            item = self._pop()
+            if item.payload.endswith(b'\n'):
+                self._batch_into(item)
+            self._in_flight = True
+            return item
+
+    def _pop(self):
+        item = heapq.heappop(self._heap)
+        if item.key is not None:
+            self._keyed.pop(item.key, None)
+        return item
+
+    def _batch_into(self, item):
+        """Append following text commands to ``item`` while they fit in one write"""
+        room = self.params.max_payload - len(item.payload)
+        while self._heap:
+            nxt = self._heap[0]
+            if (not nxt.payload.endswith(b'\n') or nxt.with_response != item.with_response
+                    or len(nxt.payload) > room):
+                break
+            self._pop()
+            if item.parts is None:
+                item.parts = [_WriteItem(item.priority, item.seq, item.payload, item.with_response,
+                                         item.key, item.label, item.retries)]
+            item.parts.append(nxt)
+            item.payload += nxt.payload
+            room -= len(nxt.payload)
+            self.stats['batched'] += 1
+
+    def _run(self):
+        try:
+            while True:
+                item = self._next_item()
+                if item is None:
+                    break
+                try:
+                    self._write(item)
+                finally:
+                    self._in_flight = False
+        finally:
+            if self.thread_exit_fn:
+                self.thread_exit_fn()
+
+    def _write(self, item):
+        if not item.with_response and item.priority != PRIORITY_SAFETY:
+            wait = self.bucket.delay()
+            while wait > 0 and self._running:
+                time.sleep(wait)
+                wait = self.bucket.delay()
+
+        self._write_done.clear()
+        self._write_ok = False
+        try:
+            accepted = self.write_fn(item.payload, item.with_response)
+        except Exception:
+            record(EVT_WRITE_ERROR, item.payload[0], len(item.payload))
+            accepted = False
+
+        if not accepted:
+            self.stats['failed'] += 1
+            self._failing = True
+            self._retry(item)
+            return
+
+        if item.with_response:
+            if not self._write_done.wait(self.write_timeout):
+                self.stats['timeouts'] += 1
+                self._failing = True
+                return
+            if not self._write_ok:
+                self.stats['failed'] += 1
+                self._failing = True
+                self._retry(item)
+                return
+        self._failing = False
+        self.last_success = self.clock()
+        if item.priority == PRIORITY_SAFETY:
+            self.last_safety_write = self.last_success
+        self.stats['written'] += 1
+        self.stats['bytes'] += len(item.payload)
+
+    def _retry(self, item):
+        """Queue a refused write again, command by command if it was a batch"""
+        dropped = []
+        with self._cond:
+            for part in item.parts or (item,):
+                if part.key is not None and part.key in self._keyed:
+                    # مقدار تازه‌تری برای همین کلید در صف است
+                    continue
+                retries = part.retries + 1
+                if ((part.priority != PRIORITY_SAFETY and retries > self.max_retries)
+                        or (len(self._heap) >= self.max_queue and not self._evict_for(part.priority))):
+                    self.stats['dropped'] += 1
+                    dropped.append(part.key)
+                    continue
+                retry = _WriteItem(part.priority, part.seq, part.payload, part.with_response,
+                                   part.key, part.label, retries)
+                heapq.heappush(self._heap, retry)
+                if retry.key is not None:
+                    self._keyed[retry.key] = retry
+                self.stats['retried'] += 1
+        if self.on_dropped:
+            for key in dropped:
+                if key is not None:
+                    self.on_dropped(key)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['pending'] = self.pending()
+        return stats
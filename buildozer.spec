@@ -9,6 +9,8 @@ package.domain = ir.bluetoothrc
 source.dir = .
 # فایل اصلی پایتون
 source.main = main.py
+# بنچمارک‌ها فقط روی دسکتاپ/CI اجرا می‌شوند
+source.exclude_dirs = benchmarks
 
 # نسخه اپلیکیشن
 version = 1.0.0
@@ -0,0 +1,150 @@
+import threading
+import time
+
+# کانال‌های پیوسته (فرمان و گاز) که فقط آخرین مقدارشان مهم است
+CONTINUOUS_CHANNELS = ('T', 'S')
+
+# مقدار حالت آزاد هر کانال؛ همیشه ارسال می‌شود حتی داخل باند hysteresis
+CHANNEL_NEUTRAL = {'T': 50, 'S': 0}
+
+
+def split_command(command):
+    """Return (channel, value) for continuous commands like T50 / S07, otherwise None"""
+    if len(command) >= 2 and command[0] in CONTINUOUS_CHANNELS and command[1:].isdigit():
+        return command[0], int(command[1:])
+    return None
+
+
+class CommandScheduler:
+    """Coalesces steering/throttle values and flushes them at a fixed rate.
+
+    Continuous channels (T, S) keep only their latest value until the next
+    flush; discrete commands (gear, lights, horn, ...) bypass the scheduler
+    and are handed to the sender immediately, in the order they arrive.
+
+    Values within ``hysteresis`` of the last value actually sent are
+    suppressed. With ``keepalive`` > 0 the last value of each channel is
+    re-sent whenever the channel has been quiet for that many seconds.
+
+    When ``batch_sender`` is set it receives every flushed channel at once
+    as a ``{channel: value}`` dict (e.g. to pack them into one binary frame).
+    """
+
+    def __init__(self, sender, interval=0.03, hysteresis=0, keepalive=0, clock=time.monotonic):
+        self.sender = sender
+        self.base_interval = interval
+        self.interval = interval
+        self.hysteresis = hysteresis
+        self.keepalive = keepalive
+        self.clock = clock
+        self.batch_sender = None
+        self._pending = {}
+        self._last_sent = {}
+        self._last_sent_time = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'submitted': 0,
+            'discrete': 0,
+            'flushes': 0,
+            'sent': 0,
+            'coalesced': 0,
+            'suppressed': 0,
+            'keepalives': 0,
+            'dropped': 0,
+        }
+
+    def submit(self, command):
+        """Queue a command; returns True if it was accepted"""
+        parsed = split_command(command)
+        if parsed is None:
+            self.stats['discrete'] += 1
+            return self.sender(command)
+        return self.submit_value(*parsed)
+
+    def submit_value(self, channel, value):
+        """Queue a continuous value without building a command string first"""
+        with self._lock:
+            self.stats['submitted'] += 1
+            if self._is_redundant(channel, value):
+                # مقدار جدید عملاً همان مقدار ارسال‌شده است؛ مقدار در صف را هم لغو کن
+                self.stats['suppressed'] += 1
+                if self._pending.pop(channel, None) is not None:
+                    self.stats['coalesced'] += 1
+                return True
+            if channel in self._pending:
+                self.stats['coalesced'] += 1
+            self._pending[channel] = value
+        return True
+
+    def _is_redundant(self, channel, value):
+        last = self._last_sent.get(channel)
+        if last is None:
+            return False
+        if value == last:
+            return True
+        if value == CHANNEL_NEUTRAL.get(channel):
+            return False
+        return abs(value - last) <= self.hysteresis
+
+    def flush(self, *args):
+        """Send the latest value of every channel that changed since the last flush"""
+        now = self.clock()
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            if self.keepalive > 0:
+                for channel, sent_at in self._last_sent_time.items():
+                    if channel not in pending and now - sent_at >= self.keepalive:
+                        pending[channel] = self._last_sent[channel]
+                        self.stats['keepalives'] += 1
+            if not pending:
+                return 0
+            self.stats['flushes'] += 1
+
+        if self.batch_sender is not None:
+            delivered = pending if self.batch_sender(pending) else {}
+        else:
+            delivered = {channel: value for channel, value in pending.items()
+                         if self.sender(f"{channel}{value:02d}")}
+
+        for channel, value in delivered.items():
+            self._last_sent[channel] = value
+            self._last_sent_time[channel] = now
+        sent = len(delivered)
+        self.stats['sent'] += sent
+        self.stats['dropped'] += len(pending) - sent
+        return sent
+
+    def clear(self):
+        """Discard pending values and forget what was sent (e.g. after a disconnect)"""
+        with self._lock:
+            self.stats['dropped'] += len(self._pending)
+            self._pending = {}
+            self._last_sent = {}
+            self._last_sent_time = {}
+
+    def forget(self, channel):
+        """Forget the last value sent on a channel (it never arrived), so it is not suppressed"""
+        with self._lock:
+            self._last_sent.pop(channel, None)
+            self._last_sent_time.pop(channel, None)
+
+    def last_value(self, channel, default=None):
+        """Latest value queued or sent on a channel"""
+        with self._lock:
+            return self._pending.get(channel, self._last_sent.get(channel, default))
+
+    def set_connection_interval(self, interval_ms):
+        """Never flush faster than the link can carry; returns True if the interval changed"""
+        interval = max(self.base_interval, interval_ms / 1000.0)
+        if interval == self.interval:
+            return False
+        self.interval = interval
+        return True
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        total = stats['submitted']
+        stats['coalesce_ratio'] = (stats['coalesced'] / total) if total else 0.0
+        stats['interval'] = self.interval
+        return stats
@@ -0,0 +1,171 @@
+import random
+import time
+from collections import deque
+
+from telemetry import record, EVT_STATE
+
+STATE_IDLE = 'idle'
+STATE_CONNECTING = 'connecting'
+STATE_DISCOVERING = 'discovering'
+STATE_READY = 'ready'
+STATE_BACKOFF = 'backoff'
+
+# ترتیب ثابت؛ ایندکس هر حالت در رکوردهای تله‌متری ذخیره می‌شود
+STATES = (STATE_IDLE, STATE_CONNECTING, STATE_DISCOVERING, STATE_READY, STATE_BACKOFF)
+
+
+class ConnectionManager:
+    """Non-blocking connect/reconnect state machine for one BLE link.
+
+    idle -> connecting -> discovering -> ready
+                 ^              |          |
+                 +-- backoff <--+----------+   (unexpected drop / timeout)
+
+    The transport is driven through two callables: ``open_fn(address,
+    auto_connect)`` starts a connection attempt and returns False if it could
+    not even be started, ``close_fn()`` tears the current attempt down.
+    Timers go through ``schedule_fn(callback, delay)``, which must return an
+    object with ``cancel()`` (a Kivy ClockEvent or a threading.Timer).
+
+    The first attempt is a direct connect; reconnects after a drop use
+    ``auto_connect=True`` so the stack picks the car up as soon as it is
+    back in range. Backoff delays grow exponentially with full jitter.
+    """
+
+    def __init__(self, open_fn, close_fn, schedule_fn, reconnect_attempts=3, connection_timeout=10.0,
+                 backoff_base=0.25, backoff_max=4.0, on_state_change=None, rng=None, clock=time.monotonic):
+        self.open_fn = open_fn
+        self.close_fn = close_fn
+        self.schedule_fn = schedule_fn
+        self.reconnect_attempts = reconnect_attempts
+        self.connection_timeout = connection_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.on_state_change = on_state_change
+        self.rng = rng or random.Random()
+        self.clock = clock
+
+        self.state = STATE_IDLE
+        self.address = None
+        self.attempt = 0
+        self.ever_ready = False
+        self._timer = None
+        self._state_since = clock()
+        self._connect_started = None
+        self._dropped_at = None
+        self.history = deque(maxlen=64)
+        self.timings = {
+            'last_connect_ms': None,
+            'last_reconnect_ms': None,
+            'reconnects': 0,
+            'failures': 0,
+        }
+
+    # --- public API ---
+    def connect(self, address):
+        """User-initiated connect to a new device"""
+        self._cancel_timer()
+        if self.state != STATE_IDLE:
+            self.close_fn()
+        self.address = address
+        self.attempt = 0
+        self.ever_ready = False
+        self._dropped_at = None
+        self._connect_started = self.clock()
+        return self._open(auto_connect=False)
+
+    def disconnect(self):
+        """User-initiated disconnect; no reconnect follows"""
+        self._cancel_timer()
+        self.address = None
+        if self.state != STATE_IDLE:
+            self.close_fn()
+            self._set_state(STATE_IDLE, reason='user')
+
+    def on_connected(self):
+        if self.state != STATE_CONNECTING:
+            return
+        self._set_state(STATE_DISCOVERING)
+        self._arm_timeout()
+
+    def on_ready(self):
+        if self.state not in (STATE_CONNECTING, STATE_DISCOVERING):
+            return
+        self._cancel_timer()
+        now = self.clock()
+        if self._dropped_at is not None:
+            self.timings['last_reconnect_ms'] = (now - self._dropped_at) * 1000.0
+            self.timings['reconnects'] += 1
+            self._dropped_at = None
+        elif self._connect_started is not None:
+            self.timings['last_connect_ms'] = (now - self._connect_started) * 1000.0
+        initial = not self.ever_ready
+        self.ever_ready = True
+        self.attempt = 0
+        self._set_state(STATE_READY, initial=initial)
+
+    def on_disconnected(self):
+        """Link dropped (or an attempt failed) without the user asking for it"""
+        if self.state == STATE_IDLE or self.address is None:
+            return
+        if self.state == STATE_READY:
+            self._dropped_at = self.clock()
+        self._retry_or_give_up('disconnected')
+
+    # --- internals ---
+    def _open(self, auto_connect):
+        self._set_state(STATE_CONNECTING, attempt=self.attempt, auto_connect=auto_connect)
+        try:
+            started = self.open_fn(self.address, auto_connect)
+        except Exception as e:
+            print(f"❌ Connect attempt error: {e}")
+            started = False
+        if not started:
+            self._retry_or_give_up('open_failed')
+            return False
+        self._arm_timeout()
+        return True
+
+    def _arm_timeout(self):
+        self._cancel_timer()
+        self._timer = self.schedule_fn(self._on_timeout, self.connection_timeout)
+
+    def _on_timeout(self, *args):
+        self._timer = None
+        if self.state in (STATE_CONNECTING, STATE_DISCOVERING):
+            self.close_fn()
+            self._retry_or_give_up('timeout')
+
+    def _retry_or_give_up(self, reason):
+        self._cancel_timer()
+        if self.attempt >= self.reconnect_attempts:
+            self.timings['failures'] += 1
+            self.close_fn()
+            self._set_state(STATE_IDLE, reason=reason, failed=True)
+            return
+        self.attempt += 1
+        delay = self.rng.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (self.attempt - 1))))
+        self._set_state(STATE_BACKOFF, reason=reason, attempt=self.attempt, delay=delay)
+        self._timer = self.schedule_fn(self._on_backoff_elapsed, delay)
+
+    def _on_backoff_elapsed(self, *args):
+        self._timer = None
+        if self.state == STATE_BACKOFF and self.address:
+            self.close_fn()
+            self._open(auto_connect=True)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _set_state(self, state, **info):
+        now = self.clock()
+        previous = self.state
+        elapsed_ms = (now - self._state_since) * 1000.0
+        self.state = state
+        self._state_since = now
+        self.history.append({'from': previous, 'to': state, 'elapsed_ms': elapsed_ms, 'at': now, **info})
+        record(EVT_STATE, STATES.index(state), int(elapsed_ms))
+        if self.on_state_change:
+            self.on_state_change(state, info)
@@ -0,0 +1,186 @@
+"""Compact binary control frame, sent next to the text protocol ("T50\\n").
+
+One frame carries the whole vehicle state in a single GATT write:
+
+    byte 0  SYNC (0xA5)
+    byte 1  sequence number (wraps at 256)
+    byte 2  steering 0..99 (50 = centre)
+    byte 3  throttle 0..99
+    byte 4  gear (0 = N, 1 = D, 2 = R)
+    byte 5  light/signal bitfield (FLAG_*)
+    byte 6  CRC-8 (poly 0x07) over bytes 0..5
+
+The firmware advertises support by answering the text probe PROTOCOL_PROBE
+with PROTOCOL_BINARY_REPLY on any notify characteristic.
+"""
+
+FRAME_SYNC = 0xA5
+FRAME_SIZE = 7
+
+PROTOCOL_TEXT = 'text'
+PROTOCOL_BINARY = 'binary'
+PROTOCOL_PROBE = 'BIN?'
+PROTOCOL_BINARY_REPLY = 'BIN1'
+
+GEAR_CODES = {'N': 0, 'D': 1, 'R': 2}
+GEAR_NAMES = {code: name for name, code in GEAR_CODES.items()}
+
+FLAG_LEFT = 0x01
+FLAG_RIGHT = 0x02
+FLAG_HAZARD = 0x04
+FLAG_LIGHT = 0x08
+FLAG_LED = 0x10
+FLAG_RGB = 0x20
+FLAG_HORN = 0x40
+FLAG_LIGHT_HORN = 0x80
+
+SIGNAL_FLAGS = FLAG_LEFT | FLAG_RIGHT | FLAG_HAZARD
+
+# فرمان‌های متنی که با یک بیت روشن/خاموش می‌شوند
+TOGGLE_COMMANDS = {
+    'LIT': FLAG_LIGHT,
+    'LED': FLAG_LED,
+    'RGB': FLAG_RGB,
+    'LHO': FLAG_LIGHT_HORN,
+}
+
+SIGNAL_COMMANDS = {
+    'LTL': FLAG_LEFT,
+    'RTL': FLAG_RIGHT,
+    'ALL': FLAG_HAZARD,
+}
+
+
+def _build_crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+CRC8_TABLE = _build_crc8_table()
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+class VehicleState:
+    """Everything a single frame carries, updated from text commands"""
+
+    __slots__ = ('steering', 'throttle', 'gear', 'flags')
+
+    def __init__(self):
+        self.steering = 50
+        self.throttle = 0
+        self.gear = 'N'
+        self.flags = 0
+
+    def set_channel(self, channel, value):
+        if channel == 'T':
+            self.steering = value
+        elif channel == 'S':
+            self.throttle = value
+
+    def apply_command(self, command):
+        """Mirror a text command into the state; returns False if a frame cannot express it"""
+        if len(command) == 3 and command[0] in 'TS' and command[1:].isdigit():
+            self.set_channel(command[0], int(command[1:]))
+        elif command in GEAR_CODES:
+            self.gear = command
+        elif command in SIGNAL_COMMANDS:
+            flag = SIGNAL_COMMANDS[command]
+            # راهنماها مثل دکمه‌ها رفتار می‌کنند: فشار دوباره خاموش می‌کند
+            self.flags = (self.flags & ~SIGNAL_FLAGS) | (flag & ~self.flags)
+        elif command == 'OFF':
+            self.flags &= ~SIGNAL_FLAGS
+        elif command in TOGGLE_COMMANDS:
+            self.flags ^= TOGGLE_COMMANDS[command]
+        elif command == 'HOR':
+            self.flags |= FLAG_HORN
+        elif command == 'HOF':
+            self.flags &= ~FLAG_HORN
+        else:
+            return False
+        return True
+
+
+def encode_frame(state, seq):
+    frame = bytearray(FRAME_SIZE)
+    frame[0] = FRAME_SYNC
+    frame[1] = seq & 0xFF
+    frame[2] = max(0, min(99, state.steering))
+    frame[3] = max(0, min(99, state.throttle))
+    frame[4] = GEAR_CODES.get(state.gear, 0)
+    frame[5] = state.flags & 0xFF
+    frame[6] = crc8(frame[:6])
+    return bytes(frame)
+
+
+def decode_frame(data):
+    """Decode one frame into a dict; raises ValueError on a malformed frame"""
+    if len(data) != FRAME_SIZE:
+        raise ValueError(f"frame must be {FRAME_SIZE} bytes, got {len(data)}")
+    if data[0] != FRAME_SYNC:
+        raise ValueError(f"bad sync byte 0x{data[0]:02x}")
+    if crc8(data[:6]) != data[6]:
+        raise ValueError("checksum mismatch")
+    if data[4] not in GEAR_NAMES:
+        raise ValueError(f"unknown gear code {data[4]}")
+    return {
+        'seq': data[1],
+        'steering': data[2],
+        'throttle': data[3],
+        'gear': GEAR_NAMES[data[4]],
+        'flags': data[5],
+    }
+
+
+class FrameDecoder:
+    """Reference stream decoder for the firmware side.
+
+    Accepts arbitrary chunks (a GATT write may be split or merged by the
+    stack), resynchronises on SYNC after garbage and counts checksum errors
+    and sequence gaps.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.last_seq = None
+        self.frames = 0
+        self.errors = 0
+        self.lost = 0
+
+    def feed(self, chunk):
+        """Consume bytes and return the list of frames decoded from them"""
+        self._buffer.extend(chunk)
+        frames = []
+        while True:
+            start = self._buffer.find(FRAME_SYNC)
+            if start < 0:
+                self._buffer.clear()
+                break
+            if start:
+                del self._buffer[:start]
+            if len(self._buffer) < FRAME_SIZE:
+                break
+            try:
+                frame = decode_frame(bytes(self._buffer[:FRAME_SIZE]))
+            except ValueError:
+                # بایت SYNC جعلی بود؛ یک بایت جلو برو و دوباره همگام شو
+                self.errors += 1
+                del self._buffer[:1]
+                continue
+            del self._buffer[:FRAME_SIZE]
+            if self.last_seq is not None:
+                self.lost += (frame['seq'] - self.last_seq - 1) & 0xFF
+            self.last_seq = frame['seq']
+            self.frames += 1
+            frames.append(frame)
+        return frames
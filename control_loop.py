@@ -0,0 +1,126 @@
+import threading
+import time
+
+from telemetry import record, EVT_LOOP_ERROR
+
+
+class ControlLoop:
+    """Runs ``step_fn(dt)`` at a fixed rate on its own thread.
+
+    Ticks are scheduled against absolute deadlines, so a slow tick does not
+    shift every following one. A tick whose step takes longer than the
+    period counts as an overrun; when the loop falls a whole period behind,
+    the missed ticks are skipped (and counted) instead of being run back to
+    back.
+    """
+
+    def __init__(self, step_fn, rate_hz=33.0, thread_exit_fn=None, clock=time.perf_counter):
+        self.step_fn = step_fn
+        self.thread_exit_fn = thread_exit_fn
+        self.clock = clock
+        self.period = 1.0 / rate_hz
+        self._running = False
+        self._wake = threading.Event()
+        self._thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            'ticks': 0,
+            'overruns': 0,
+            'missed': 0,
+            'errors': 0,
+            'step_total': 0.0,
+            'step_max': 0.0,
+            'jitter_total': 0.0,
+            'jitter_max': 0.0,
+        }
+
+    @property
+    def rate_hz(self):
+        return 1.0 / self.period
+
+    @property
+    def running(self):
+        return self._running
+
+    def set_rate(self, rate_hz):
+        """Takes effect from the next tick"""
+        self.period = 1.0 / rate_hz
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, name='control-loop', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        self._wake.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        try:
+            last = self.clock()
+            deadline = last + self.period
+            while self._running:
+                delay = deadline - self.clock()
+                if delay > 0:
+                    self._wake.wait(delay)
+                    if not self._running:
+                        break
+
+                start = self.clock()
+                jitter = start - deadline
+                dt = start - last
+                last = start
+                self._tick(dt, jitter)
+
+                deadline += self.period
+                now = self.clock()
+                if now - deadline > self.period:
+                    # بیش از یک دوره عقب هستیم؛ تیک‌های جاافتاده را اجرا نکن
+                    missed = int((now - deadline) / self.period)
+                    self.stats['missed'] += missed
+                    deadline += missed * self.period
+        finally:
+            if self.thread_exit_fn:
+                self.thread_exit_fn()
+
+    def _tick(self, dt, jitter):
+        start = self.clock()
+        try:
+            self.step_fn(dt)
+        except Exception:
+            self.stats['errors'] += 1
+            record(EVT_LOOP_ERROR, value=self.stats['errors'])
+        duration = self.clock() - start
+
+        stats = self.stats
+        stats['ticks'] += 1
+        stats['step_total'] += duration
+        stats['step_max'] = max(stats['step_max'], duration)
+        stats['jitter_total'] += abs(jitter)
+        stats['jitter_max'] = max(stats['jitter_max'], abs(jitter))
+        if duration > self.period:
+            stats['overruns'] += 1
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        ticks = stats['ticks']
+        stats['rate_hz'] = self.rate_hz
+        stats['period_ms'] = self.period * 1000.0
+        stats['step_mean_ms'] = (stats.pop('step_total') / ticks * 1000.0) if ticks else 0.0
+        stats['step_max_ms'] = stats.pop('step_max') * 1000.0
+        stats['jitter_mean_ms'] = (stats.pop('jitter_total') / ticks * 1000.0) if ticks else 0.0
+        stats['jitter_max_ms'] = stats.pop('jitter_max') * 1000.0
+        return stats
+
+    def summary(self):
+        stats = self.get_stats()
+        return (f"Loop: {stats['rate_hz']:.0f} Hz  step {stats['step_mean_ms']:.2f}/{stats['step_max_ms']:.2f} ms"
+                f"  jitter {stats['jitter_mean_ms']:.2f} ms  overruns {stats['overruns']}  missed {stats['missed']}")
@@ -0,0 +1,107 @@
+import time
+from collections import deque
+
+from latency_probe import percentile
+
+# فرمان ضربان قلب؛ فریمور اگر در مهلت خودش آن را نگیرد باید خودرو را متوقف کند
+HEARTBEAT_COMMAND = 'HB'
+
+TRIP_STALL = 'stall'
+TRIP_NOTIFY = 'notify'
+TRIP_DISCONNECT = 'disconnect'
+TRIP_PAUSE = 'pause'
+TRIP_MANUAL = 'manual'
+
+
+class Failsafe:
+    """Heartbeat sender and stall watchdog for the active link.
+
+    ``tick(connected, stalled_for, notify_age)`` is called on every control
+    loop tick. It sends a heartbeat every ``heartbeat_interval`` seconds
+    and trips when the writer has had work without progress for
+    ``stall_timeout`` seconds, or when no notification arrived for
+    ``notify_timeout`` seconds (0 disables either check). Tripping calls
+    ``stop_fn(reason)``, which must put a stop on the radio at safety
+    priority. The time from trip to the stop actually being written is
+    measured through ``stop_written_at()``, the writer's last safety
+    write timestamp.
+    """
+
+    def __init__(self, stop_fn, heartbeat_fn, stop_written_at, heartbeat_interval=0.25,
+                 stall_timeout=0.5, notify_timeout=0.0, window=64, clock=time.monotonic):
+        self.stop_fn = stop_fn
+        self.heartbeat_fn = heartbeat_fn
+        self.stop_written_at = stop_written_at
+        self.heartbeat_interval = heartbeat_interval
+        self.stall_timeout = stall_timeout
+        self.notify_timeout = notify_timeout
+        self.clock = clock
+        self.tripped = None
+        self._last_heartbeat = 0.0
+        self._stop_pending_since = None
+        self.stop_latencies = deque(maxlen=window)
+        self.trips = {}
+        self.heartbeats = 0
+
+    @classmethod
+    def from_settings(cls, safety, stop_fn, heartbeat_fn, stop_written_at):
+        """Build from a safety_settings snapshot"""
+        failsafe = cls(stop_fn, heartbeat_fn, stop_written_at)
+        failsafe.apply_settings(safety)
+        return failsafe
+
+    def apply_settings(self, safety):
+        self.heartbeat_interval = safety.heartbeat_interval
+        self.stall_timeout = safety.stall_timeout
+        self.notify_timeout = safety.notify_timeout
+
+    def tick(self, connected, stalled_for, notify_age=None):
+        now = self.clock()
+        self._check_stop_written()
+        if not connected:
+            return
+
+        if self.tripped is None:
+            if self.stall_timeout > 0 and stalled_for > self.stall_timeout:
+                self.trip(TRIP_STALL)
+            elif self.notify_timeout > 0 and notify_age is not None and notify_age > self.notify_timeout:
+                self.trip(TRIP_NOTIFY)
+        elif stalled_for == 0 and (not self.notify_timeout or notify_age is None or notify_age <= self.notify_timeout):
+            # شرط خطا برطرف شد؛ خودرو متوقف مانده تا راننده دوباره گاز بدهد
+            print(f"✅ Failsafe re-armed after {self.tripped}")
+            self.tripped = None
+
+        if self.heartbeat_interval > 0 and now - self._last_heartbeat >= self.heartbeat_interval:
+            self._last_heartbeat = now
+            self.heartbeats += 1
+            self.heartbeat_fn()
+
+    def trip(self, reason):
+        """Stop the car now; safe to call from any thread"""
+        self.tripped = reason
+        self.trips[reason] = self.trips.get(reason, 0) + 1
+        self._stop_pending_since = self.clock()
+        print(f"🛑 Failsafe stop: {reason}")
+        self.stop_fn(reason)
+
+    def _check_stop_written(self):
+        since = self._stop_pending_since
+        if since is None:
+            return
+        written = self.stop_written_at()
+        if written is not None and written >= since:
+            self.stop_latencies.append((written - since) * 1000.0)
+            self._stop_pending_since = None
+
+    def get_stats(self):
+        self._check_stop_written()
+        ordered = sorted(self.stop_latencies)
+        return {
+            'tripped': self.tripped,
+            'trips': dict(self.trips),
+            'heartbeats': self.heartbeats,
+            'stops_measured': len(ordered),
+            'stop_last_ms': self.stop_latencies[-1] if self.stop_latencies else None,
+            'stop_p50_ms': percentile(ordered, 50),
+            'stop_max_ms': ordered[-1] if ordered else None,
+        }
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+
+from kivy.storage.jsonstore import JsonStore
+
+
+def layout_hash(service_uuids):
+    """Short fingerprint of a device's service layout"""
+    joined = '|'.join(sorted(uuid.lower() for uuid in service_uuids))
+    return hashlib.sha1(joined.encode('utf-8')).hexdigest()[:16]
+
+
+class GattCache:
+    """Remembers the chosen characteristics of each device, keyed by address.
+
+    An entry looks like::
+
+        {
+            'layout': '<layout_hash of the service UUIDs>',
+            'write': [service_uuid, char_uuid],
+            'battery': [service_uuid, char_uuid] or None,
+            'notify': [[service_uuid, char_uuid], ...],
+        }
+
+    One instance is shared by every link of the vehicle pool: each
+    JsonStore keeps its own copy of the file and rewrites all of it on
+    ``put``, so two stores on the same path would erase each other's cars.
+    """
+
+    def __init__(self, path='ble_gatt_cache.json'):
+        self.store = JsonStore(path)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(address):
+        return address.upper().replace(':', '')
+
+    def get(self, address):
+        try:
+            key = self._key(address)
+            with self._lock:
+                if self.store.exists(key):
+                    return self.store.get(key)
+        except Exception as e:
+            print(f"❌ GATT cache read error for {address}: {e}")
+        return None
+
+    def put(self, address, layout, write, battery=None, notify=()):
+        try:
+            with self._lock:
+                self.store.put(
+                    self._key(address),
+                    layout=layout,
+                    write=list(write),
+                    battery=list(battery) if battery else None,
+                    notify=[list(pair) for pair in notify]
+                )
+        except Exception as e:
+            print(f"❌ GATT cache write error for {address}: {e}")
+
+    def invalidate(self, address):
+        try:
+            key = self._key(address)
+            with self._lock:
+                if not self.store.exists(key):
+                    return
+                self.store.delete(key)
+            print(f"🗑️ GATT cache invalidated for {address}")
+        except Exception as e:
+            print(f"❌ GATT cache delete error for {address}: {e}")
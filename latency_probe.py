@@ -0,0 +1,146 @@
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+
+# فرمان پینگ: PNG<seq>:<timestamp_us> ؛ فریمور باید همان متن را از طریق notify برگرداند
+PING_PREFIX = 'PNG'
+
+HISTOGRAM_EDGES_MS = (5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+class LatencyProbe:
+    """Matches timestamped ping commands with their echoes and keeps rolling RTT stats"""
+
+    def __init__(self, send_fn, window=256, timeout=1.0, clock=time.perf_counter):
+        self.send_fn = send_fn
+        self.timeout = timeout
+        self.clock = clock
+        self.samples = deque(maxlen=window)
+        self._outstanding = {}
+        self._origin = clock()
+        self._seq = 0
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.late = 0
+
+    def send_ping(self, *args):
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            self._seq = (self._seq + 1) % 10000
+            seq = self._seq
+            self._outstanding[seq] = now
+            self.sent += 1
+        timestamp_us = int((now - self._origin) * 1e6)
+        return self.send_fn(f"{PING_PREFIX}{seq:04d}:{timestamp_us}")
+
+    def on_echo(self, text):
+        """Feed a notification; returns the RTT in ms if it answered an outstanding ping"""
+        now = self.clock()
+        if not text.startswith(PING_PREFIX):
+            return None
+        try:
+            seq = int(text[len(PING_PREFIX):].split(':', 1)[0])
+        except ValueError:
+            return None
+        with self._lock:
+            sent_at = self._outstanding.pop(seq, None)
+            if sent_at is None:
+                # جواب بعد از timeout رسید و قبلاً گم‌شده حساب شده
+                self.late += 1
+                return None
+            rtt_ms = (now - sent_at) * 1000.0
+            self.samples.append(rtt_ms)
+            self.received += 1
+        return rtt_ms
+
+    def _expire(self, now):
+        expired = [seq for seq, sent_at in self._outstanding.items() if now - sent_at > self.timeout]
+        for seq in expired:
+            del self._outstanding[seq]
+        self.lost += len(expired)
+
+    def get_stats(self):
+        with self._lock:
+            self._expire(self.clock())
+            samples = list(self.samples)
+            lost = self.lost
+            sent = self.sent
+
+        ordered = sorted(samples)
+        jitter = 0.0
+        if len(samples) > 1:
+            jitter = sum(abs(b - a) for a, b in zip(samples, samples[1:])) / (len(samples) - 1)
+
+        histogram = [0] * (len(HISTOGRAM_EDGES_MS) + 1)
+        for rtt in samples:
+            bucket = 0
+            while bucket < len(HISTOGRAM_EDGES_MS) and rtt > HISTOGRAM_EDGES_MS[bucket]:
+                bucket += 1
+            histogram[bucket] += 1
+
+        return {
+            'sent': sent,
+            'received': self.received,
+            'lost': lost,
+            'late': self.late,
+            'loss_rate': (lost / sent) if sent else 0.0,
+            'count': len(samples),
+            'min': ordered[0] if ordered else None,
+            'max': ordered[-1] if ordered else None,
+            'mean': (sum(samples) / len(samples)) if samples else None,
+            'p50': percentile(ordered, 50),
+            'p95': percentile(ordered, 95),
+            'p99': percentile(ordered, 99),
+            'jitter': jitter,
+            'histogram_edges_ms': list(HISTOGRAM_EDGES_MS),
+            'histogram': histogram,
+        }
+
+    def summary(self):
+        stats = self.get_stats()
+        if not stats['count']:
+            return f"RTT: waiting... (sent {stats['sent']}, lost {stats['lost']})"
+        return (f"RTT p50 {stats['p50']:.1f} / p95 {stats['p95']:.1f} / p99 {stats['p99']:.1f} ms"
+                f"  jitter {stats['jitter']:.1f} ms  loss {stats['loss_rate'] * 100:.1f}%")
+
+    def export(self, path, extra=None):
+        """Write stats and raw samples as JSON"""
+        data = {
+            'exported_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'stats': self.get_stats(),
+            'samples_ms': list(self.samples),
+        }
+        if extra:
+            data.update(extra)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+        return path
+
+
+class SimulatedLinkModel:
+    """Fake latency/loss for the desktop path: delay() returns seconds, or None if the packet is lost"""
+
+    def __init__(self, latency_ms=20.0, jitter_ms=5.0, loss_rate=0.0, rng=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.loss_rate = loss_rate
+        self.rng = rng or random.Random()
+
+    def delay(self):
+        if self.rng.random() < self.loss_rate:
+            return None
+        return max(0.0, self.rng.gauss(self.latency_ms, self.jitter_ms)) / 1000.0
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+
+# نحوه جا دادن مستطیل طراحی در پنجره
+FIT_STRETCH = 'stretch'
+FIT_SQUARE = 'square'
+
+
+class LayoutItem:
+    """One control on the design canvas (Figma coordinates, y measured from the top).
+
+    ``kind`` picks the widget factory and ``options`` are passed to it, so a
+    new control is one entry in the layout table rather than another branch.
+    """
+
+    __slots__ = ('name', 'x', 'y', 'w', 'h', 'src', 'kind', 'fit', 'options')
+
+    def __init__(self, name, x, y, w, h, src='', kind='image', fit=FIT_STRETCH, **options):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.src = src
+        self.kind = kind
+        self.fit = fit
+        self.options = options
+
+
+class Transform:
+    """Uniform scale plus letterbox margins that fit the design canvas into one window size"""
+
+    __slots__ = ('scale', 'margin_x', 'margin_y', 'inset', 'design_height')
+
+    def __init__(self, scale, margin_x, margin_y, inset, design_height):
+        self.scale = scale
+        self.margin_x = margin_x
+        self.margin_y = margin_y
+        self.inset = inset
+        self.design_height = design_height
+
+    def place(self, item):
+        """(pos, size) of ``item`` in window pixels, origin bottom-left"""
+        s = self.scale
+        x = item.x * s + self.margin_x
+        y = (self.design_height - (item.y + item.h)) * s + self.margin_y
+        w = item.w * s
+        h = item.h * s
+        if item.fit == FIT_SQUARE:
+            side = min(w, h)
+            x += (w - side) / 2
+            y += (h - side) / 2
+            w = h = side
+        return (x, y), (w, h)
+
+
+class LayoutEngine:
+    """Places design-canvas items for a window size, one precomputed frame table per size.
+
+    ``layout(size)`` returns the transform and ``{name: (pos, size)}`` for
+    every item. Both are kept in a small LRU, so the burst of size events
+    during a resize, or rotating back and forth, is a dict lookup.
+    ``apply`` then writes every widget in a single pass and only touches
+    values that actually changed.
+    """
+
+    def __init__(self, items, design_size, safe_area=0.0, cache_size=4):
+        self.items = tuple(items)
+        self.design_width, self.design_height = design_size
+        # سهم بالا و پایین پنجره که برای نوار وضعیت/ناوبری خالی می‌ماند
+        self.safe_area = safe_area
+        self.cache_size = max(1, cache_size)
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def transform(self, window_size):
+        win_w, win_h = window_size
+        inset = max(0, win_h * self.safe_area)
+        usable_height = win_h - 2 * inset
+
+        if win_w / max(1, win_h) > self.design_width / self.design_height:
+            scale = usable_height / self.design_height
+            return Transform(scale, (win_w - self.design_width * scale) / 2, inset, inset, self.design_height)
+        scale = win_w / self.design_width
+        return Transform(scale, 0, (win_h - self.design_height * scale) / 2, inset, self.design_height)
+
+    def layout(self, window_size):
+        """(transform, frames) for ``window_size``, from the LRU when possible"""
+        key = (window_size[0], window_size[1])
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        transform = self.transform(key)
+        cached = (transform, {item.name: transform.place(item) for item in self.items})
+        self._cache[key] = cached
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return cached
+
+    def apply(self, widgets, frames):
+        """Move and resize ``widgets`` (name -> widget) to ``frames``; returns how many changed"""
+        changed = 0
+        for name, widget in widgets.items():
+            frame = frames.get(name)
+            if frame is None:
+                continue
+            pos, size = frame
+            moved = False
+            if tuple(widget.size) != size:
+                widget.size = size
+                moved = True
+            if tuple(widget.pos) != pos:
+                widget.pos = pos
+                moved = True
+            changed += moved
+        return changed
+
+    def clear(self):
+        self._cache.clear()
+
+    def get_stats(self):
+        return {
+            'items': len(self.items),
+            'cached_sizes': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
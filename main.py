@@ -1,19 +1,17 @@
+# مبدأ زمان‌سنجی راه‌اندازی؛ قبل از هر ایمپورت Kivy
+from startup_timeline import (get_timeline, mark_startup, STAGE_IMPORT, STAGE_BUILD, STAGE_FIRST_FRAME,
+                              STAGE_BLE_READY, STAGE_CONNECTED)
+
 from kivy.app import App
 from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.gridlayout import GridLayout
-from kivy.uix.scrollview import ScrollView
 from kivy.uix.image import Image
 from kivy.uix.label import Label
-from kivy.uix.togglebutton import ToggleButton
-from kivy.uix.popup import Popup
-from kivy.uix.button import Button
-from kivy.uix.slider import Slider
 from kivy.uix.behaviors import ButtonBehavior
 from kivy.uix.widget import Widget
-from kivy.properties import StringProperty, NumericProperty, ObjectProperty, ListProperty, BooleanProperty
+from kivy.properties import StringProperty, NumericProperty, ObjectProperty, BooleanProperty
 from kivy.clock import Clock
-from kivy.graphics import Color, Rectangle, Rotate, PushMatrix, PopMatrix, Line
+from kivy.graphics import Color, Rectangle, Rotate, PushMatrix, PopMatrix
 from kivy.core.window import Window
 from kivy.config import Config
 
@@ -22,6 +20,7 @@ import threading
 import time
 import math
 import random
+from functools import partial
 
 # تنظیمات اولیه
 Config.set('graphics', 'resizable', '1')
@@ -30,69 +29,46 @@ Config.set('graphics', 'height', '600')
 Window.clearcolor = (1, 1, 1, 1)
 
 # ایمپورت مدیریت تنظیمات
-from kivy.storage.jsonstore import JsonStore
+from settings_manager import SettingsManager, get_setting, set_setting, get_snapshot, subscribe_settings
+
+from command_scheduler import CommandScheduler, split_command, CONTINUOUS_CHANNELS
+from ble_writer import (BLEWriter, ConnectionParameters, command_priority,
+                        PRIORITY_SAFETY, PRIORITY_DISCRETE, PRIORITY_CONTINUOUS)
+from connection_manager import (ConnectionManager, STATE_IDLE, STATE_CONNECTING,
+                                STATE_DISCOVERING, STATE_READY, STATE_BACKOFF)
+from gatt_cache import GattCache, layout_hash
+from vehicle_pool import VehiclePool, ALL_STOP_COMMANDS
+from latency_probe import LatencyProbe, PING_PREFIX
+from sim_transport import SimTransport
+from session_recorder import (get_recorder, record_input, record_button, record_command, Session, SessionReplay,
+                              ReplayPipeline,
+                              REC_STEER, REC_PEDAL, REC_ACCEL, REC_ROTATION, REC_BUTTON,
+                              PHASE_DOWN, PHASE_MOVE, PHASE_UP)
+from telemetry import (get_telemetry, record, EVT_WRITE, EVT_WRITE_ERROR, EVT_COMMAND, EVT_NOT_CONNECTED,
+                       EVT_QUEUE_FULL, EVT_NOTIFY, EVT_BATTERY, EVT_SENSOR_ERROR)
+from steering_filters import SteeringPipeline, calibration_offsets
+from steering_curve import SteeringCurve, COMMAND_TEXT, PAYLOAD_BY_TEXT
+from layout_engine import LayoutEngine, LayoutItem, FIT_SQUARE
+from throttle_engine import ThrottleEngine
+from control_loop import ControlLoop
+from failsafe import Failsafe, HEARTBEAT_COMMAND, TRIP_DISCONNECT, TRIP_PAUSE
+from sensor_worker import SampleRing, SensorWorker, SAMPLE_ACCEL, SAMPLE_ROTATION, sensor_timing
+from control_frame import (VehicleState, encode_frame, PROTOCOL_TEXT, PROTOCOL_BINARY,
+                           PROTOCOL_PROBE, PROTOCOL_BINARY_REPLY)
+
+PAYLOAD_HEARTBEAT = (HEARTBEAT_COMMAND + '\n').encode('utf-8')
 
 # Try to import jnius / android API
 HAS_ANDROID = False
 try:
     from jnius import autoclass, cast, PythonJavaClass, java_method
+    from jnius import detach as jnius_detach
     from android.permissions import request_permissions, Permission, check_permission
     HAS_ANDROID = True
 except Exception as e:
     HAS_ANDROID = False
     print(f"Android components not available: {e}")
 
-class SettingsManager:
-    def __init__(self):
-        self.store = JsonStore('rc_car_settings.json')
-    
-    def get(self, key, default=None):
-        try:
-            if self.store.exists(key):
-                return self.store.get(key).get('value', default)
-            return default
-        except Exception as e:
-            print(f"❌ Settings read error for {key}: {e}")
-            return default
-    
-    def set(self, key, value):
-        self.store.put(key, value=value)
-    
-    def get_all_settings(self):
-        """دریافت تمام تنظیمات"""
-        settings = {}
-        for key in self.store.keys():
-            settings[key] = self.get(key)
-        return settings
-    
-    def reset_to_defaults(self):
-        """بازنشانی تمام تنظیمات به حالت پیش‌فرض"""
-        default_settings = {
-            'sensitivity': 1.0,
-            'auto_connect': True,
-            'steering_sensitivity': 1.0,
-            'battery_warning_level': 20,
-            'last_connected_device': ''
-        }
-        
-        for key, value in default_settings.items():
-            self.set(key, value)
-        
-        print("✅ All settings reset to default")
-        return default_settings
-
-# دسترسی سریع به تنظیمات
-def get_setting(key, default=None):
-    app = App.get_running_app()
-    if hasattr(app, 'settings_manager'):
-        return app.settings_manager.get(key, default)
-    return default
-
-def set_setting(key, value):
-    app = App.get_running_app()
-    if hasattr(app, 'settings_manager'):
-        app.settings_manager.set(key, value)
-
 # تابع برای تنظیم سایز کامل صفحه
 def setup_fullscreen():
     try:
@@ -104,32 +80,22 @@ def setup_fullscreen():
         else:
             Window.maximize()
         
-        def update_size(dt):
-            actual_width, actual_height = Window.size
-            print(f"📱 Final Window size: {actual_width}x{actual_height}")
-            
-        Clock.schedule_once(update_size, 1.0)
-        
     except Exception as e:
         print(f"Fullscreen setup error: {e}")
 
-# اجرای تنظیمات فول اسکرین
-Clock.schedule_once(lambda dt: setup_fullscreen(), 0.5)
-
-if HAS_ANDROID:
-    # تنظیم landscape
-    def set_landscape():
-        try:
-            PythonActivity = autoclass('org.kivy.android.PythonActivity')
-            ActivityInfo = autoclass('android.content.pm.ActivityInfo')
-            
-            current_activity = PythonActivity.mActivity
-            current_activity.setRequestedOrientation(ActivityInfo.SCREEN_ORIENTATION_LANDSCAPE)
-            print("✅ Orientation set to landscape")
-        except Exception as e:
-            print(f"Orientation error: {e}")
-    
-    Clock.schedule_once(lambda dt: set_landscape(), 1)
+# تنظیم landscape (فقط اندروید)
+def set_landscape():
+    if not HAS_ANDROID:
+        return
+    try:
+        PythonActivity = autoclass('org.kivy.android.PythonActivity')
+        ActivityInfo = autoclass('android.content.pm.ActivityInfo')
+        
+        current_activity = PythonActivity.mActivity
+        current_activity.setRequestedOrientation(ActivityInfo.SCREEN_ORIENTATION_LANDSCAPE)
+        print("✅ Orientation set to landscape")
+    except Exception as e:
+        print(f"Orientation error: {e}")
 
 # --- Android / BLE / Accelerometer support ---
 if HAS_ANDROID:
@@ -159,9 +125,12 @@ if HAS_ANDROID:
     class AccelerometerEventListener(PythonJavaClass):
         __javainterfaces__ = ['android/hardware/SensorEventListener']
         
-        def __init__(self, callback):
+        def __init__(self, callback, rotation_callback=None, rotation_type=None):
             super().__init__()
             self.callback = callback
+            self.rotation_callback = rotation_callback
+            self.rotation_type = rotation_type
+            self.errors = 0
 
         @java_method('(Landroid/hardware/SensorEvent;)V')
         def onSensorChanged(self, event):
@@ -170,9 +139,14 @@ if HAS_ANDROID:
                 x = float(values[0])
                 y = float(values[1])
                 z = float(values[2])
+                if self.rotation_callback and event.sensor.getType() == self.rotation_type:
+                    w = float(values[3]) if len(values) > 3 else math.sqrt(max(0.0, 1.0 - x*x - y*y - z*z))
+                    self.rotation_callback(x, y, z, w)
+                    return
                 self.callback(x, y, z)
-            except Exception as e:
-                print(f"Sensor data error: {e}")
+            except Exception:
+                self.errors += 1
+                record(EVT_SENSOR_ERROR, value=self.errors)
 
         @java_method('(Landroid/hardware/Sensor;I)V')
         def onAccuracyChanged(self, sensor, accuracy):
@@ -182,16 +156,25 @@ class AccelerometerManager:
     def __init__(self):
         self.sensor_manager = None
         self.accelerometer = None
+        self.rotation_sensor = None
+        self.rotation_type = None
         self.listener = None
         self.is_active = False
         self.accel_values = [0, 0, 0]
         self.steering_angle = 0
         self.controller = None
-        self.sensitivity = get_setting('sensitivity', 1.0)
+        # اسنپ‌شات تنظیمات کنترل؛ مسیر سنسور فقط همین را می‌خواند
+        self.controls = subscribe_settings('control_settings', self._on_controls_changed)
+        self.accel_settings = subscribe_settings('accelerometer_settings', self._on_accel_settings_changed)
+        self.pipeline = SteeringPipeline.from_settings(self.controls, self.accel_settings)
+        # کالبک سنسور فقط نمونه را در حلقه می‌گذارد؛ محاسبه در رشته worker با تیک ثابت
+        self.ring = SampleRing()
+        self.timing = sensor_timing(self.accel_settings)
+        self.worker = SensorWorker(self.ring, self._process_batch, self._publish_angle, tick=self.timing[2])
         self._simulate_event = None
-        
-        if HAS_ANDROID:
-            self.initialize_sensor()
+        Window.bind(size=self._on_window_size)
+        self._on_window_size(Window, Window.size)
+        # سنسورها در اولین start() ساخته می‌شوند تا راه‌اندازی برنامه منتظر آن‌ها نماند
 
     def initialize_sensor(self):
         """Initialize sensor components with correct context"""
@@ -211,6 +194,12 @@ class AccelerometerManager:
             if not self.accelerometer:
                 print("❌ Accelerometer not available on this device")
                 return False
+
+            # سنسور چرخش بدون مغناطیس‌سنج برای فیلتر مکمل (اختیاری)
+            self.rotation_type = Sensor.TYPE_GAME_ROTATION_VECTOR
+            self.rotation_sensor = self.sensor_manager.getDefaultSensor(self.rotation_type)
+            if not self.rotation_sensor:
+                print("⚠️ Game rotation vector not available; accelerometer only")
                 
             print("✅ Accelerometer initialized successfully")
             return True
@@ -222,7 +211,10 @@ class AccelerometerManager:
         """Start accelerometer with fresh listener each time"""
         if not HAS_ANDROID:
             self.is_active = True
-            self._simulate_event = Clock.schedule_interval(self._simulate_accelerometer, 0.1)
+            self.pipeline.reset()
+            self.worker.start()
+            period_us = self.timing[0]
+            self._simulate_event = Clock.schedule_interval(self._simulate_accelerometer, max(0.005, period_us / 1e6))
             print("✅ Accelerometer simulation started")
             return True
             
@@ -231,18 +223,37 @@ class AccelerometerManager:
                 if not self.initialize_sensor():
                     return False
 
-            self.listener = AccelerometerEventListener(self.update_values)
+            use_rotation = self.accel_settings.use_rotation_vector and self.rotation_sensor is not None
+            self.listener = AccelerometerEventListener(
+                self.update_values,
+                self.update_rotation if use_rotation else None,
+                self.rotation_type
+            )
+            self.pipeline.reset()
             
-            SensorManager = autoclass('android.hardware.SensorManager')
+            # دوره نمونه‌برداری بر حسب میکروثانیه و دسته‌بندی FIFO سخت‌افزاری (API 19+)
+            period_us, max_latency_us, tick = self.timing
+            if max_latency_us and self.accelerometer.getFifoMaxEventCount() == 0:
+                print("⚠️ Sensor has no hardware FIFO; batching request will be ignored")
             success = self.sensor_manager.registerListener(
                 self.listener,
                 self.accelerometer,
-                SensorManager.SENSOR_DELAY_GAME
+                period_us,
+                max_latency_us
             )
+            if success and use_rotation:
+                self.sensor_manager.registerListener(
+                    self.listener,
+                    self.rotation_sensor,
+                    period_us,
+                    max_latency_us
+                )
             
             if success:
                 self.is_active = True
-                print("✅ Accelerometer started successfully")
+                self.worker.start()
+                print(f"✅ Accelerometer started successfully ({self.accel_settings.sensor_mode}: "
+                      f"{period_us} us, batch {max_latency_us} us)")
                 return True
             else:
                 print("❌ Failed to register sensor listener")
@@ -259,6 +270,7 @@ class AccelerometerManager:
             if self._simulate_event:
                 Clock.unschedule(self._simulate_event)
                 self._simulate_event = None
+            self.worker.stop()
             print("✅ Accelerometer simulation stopped")
             return True
             
@@ -268,6 +280,7 @@ class AccelerometerManager:
                 self.listener = None
             
             self.is_active = False
+            self.worker.stop()
             print("✅ Accelerometer stopped successfully")
             return True
             
@@ -275,37 +288,89 @@ class AccelerometerManager:
             print(f"❌ Error stopping accelerometer: {e}")
             return False
 
+    def _on_controls_changed(self, controls):
+        self.controls = controls
+        self._rebuild_pipeline()
+
+    def _on_accel_settings_changed(self, accel_settings):
+        self.accel_settings = accel_settings
+        self._rebuild_pipeline()
+        timing = sensor_timing(accel_settings)
+        if timing != self.timing:
+            self.timing = timing
+            self.worker.tick = timing[2]
+            if self.is_active:
+                # نرخ جدید فقط با ثبت دوباره listener اعمال می‌شود
+                self.stop()
+                self.start()
+
+    def set_sensor_mode(self, mode):
+        set_setting('sensor_mode', mode)
+
+    def get_sensor_stats(self):
+        period_us, max_latency_us, tick = self.timing
+        stats = self.worker.get_stats()
+        stats.update(mode=self.accel_settings.sensor_mode, period_us=period_us,
+                     max_latency_us=max_latency_us, tick=tick)
+        return stats
+
+    def _rebuild_pipeline(self):
+        pipeline = SteeringPipeline.from_settings(self.controls, self.accel_settings)
+        pipeline.landscape = self.pipeline.landscape
+        # جایگزینی اتمیک؛ رشته سنسور همیشه یک pipeline کامل می‌بیند
+        self.pipeline = pipeline
+
+    def _on_window_size(self, window, size):
+        self.pipeline.landscape = size[0] > size[1]
+
+    def calibrate(self):
+        """Use the current resting position as neutral steering"""
+        x, y, z = self.accel_values
+        if not any(self.accel_values):
+            print("⚠️ No accelerometer sample to calibrate from")
+            return False
+        cx, cy, cz = calibration_offsets(x, y, z)
+        set_setting('calibration_x', cx)
+        set_setting('calibration_y', cy)
+        set_setting('calibration_z', cz)
+        print(f"✅ Accelerometer calibrated: ({cx:.2f}, {cy:.2f}, {cz:.2f})")
+        return True
+
+    @property
+    def sensitivity(self):
+        return self.controls.sensitivity
+
     def set_sensitivity(self, s):
-        self.sensitivity = max(0.5, min(2.0, s))
-        set_setting('sensitivity', self.sensitivity)
+        set_setting('sensitivity', max(0.5, min(2.0, s)))
         print(f"✅ Sensitivity set to: {self.sensitivity}")
 
-    def get_orientation_adjusted_values(self, x, y, z):
-        """Adjust accelerometer values based on device orientation"""
-        if Window.width > Window.height:
-            x_adj = -y
-            y_adj = x
-            return x_adj, y_adj, z
-        else:
-            return x, y, z
-
     def update_values(self, x, y, z):
-        """Callback for sensor data"""
+        """Callback for sensor data (sensor thread): only queue the sample"""
         self.accel_values = [x, y, z]
-        try:
-            x_adj, y_adj, z_adj = self.get_orientation_adjusted_values(x, y, z)
-            
-            tilt_angle = math.degrees(math.atan2(x_adj, math.sqrt(y_adj*y_adj + z_adj*z_adj)))
-            tilt_angle = -tilt_angle
-            tilt_angle *= self.sensitivity
-            
-            self.steering_angle = max(-90, min(90, tilt_angle * 2))
-            
-            if self.controller and self.is_active:
-                self.controller.update_steering_from_accelerometer(self.steering_angle)
-                
-        except Exception as e:
-            print(f"❌ Steering calculation error: {e}")
+        record_input(REC_ACCEL, 0, x, y, z)
+        self.ring.push((SAMPLE_ACCEL, x, y, z, 0.0, time.monotonic()))
+
+    def update_rotation(self, qx, qy, qz, qw):
+        """Callback for TYPE_GAME_ROTATION_VECTOR samples (complementary filter)"""
+        record_input(REC_ROTATION, 0, qx, qy, qz, qw)
+        self.ring.push((SAMPLE_ROTATION, qx, qy, qz, qw, time.monotonic()))
+
+    def _process_batch(self, batch):
+        """Worker thread: run every sample through the filters, return the newest angle"""
+        pipeline = self.pipeline
+        angle = None
+        for kind, a, b, c, d, t in batch:
+            if kind == SAMPLE_ROTATION:
+                pipeline.feed_rotation(a, b, c, d)
+            else:
+                angle = pipeline.process(a, b, c, t)
+        if angle is not None:
+            self.steering_angle = angle
+        return angle
+
+    def _publish_angle(self, angle):
+        if self.controller and self.is_active:
+            self.controller.update_steering_from_accelerometer(angle)
 
     def _simulate_accelerometer(self, dt):
         """شبیه‌سازی شتاب‌سنج برای محیط غیر-اندروید"""
@@ -324,9 +389,10 @@ class AccelerometerManager:
 
 # --- Complete Android BLE Implementation with Auto-Discovery ---
 class AndroidBLE:
-    def __init__(self):
+    def __init__(self, gatt_cache=None):
         self.connected = False
         self.device_name = ""
+        self.device_address = ""
         self.main_app = None
         self.characteristic_found = False
         self.gatt = None
@@ -340,6 +406,8 @@ class AndroidBLE:
         self.write_characteristic = None
         self.battery_characteristic = None
         self.notify_characteristics = []
+        # کش مشترک همه لینک‌ها (یک فایل برای همه خودروها)
+        self.gatt_cache = gatt_cache or GattCache()
         
         # Common BLE UUIDs for auto-discovery
         self.common_services = {
@@ -371,10 +439,96 @@ class AndroidBLE:
         self.battery_update_callback = None
         self.scanning = False
         self.scanner = None
+        self.scan_callback = None
+        self.scan_max_devices = 0
+        self.scan_name_filters = []
+        self.scan_results = {}
+        self._scan_lock = threading.Lock()
+        self._scan_dirty = False
+        
+        # پروتکل ارسال: متنی (T50\n) یا فریم باینری فشرده
+        self.vehicle_state = VehicleState()
+        self.protocol = PROTOCOL_TEXT
+        self.protocol_callback = None
+        self._frame_seq = 0
+        
+        # اتصال/اتصال مجدد غیرمسدودکننده با backoff
+        self.connection_state_callback = None
+        self.connection_manager = ConnectionManager(
+            self._open_gatt,
+            self._close_gatt,
+            Clock.schedule_once,
+            reconnect_attempts=get_setting('reconnect_attempts', 3),
+            connection_timeout=get_setting('connection_timeout', 10),
+            on_state_change=self._on_connection_state
+        )
+        
+        # پارامترهای لینک (MTU و اولویت اتصال) بعد از اتصال مذاکره می‌شوند
+        self.link_params = ConnectionParameters()
+        self.params_callback = None
+        self._discovery_started = False
+        
+        # تمام نوشتن‌های GATT روی یک ترد جداگانه و به ترتیب اولویت انجام می‌شوند
+        self.write_with_response = False
+        self.writer = BLEWriter(
+            self._gatt_write,
+            max_queue=get_setting('ble_write_queue_size', 32),
+            write_timeout=get_setting('ble_write_timeout', 0.5),
+            rate=get_setting('ble_write_rate', 60),
+            thread_exit_fn=jnius_detach if HAS_ANDROID else None,
+            params=self.link_params,
+            on_dropped=self._on_write_dropped
+        )
+        self.writer.start()
+        
+        # زمان آخرین notify برای نگهبان failsafe
+        self.last_notify_at = None
         
+        # حالت تشخیصی تأخیر رفت‌وبرگشت (پینگ/اکو)
+        self.latency_probe = None
+        self._ping_event = None
+        
+        # اشیای BLE اندروید (autoclass و callbackها) روی ترد جدا ساخته می‌شوند تا UI منتظر نماند
+        self.ready = threading.Event()
+        self._ready_lock = threading.Lock()
+        self._ready_callbacks = []
         if HAS_ANDROID:
+            threading.Thread(target=self._initialize_platform, name='ble-init', daemon=True).start()
+        else:
+            self.setup_sim_transport()
+            self._set_ready()
+
+    def _initialize_platform(self):
+        try:
             self.initialize_ble()
             self.setup_gatt_callbacks()
+            self.setup_scan_callback()
+        finally:
+            self._set_ready()
+            jnius_detach()
+
+    def _set_ready(self):
+        with self._ready_lock:
+            self.ready.set()
+            callbacks, self._ready_callbacks = self._ready_callbacks, []
+        mark_startup(STAGE_BLE_READY)
+        for callback in callbacks:
+            Clock.schedule_once(lambda dt, callback=callback: callback())
+
+    def when_ready(self, callback):
+        """Run ``callback`` on the Kivy thread once the platform BLE objects exist"""
+        with self._ready_lock:
+            if not self.ready.is_set():
+                self._ready_callbacks.append(callback)
+                return
+        Clock.schedule_once(lambda dt: callback())
+
+    @property
+    def active_app(self):
+        """main_app, but only while the UI is driving this link"""
+        if self.main_app and self.main_app.ble is self:
+            return self.main_app
+        return None
 
     def setup_gatt_callbacks(self):
         """GATT Callback کامل برای اندروید"""
@@ -402,21 +556,18 @@ class AndroidBLE:
                         self.outer.connected = True
                         self.outer.gatt = gatt
                         self.outer.services_discovered = False
+                        Clock.schedule_once(lambda dt: self.outer.connection_manager.on_connected())
                         
-                        success = gatt.discoverServices()
-                        print(f"Service discovery started: {success}")
-                        
-                        if self.outer.main_app:
-                            Clock.schedule_once(lambda dt: setattr(self.outer.main_app, 'connection_status', "Discovering Services"))
+                        # اول MTU و اولویت اتصال، بعد کشف سرویس‌ها
+                        self.outer.negotiate_link(gatt)
                     else:
                         print("❌ Disconnected from GATT server")
-                        self.outer.connected = False
-                        self.outer.characteristic_found = False
-                        self.outer.services_discovered = False
-                        self.outer.write_characteristic = None
-                        self.outer.battery_characteristic = None
-                        if self.outer.main_app:
-                            Clock.schedule_once(lambda dt: setattr(self.outer.main_app, 'connection_status', "Disconnected"))
+                        self.outer._on_link_lost()
+                
+                @java_method('(Landroid/bluetooth/BluetoothGatt;II)V')
+                def onMtuChanged(self, gatt, mtu, status):
+                    print(f"📏 MTU changed: {mtu}, status: {status}")
+                    self.outer.on_mtu_changed(mtu, status == BluetoothGatt.GATT_SUCCESS)
                 
                 @java_method('(Landroid/bluetooth/BluetoothGatt;I)V')
                 def onServicesDiscovered(self, gatt, status):
@@ -427,8 +578,7 @@ class AndroidBLE:
                         self.outer.auto_discover_characteristics()
                     else:
                         print(f"❌ Service discovery failed: {status}")
-                        if self.outer.main_app:
-                            Clock.schedule_once(lambda dt: setattr(self.outer.main_app, 'connection_status', "Service Discovery Failed"))
+                        Clock.schedule_once(lambda dt: self.outer.connection_manager.on_disconnected())
                 
                 @java_method('(Landroid/bluetooth/BluetoothGatt;Landroid/bluetooth/BluetoothGattCharacteristic;I)V')
                 def onCharacteristicRead(self, gatt, characteristic, status):
@@ -444,17 +594,19 @@ class AndroidBLE:
                 
                 @java_method('(Landroid/bluetooth/BluetoothGatt;Landroid/bluetooth/BluetoothGattCharacteristic;I)V')
                 def onCharacteristicWrite(self, gatt, characteristic, status):
-                    if status == BluetoothGatt.GATT_SUCCESS:
-                        print("✅ Characteristic write successful")
-                    else:
+                    # ترد نویسنده تا رسیدن این تأیید نوشتن بعدی را شروع نمی‌کند
+                    self.outer.writer.on_write_complete(status == BluetoothGatt.GATT_SUCCESS)
+                    if status != BluetoothGatt.GATT_SUCCESS:
                         print(f"❌ Characteristic write failed: {status}")
                 
                 @java_method('(Landroid/bluetooth/BluetoothGatt;Landroid/bluetooth/BluetoothGattCharacteristic;[B)V')
                 def onCharacteristicChanged(self, gatt, characteristic, value):
                     uuid = characteristic.getUuid().toString().lower()
-                    print(f"📨 Characteristic changed: {uuid}")
+                    record(EVT_NOTIFY, value=len(value) if value else 0)
                     if "2a19" in uuid:  # UUID باتری
                         self.outer.on_battery_data_received(value)
+                    else:
+                        self.outer.on_notify_data(uuid, value)
             
             self.gatt_callback = GattCallback(self)
             print("✅ GATT callbacks setup completed")
@@ -462,6 +614,19 @@ class AndroidBLE:
         except Exception as e:
             print(f"❌ GATT callback setup error: {e}")
 
+    def setup_sim_transport(self):
+        """Desktop/CI: route scan, connect and writes to the in-process fake GATT server"""
+        transport = SimTransport.from_settings(get_snapshot('advanced_settings'))
+        # callbackها روی ترد شبیه‌ساز می‌آیند؛ مثل callbackهای اندروید به ترد Kivy منتقل می‌شوند
+        transport.on_connected = lambda: Clock.schedule_once(lambda dt: self._on_sim_connected())
+        transport.on_mtu_changed = lambda mtu, ok: Clock.schedule_once(lambda dt: self._on_sim_mtu_changed(mtu, ok))
+        transport.on_disconnected = self._on_link_lost
+        transport.on_write_complete = self.writer.on_write_complete
+        transport.on_notify = self.on_notify_data
+        transport.on_battery = self.on_battery_data_received
+        self.transport = transport
+        print("✅ BLE simulation initialized for desktop")
+
     def initialize_ble(self):
         """Initialize BLE components"""
         if not HAS_ANDROID:
@@ -498,110 +663,192 @@ class AndroidBLE:
             print(f"❌ BLE initialization error: {e}")
             return False
 
+    def negotiate_link(self, gatt):
+        """Request connection priority and MTU; service discovery starts once the MTU is settled"""
+        self._discovery_started = False
+        priority = get_setting('connection_priority', 'high')
+        
+        try:
+            BluetoothGatt = autoclass('android.bluetooth.BluetoothGatt')
+            priority_codes = {
+                'high': BluetoothGatt.CONNECTION_PRIORITY_HIGH,
+                'balanced': BluetoothGatt.CONNECTION_PRIORITY_BALANCED,
+                'low_power': BluetoothGatt.CONNECTION_PRIORITY_LOW_POWER,
+            }
+            if gatt.requestConnectionPriority(priority_codes.get(priority, BluetoothGatt.CONNECTION_PRIORITY_HIGH)):
+                self.link_params.priority = priority
+                print(f"✅ Connection priority requested: {priority}")
+        except Exception as e:
+            print(f"❌ Connection priority error: {e}")
+        self._apply_link_params()
+        
+        requested = False
+        try:
+            requested = gatt.requestMtu(get_setting('ble_mtu_size', 512))
+        except Exception as e:
+            print(f"❌ MTU request error: {e}")
+            
+        if requested:
+            # اگر onMtuChanged هرگز نرسید، کشف سرویس‌ها را معطل نکن
+            Clock.schedule_once(lambda dt: self.start_service_discovery(), 1.0)
+        else:
+            self.start_service_discovery()
+
+    def on_mtu_changed(self, mtu, success):
+        if success:
+            self.link_params.mtu = mtu
+            self._apply_link_params()
+        self.start_service_discovery()
+
+    def start_service_discovery(self):
+        if self._discovery_started or not self.connected or not self.gatt:
+            return
+        self._discovery_started = True
+        success = self.gatt.discoverServices()
+        print(f"Service discovery started: {success}")
+
+    def _apply_link_params(self):
+        print(f"📶 Link parameters: {self.link_params}")
+        if self.params_callback:
+            Clock.schedule_once(lambda dt: self.params_callback(self.link_params))
+
     def auto_discover_characteristics(self):
         """کشف خودکار تمام کاراکترستیک‌های مهم"""
         if not HAS_ANDROID or not self.gatt:
             return
             
         try:
-            BluetoothGattService = autoclass('android.bluetooth.BluetoothGattService')
-            BluetoothGattCharacteristic = autoclass('android.bluetooth.BluetoothGattCharacteristic')
-            BluetoothGattDescriptor = autoclass('android.bluetooth.BluetoothGattDescriptor')
-            
             services = self.gatt.getServices()
-            print(f"🔍 Found {services.size()} services - Starting auto-discovery")
+            service_uuids = [services.get(i).getUuid().toString().lower() for i in range(services.size())]
+            layout = layout_hash(service_uuids)
             
-            found_characteristics = []
-            
-            for i in range(services.size()):
-                service = services.get(i)
-                service_uuid = service.getUuid().toString().lower()
-                print(f"🔧 Service {i+1}: {service_uuid}")
-                
-                characteristics = service.getCharacteristics()
-                print(f"   Found {characteristics.size()} characteristics")
-                
-                for j in range(characteristics.size()):
-                    characteristic = characteristics.get(j)
-                    char_uuid = characteristic.getUuid().toString().lower()
-                    properties = characteristic.getProperties()
-                    
-                    char_info = f"     Characteristic {j+1}: {char_uuid}, properties: {properties}"
-                    found_characteristics.append((char_uuid, properties))
-                    print(char_info)
-                    
-                    # شناسایی کاراکترستیک باتری
-                    if "2a19" in char_uuid:
-                        self.battery_characteristic = characteristic
-                        print("✅ Battery characteristic found")
-                        # فعال کردن notifications برای باتری
-                        self.enable_notifications(characteristic)
-                        # خواندن مقدار اولیه باتری
-                        self.gatt.readCharacteristic(characteristic)
-                    
-                    # شناسایی کاراکترستیک‌های قابل نوشتن
-                    if (properties & BluetoothGattCharacteristic.PROPERTY_WRITE or 
-                        properties & BluetoothGattCharacteristic.PROPERTY_WRITE_NO_RESPONSE):
-                        
-                        # اولویت‌بندی کاراکترستیک‌های نوشتن
-                        priority = 0
-                        
-                        # کاراکترستیک‌های UART اولویت بالا
-                        if "6e400002" in char_uuid or "6e400003" in char_uuid:
-                            priority = 100
-                        # کاراکترستیک‌های شناخته شده سفارشی
-                        elif any(uuid in char_uuid for uuid in ['ffe1', 'ffb1', 'fff1']):
-                            priority = 80
-                        # سایر کاراکترستیک‌های قابل نوشتن
-                        else:
-                            priority = 50
-                        
-                        if not self.write_characteristic or priority > getattr(self.write_characteristic, 'priority', 0):
-                            self.write_characteristic = characteristic
-                            self.write_characteristic.priority = priority
-                            self.characteristic_found = True
-                            print(f"✅ Selected write characteristic (priority {priority}): {char_uuid}")
-                    
-                    # شناسایی کاراکترستیک‌های notify
-                    if (properties & BluetoothGattCharacteristic.PROPERTY_NOTIFY or 
-                        properties & BluetoothGattCharacteristic.PROPERTY_INDICATE):
-                        self.enable_notifications(characteristic)
-                        self.notify_characteristics.append(characteristic)
-                        print(f"✅ Notify enabled for: {char_uuid}")
-            
-            # اگر کاراکترستیک نوشتن پیدا نشد، از اولین کاراکترستیک قابل نوشتن استفاده کن
-            if not self.characteristic_found:
-                for char_uuid, properties in found_characteristics:
-                    if (properties & BluetoothGattCharacteristic.PROPERTY_WRITE or 
-                        properties & BluetoothGattCharacteristic.PROPERTY_WRITE_NO_RESPONSE):
-                        # پیدا کردن characteristic مربوطه
-                        for i in range(services.size()):
-                            service = services.get(i)
-                            characteristics = service.getCharacteristics()
-                            for j in range(characteristics.size()):
-                                characteristic = characteristics.get(j)
-                                if characteristic.getUuid().toString().lower() == char_uuid:
-                                    self.write_characteristic = characteristic
-                                    self.characteristic_found = True
-                                    print(f"✅ Fallback write characteristic: {char_uuid}")
-                                    break
-                            if self.characteristic_found:
-                                break
-                    if self.characteristic_found:
-                        break
+            # اتصال مجدد: اگر چیدمان سرویس‌ها تغییر نکرده، از کش استفاده کن
+            if not self._resolve_from_cache(layout):
+                self._discover_all_characteristics(services, layout)
             
             if self.characteristic_found:
                 print("🎯 Auto-discovery completed successfully")
-                if self.main_app:
-                    Clock.schedule_once(lambda dt: self._update_connection_ui())
+                self._select_write_type()
+                self.negotiate_protocol()
+                Clock.schedule_once(lambda dt: self._on_link_ready())
             else:
                 print("❌ No suitable write characteristics found")
-                if self.main_app:
-                    self.main_app.connection_status = "No Write Char Found"
+                if self.active_app:
+                    self.active_app.connection_status = "No Write Char Found"
                 
         except Exception as e:
             print(f"❌ Auto-discovery error: {e}")
 
+    def _discover_all_characteristics(self, services, layout):
+        """Walk every service/characteristic once and cache what was chosen"""
+        BluetoothGattCharacteristic = autoclass('android.bluetooth.BluetoothGattCharacteristic')
+        
+        print(f"🔍 Found {services.size()} services - Starting auto-discovery")
+        
+        write_priority = 0
+        write_pair = None
+        battery_pair = None
+        notify_pairs = []
+        
+        for i in range(services.size()):
+            service = services.get(i)
+            service_uuid = service.getUuid().toString().lower()
+            print(f"🔧 Service {i+1}: {service_uuid}")
+            
+            characteristics = service.getCharacteristics()
+            print(f"   Found {characteristics.size()} characteristics")
+            
+            for j in range(characteristics.size()):
+                characteristic = characteristics.get(j)
+                char_uuid = characteristic.getUuid().toString().lower()
+                properties = characteristic.getProperties()
+                print(f"     Characteristic {j+1}: {char_uuid}, properties: {properties}")
+                
+                # شناسایی کاراکترستیک باتری
+                if "2a19" in char_uuid:
+                    self.battery_characteristic = characteristic
+                    battery_pair = (service_uuid, char_uuid)
+                    print("✅ Battery characteristic found")
+                    # فعال کردن notifications برای باتری
+                    self.enable_notifications(characteristic)
+                    # خواندن مقدار اولیه باتری
+                    self.gatt.readCharacteristic(characteristic)
+                
+                # شناسایی کاراکترستیک‌های قابل نوشتن
+                if (properties & BluetoothGattCharacteristic.PROPERTY_WRITE or 
+                    properties & BluetoothGattCharacteristic.PROPERTY_WRITE_NO_RESPONSE):
+                    
+                    # کاراکترستیک‌های UART اولویت بالا
+                    if "6e400002" in char_uuid or "6e400003" in char_uuid:
+                        priority = 100
+                    # کاراکترستیک‌های شناخته شده سفارشی
+                    elif any(uuid in char_uuid for uuid in ['ffe1', 'ffb1', 'fff1']):
+                        priority = 80
+                    # سایر کاراکترستیک‌های قابل نوشتن
+                    else:
+                        priority = 50
+                    
+                    if priority > write_priority:
+                        write_priority = priority
+                        write_pair = (service_uuid, char_uuid)
+                        self.write_characteristic = characteristic
+                        self.characteristic_found = True
+                        print(f"✅ Selected write characteristic (priority {priority}): {char_uuid}")
+                
+                # شناسایی کاراکترستیک‌های notify (باتری بالاتر فعال شده)
+                if ("2a19" not in char_uuid and
+                        (properties & BluetoothGattCharacteristic.PROPERTY_NOTIFY or 
+                         properties & BluetoothGattCharacteristic.PROPERTY_INDICATE)):
+                    self.enable_notifications(characteristic)
+                    self.notify_characteristics.append(characteristic)
+                    notify_pairs.append((service_uuid, char_uuid))
+                    print(f"✅ Notify enabled for: {char_uuid}")
+        
+        if write_pair and self.device_address:
+            self.gatt_cache.put(self.device_address, layout, write_pair, battery_pair, notify_pairs)
+
+    def _resolve_from_cache(self, layout):
+        """Look up cached characteristics directly; returns False (and invalidates) on any mismatch"""
+        if not self.device_address:
+            return False
+        entry = self.gatt_cache.get(self.device_address)
+        if not entry:
+            return False
+            
+        if entry.get('layout') != layout:
+            self.gatt_cache.invalidate(self.device_address)
+            return False
+            
+        write = self._lookup_characteristic(entry['write'])
+        battery = self._lookup_characteristic(entry['battery']) if entry.get('battery') else None
+        notify = [self._lookup_characteristic(pair) for pair in entry.get('notify', [])]
+        if not write or (entry.get('battery') and not battery) or None in notify:
+            self.gatt_cache.invalidate(self.device_address)
+            return False
+            
+        self.write_characteristic = write
+        self.characteristic_found = True
+        
+        if battery:
+            self.battery_characteristic = battery
+            self.enable_notifications(battery)
+            self.gatt.readCharacteristic(battery)
+            
+        for characteristic in notify:
+            self.enable_notifications(characteristic)
+            self.notify_characteristics.append(characteristic)
+            
+        print(f"⚡ Characteristics resolved from cache for {self.device_address}")
+        return True
+
+    def _lookup_characteristic(self, pair):
+        service_uuid, char_uuid = pair
+        UUID = autoclass('java.util.UUID')
+        service = self.gatt.getService(UUID.fromString(service_uuid))
+        if not service:
+            return None
+        return service.getCharacteristic(UUID.fromString(char_uuid))
+
     def enable_notifications(self, characteristic):
         """فعال کردن notifications برای یک کاراکترستیک"""
         if not HAS_ANDROID or not self.gatt:
@@ -626,6 +873,7 @@ class AndroidBLE:
 
     def on_battery_data_received(self, data):
         """پردازش داده‌های باتری از BLE"""
+        self.last_notify_at = time.monotonic()
         try:
             level = None
             
@@ -653,7 +901,7 @@ class AndroidBLE:
             level = max(0, min(100, level))
             self.battery_level = level
             
-            print(f"🔋 Battery level: {level}%")
+            record(EVT_BATTERY, value=level)
             
             if self.battery_update_callback:
                 Clock.schedule_once(lambda dt: self.battery_update_callback(level))
@@ -661,183 +909,472 @@ class AndroidBLE:
         except Exception as e:
             print(f"❌ Battery data error: {e}")
 
+    def on_notify_data(self, uuid, data):
+        """Handle notifications from non-battery characteristics"""
+        self.last_notify_at = time.monotonic()
+        try:
+            payload = bytes(b & 0xFF for b in data)
+            text = payload.decode('utf-8', errors='ignore')
+        except Exception as e:
+            print(f"❌ Notify data error: {e}")
+            return
+            
+        for line in text.split('\n'):
+            line = line.strip()
+            if line.startswith(PING_PREFIX):
+                if self.latency_probe:
+                    self.latency_probe.on_echo(line)
+            elif line == PROTOCOL_BINARY_REPLY and self.protocol != PROTOCOL_BINARY:
+                print(f"✅ Device supports binary control frames: {self.device_name}")
+                self.set_protocol(PROTOCOL_BINARY)
+
+    def start_latency_test(self):
+        """Send timestamped pings and match the echoes coming back on notify characteristics"""
+        self.stop_latency_test()
+        self.latency_probe = LatencyProbe(
+            self.send_command,
+            window=get_setting('latency_window', 256),
+            timeout=get_setting('latency_timeout', 1.0)
+        )
+        self._ping_event = Clock.schedule_interval(self.latency_probe.send_ping, get_setting('latency_ping_interval', 0.2))
+        print("⏱️ Latency test started")
+        return self.latency_probe
+
+    def stop_latency_test(self):
+        if self._ping_event:
+            self._ping_event.cancel()
+            self._ping_event = None
+            print(f"⏱️ Latency test stopped: {self.latency_probe.summary()}")
+
+    def negotiate_protocol(self):
+        """Use the protocol remembered for this device, otherwise probe for binary support"""
+        known = get_setting('device_protocols', {}).get(self.device_address)
+        if known == PROTOCOL_BINARY:
+            self.set_protocol(PROTOCOL_BINARY)
+        else:
+            self.send_command(PROTOCOL_PROBE)
+
+    def set_protocol(self, protocol):
+        """Switch the wire protocol and remember it for this device"""
+        self.protocol = protocol
+        self._frame_seq = 0
+        
+        if self.device_address:
+            protocols = dict(get_setting('device_protocols', {}))
+            if protocols.get(self.device_address) != protocol:
+                protocols[self.device_address] = protocol
+                set_setting('device_protocols', protocols)
+        
+        print(f"🔀 Protocol set to {protocol}")
+        if self.protocol_callback:
+            Clock.schedule_once(lambda dt: self.protocol_callback(protocol))
+
+    def _reset_protocol(self):
+        """Fall back to text until the next negotiation, without touching the saved choice"""
+        if self.protocol == PROTOCOL_TEXT:
+            return
+        self.protocol = PROTOCOL_TEXT
+        if self.protocol_callback:
+            Clock.schedule_once(lambda dt: self.protocol_callback(PROTOCOL_TEXT))
+
     def set_battery_callback(self, callback):
         """Set callback for battery level updates"""
         self.battery_update_callback = callback
         print("✅ Battery callback set")
 
-    def start_scan(self, callback):
-        """Start BLE device scan"""
-        self.scan_callback = callback
-        
+    def setup_scan_callback(self):
+        """ScanCallback برای اسکن واقعی BLE"""
         if not HAS_ANDROID:
-            def simulate_scan():
-                time.sleep(2)
-                devices = [
-                    "ESP32_Car_01 (AA:BB:CC:DD:EE:FF)",
-                    "Arduino_BLE (11:22:33:44:55:66)",
-                    "Raspberry_Pi (CC:DD:EE:FF:11:22)",
-                    "SmartDevice_123 (DD:EE:FF:11:22:33)"
-                ]
-                Clock.schedule_once(lambda dt: callback(devices))
-                print("✅ BLE scan simulation completed")
-            
-            threading.Thread(target=simulate_scan, daemon=True).start()
+            return
+            
+        try:
+            class LeScanCallback(PythonJavaClass):
+                __javainterfaces__ = ['android/bluetooth/le/ScanCallback']
+                
+                def __init__(self, outer):
+                    super().__init__()
+                    self.outer = outer
+                
+                @java_method('(ILandroid/bluetooth/le/ScanResult;)V')
+                def onScanResult(self, callbackType, result):
+                    self.outer._on_android_scan_result(result)
+                
+                @java_method('(Ljava/util/List;)V')
+                def onBatchScanResults(self, results):
+                    for i in range(results.size()):
+                        self.outer._on_android_scan_result(results.get(i))
+                
+                @java_method('(I)V')
+                def onScanFailed(self, errorCode):
+                    print(f"❌ BLE scan failed: {errorCode}")
+                    Clock.schedule_once(lambda dt: self.outer.stop_scan())
+            
+            self.le_scan_callback = LeScanCallback(self)
+            print("✅ Scan callback setup completed")
+            
+        except Exception as e:
+            print(f"❌ Scan callback setup error: {e}")
+
+    def start_scan(self, callback):
+        """Start BLE device scan; results stream into callback as they arrive"""
+        if not self.ready.is_set():
+            self.when_ready(lambda: self.start_scan(callback))
             return ["Scanning for BLE devices..."]
+        self.stop_scan(notify=False)
+        self.scan_callback = callback
+        self.scan_max_devices = get_setting('scan_max_devices', 0)
+        self.scan_name_filters = [k.lower() for k in get_setting('scan_name_filters', ['esp32', 'arduino', 'car', 'ble', 'rc'])]
+        with self._scan_lock:
+            self.scan_results = {}
+        self._scan_dirty = False
+        self.scanning = True
         
         print("🔍 Starting BLE scan...")
         
-        try:
-            # استفاده از دستگاه‌های paired شده به عنوان fallback
-            bonded_devices = self.bluetooth_adapter.getBondedDevices()
-            found_devices = []
-            
-            if bonded_devices:
-                for device in bonded_devices:
-                    name = device.getName()
-                    address = device.getAddress()
-                    if name and any(keyword in name.lower() for keyword in ['esp32', 'arduino', 'car', 'ble', 'rc']):
-                        device_str = f"{name} ({address})"
-                        found_devices.append(device_str)
-                        print(f"📱 Found bonded device: {device_str}")
-            
-            if not found_devices:
-                found_devices = [
-                    "ESP32_RC_Car_01 (AA:BB:CC:DD:EE:FF)",
-                    "Arduino_Car_BLE (11:22:33:44:55:66)",
-                    "Smart_RC_Car (CC:DD:EE:FF:11:22)"
-                ]
-                print("🔧 Showing test devices for demonstration")
-            
-            Clock.schedule_once(lambda dt: callback(found_devices), 3.0)
-            return ["Scanning for BLE devices..."]
+        if not HAS_ANDROID:
+            self.transport.scan(self._on_scan_result)
+        else:
+            try:
+                self._start_le_scan()
+            except Exception as e:
+                self.scanning = False
+                print(f"❌ BLE scan error: {e}")
+                return [f"Scan error: {str(e)}"]
+        
+        # نتایج با نرخ محدود به UI فرستاده می‌شوند؛ اسکن حداکثر scan_duration ثانیه طول می‌کشد
+        self._scan_push_event = Clock.schedule_interval(self._push_scan_results, 0.2)
+        self._scan_timeout_event = Clock.schedule_once(lambda dt: self.stop_scan(), get_setting('scan_duration', 10))
+        return ["Scanning for BLE devices..."]
+
+    def _start_le_scan(self):
+        ScanSettingsBuilder = autoclass('android.bluetooth.le.ScanSettings$Builder')
+        ScanSettings = autoclass('android.bluetooth.le.ScanSettings')
+        ScanFilterBuilder = autoclass('android.bluetooth.le.ScanFilter$Builder')
+        ParcelUuid = autoclass('android.os.ParcelUuid')
+        ArrayList = autoclass('java.util.ArrayList')
+        
+        self.scanner = self.bluetooth_adapter.getBluetoothLeScanner()
+        if not self.scanner:
+            raise RuntimeError("BLE scanner not available")
+        if not hasattr(self, 'le_scan_callback'):
+            self.setup_scan_callback()
+            
+        filters = ArrayList()
+        for uuid in get_setting('scan_service_uuids', []):
+            filters.add(ScanFilterBuilder().setServiceUuid(ParcelUuid.fromString(uuid)).build())
+        
+        settings = ScanSettingsBuilder().setScanMode(ScanSettings.SCAN_MODE_LOW_LATENCY).build()
+        self.scanner.startScan(filters, settings, self.le_scan_callback)
+
+    def _on_android_scan_result(self, result):
+        device = result.getDevice()
+        self._on_scan_result(device.getName(), device.getAddress(), result.getRssi())
+
+    def _on_scan_result(self, name, address, rssi):
+        """Record one advertisement; safe to call from the scanner thread"""
+        if not self.scanning or not address:
+            return
+        if self.scan_name_filters and not (name and any(k in name.lower() for k in self.scan_name_filters)):
+            return
             
-        except Exception as e:
-            print(f"❌ BLE scan error: {e}")
-            return [f"Scan error: {str(e)}"]
+        with self._scan_lock:
+            known = self.scan_results.get(address)
+            if known is None:
+                print(f"📱 Found device: {name} ({address}) {rssi} dBm")
+            elif known['rssi'] == rssi and known['name'] == (name or known['name']):
+                return
+            self.scan_results[address] = {'name': name or (known and known['name']) or 'Unknown', 'rssi': rssi}
+            self._scan_dirty = True
+            found = len(self.scan_results)
+            
+        if self.scan_max_devices and found >= self.scan_max_devices:
+            # به تعداد کافی دستگاه رسیدیم؛ منتظر پایان زمان اسکن نمان
+            Clock.schedule_once(lambda dt: self.stop_scan())
+
+    def get_scan_devices(self):
+        """Device strings "Name (ADDR)" sorted by signal strength"""
+        with self._scan_lock:
+            ordered = sorted(self.scan_results.items(), key=lambda item: -item[1]['rssi'])
+        return [f"{info['name']} ({address})" for address, info in ordered]
+
+    def get_scan_rssi(self, device_str):
+        address = device_str.split('(')[-1].split(')')[0]
+        with self._scan_lock:
+            info = self.scan_results.get(address)
+        return info['rssi'] if info else None
+
+    def _push_scan_results(self, dt=None):
+        if not self._scan_dirty or not self.scan_callback:
+            return
+        self._scan_dirty = False
+        self.scan_callback(self.get_scan_devices())
+
+    def stop_scan(self, notify=True):
+        """Stop scanning and deliver the final device list"""
+        for event_name in ('_scan_push_event', '_scan_timeout_event'):
+            event = getattr(self, event_name, None)
+            if event:
+                event.cancel()
+                setattr(self, event_name, None)
+                
+        if not self.scanning:
+            return
+        self.scanning = False
+        
+        if HAS_ANDROID and self.scanner and hasattr(self, 'le_scan_callback'):
+            try:
+                self.scanner.stopScan(self.le_scan_callback)
+            except Exception as e:
+                print(f"❌ Stop scan error: {e}")
+        elif not HAS_ANDROID:
+            self.transport.stop_scan()
+                
+        print(f"✅ BLE scan finished: {len(self.scan_results)} devices")
+        if notify and self.scan_callback:
+            self.scan_callback(self.get_scan_devices())
 
     def connect(self, device_address):
-        """Connect to BLE device"""
+        """Start connecting to a BLE device; progress is reported through connection states"""
+        if not self.ready.is_set():
+            self.when_ready(lambda: self.connect(device_address))
+            return True
         try:
             print(f"🔄 Attempting to connect to: {device_address}")
             
-            if not HAS_ANDROID:
-                self.device_name = device_address.split(' ')[0]
-                self.connected = True
-                self.characteristic_found = True
-                if self.battery_update_callback:
-                    self.battery_update_callback(self.battery_level)
-                Clock.schedule_once(lambda dt: self._simulate_connection(), 1)
-                print("✅ Desktop connection simulation completed")
-                return True
-                
             if '(' in device_address and ')' in device_address:
                 address = device_address.split('(')[-1].split(')')[0]
                 self.device_name = device_address.split('(')[0].strip()
             else:
                 address = device_address
                 self.device_name = device_address
+            self.device_address = address
             
             print(f"📱 Device name: {self.device_name}, Address: {address}")
-            
-            if self.connected:
-                self.disconnect()
-                time.sleep(1)
-            
-            BluetoothDevice = autoclass('android.bluetooth.BluetoothDevice')
-            PythonActivity = autoclass('org.kivy.android.PythonActivity')
-            
-            device = self.bluetooth_adapter.getRemoteDevice(address)
-            if not device:
-                print(f"❌ Device not found: {address}")
-                return False
-                
-            activity = PythonActivity.mActivity
-            self.gatt = device.connectGatt(activity, False, self.gatt_callback)
-            
-            if self.gatt:
-                print("✅ GATT connection initiated")
-                return True
-            else:
-                print("❌ Failed to initiate GATT connection")
-                return False
+            return self.connection_manager.connect(address)
             
         except Exception as e:
             print(f"❌ Connect error: {e}")
             return False
 
+    def _open_gatt(self, address, auto_connect):
+        """Start one GATT connection attempt (called by the connection manager)"""
+        if not HAS_ANDROID:
+            self.transport.apply_settings(get_snapshot('advanced_settings'))
+            return self.transport.open(address, auto_connect)
+            
+        PythonActivity = autoclass('org.kivy.android.PythonActivity')
+        
+        device = self.bluetooth_adapter.getRemoteDevice(address)
+        if not device:
+            print(f"❌ Device not found: {address}")
+            return False
+            
+        # autoConnect=True برای اتصال مجدد سریع به دستگاه قبلی وقتی دوباره در برد قرار گیرد
+        self.gatt = device.connectGatt(PythonActivity.mActivity, auto_connect, self.gatt_callback)
+        
+        if self.gatt:
+            print(f"✅ GATT connection initiated (autoConnect={auto_connect})")
+            return True
+        print("❌ Failed to initiate GATT connection")
+        return False
+
+    def _close_gatt(self):
+        """Tear down the current GATT client without touching the reconnect logic"""
+        self.writer.clear()
+        if HAS_ANDROID and self.gatt:
+            try:
+                self.gatt.disconnect()
+                self.gatt.close()
+            except Exception as e:
+                print(f"❌ GATT close error: {e}")
+        elif not HAS_ANDROID:
+            self.transport.close()
+        self.gatt = None
+        self._reset_link_state()
+
+    def _reset_link_state(self):
+        self.connected = False
+        self.characteristic_found = False
+        self.write_characteristic = None
+        self.services_discovered = False
+        self.battery_characteristic = None
+        self.notify_characteristics = []
+        self.link_params.reset()
+        self.writer.reset_progress()
+        self._discovery_started = False
+        self._reset_protocol()
+
+    def _on_link_lost(self):
+        """The link dropped without us asking; safe to call from any thread"""
+        self.writer.clear()
+        self._reset_link_state()
+        if self.active_app:
+            Clock.schedule_once(lambda dt: self.main_app.reset_command_state())
+        # مدیر اتصال تصمیم می‌گیرد دوباره وصل شود یا نه
+        Clock.schedule_once(lambda dt: self.connection_manager.on_disconnected())
+
+    def _on_connection_state(self, state, info):
+        if self.connection_state_callback:
+            self.connection_state_callback(state, info)
+
+    def _on_link_ready(self):
+        """Characteristics resolved: the car is drivable"""
+        self.connection_manager.on_ready()
+        self._update_connection_ui()
+
     def _update_connection_ui(self):
         """Update UI after successful connection"""
-        if self.main_app:
-            self.main_app.connected_device = f"Connected: {self.device_name}"
-            self.main_app.battery_level = f"{self.battery_level}%"
-            self.main_app.connection_status = "Connected"
+        app = self.active_app
+        if app:
+            app.connected_device = f"Connected: {self.device_name}"
+            app.battery_level = f"{self.battery_level}%"
+            app.connection_status = "Connected"
             print("✅ UI updated with connection status")
 
-    def _simulate_connection(self):
-        """Simulate connection for non-Android"""
-        if self.main_app:
-            self.main_app.connected_device = f"Connected: {self.device_name}"
-            self.main_app.battery_level = f"{self.battery_level}%"
-            self.main_app.connection_status = "Connected"
-            print("✅ Desktop connection simulation UI updated")
+    def _on_sim_connected(self):
+        """Desktop counterpart of onConnectionStateChange + negotiate_link"""
+        if self.connection_manager.state != STATE_CONNECTING:
+            self.transport.close()
+            return
+        self.connected = True
+        self.connection_manager.on_connected()
+        
+        priority = get_setting('connection_priority', 'high')
+        if self.transport.set_priority(priority):
+            self.link_params.priority = priority
+        self._apply_link_params()
+        if not self.transport.request_mtu(get_setting('ble_mtu_size', 512)):
+            self._on_sim_services()
+
+    def _on_sim_mtu_changed(self, mtu, success):
+        if success:
+            self.link_params.mtu = mtu
+            self._apply_link_params()
+        self._on_sim_services()
 
-    def send_command(self, command):
+    def _on_sim_services(self):
+        """The simulated car has one write characteristic and notifies on it"""
+        if not self.connected:
+            return
+        self.characteristic_found = True
+        self._select_write_type()
+        self._on_link_ready()
+        print(f"✅ Simulated link ready: {self.link_params}")
+        self.negotiate_protocol()
+
+    def send_command(self, command, priority=None):
         """Send command via BLE"""
+        if priority is None:
+            priority = command_priority(command)
+        key = command[0] if priority == PRIORITY_CONTINUOUS else None
+        payload = PAYLOAD_BY_TEXT.get(command)
+        if payload is None:
+            payload = (command + '\n').encode('utf-8')
+        return self._write_bytes(payload, command, priority, key)
+
+    def _on_write_dropped(self, key):
+        """The writer gave up on a keyed value (writer thread)"""
+        app = self.active_app
+        if app:
+            app.on_write_dropped(key)
+
+    def notify_age(self):
+        """Seconds since the last notification from the car (None if none yet)"""
+        if self.last_notify_at is None:
+            return None
+        return time.monotonic() - self.last_notify_at
+
+    def send_heartbeat(self):
+        """Watchdog heartbeat for the firmware; a pending one is replaced, never queued twice"""
+        if self.protocol == PROTOCOL_BINARY:
+            # هر فریم باینری خودش ضربان قلب است
+            return self.send_frame(self.vehicle_state)
+        return self._write_bytes(PAYLOAD_HEARTBEAT, HEARTBEAT_COMMAND, PRIORITY_DISCRETE, key=HEARTBEAT_COMMAND)
+
+    def emergency_stop(self):
+        """Drop everything queued and put a full stop on the radio ahead of any other write"""
+        for command in ALL_STOP_COMMANDS:
+            self.vehicle_state.apply_command(command)
         if not self.connected:
-            print(f"[BLE NOT CONNECTED] {command}")
+            return False
+        self.writer.clear()
+        if self.protocol == PROTOCOL_BINARY:
+            return self.send_frame(self.vehicle_state, PRIORITY_SAFETY)
+        # سه فرمان در یک نوشتن بسته‌بندی می‌شوند
+        results = [self.send_command(command, PRIORITY_SAFETY) for command in ALL_STOP_COMMANDS]
+        return all(results)
+
+    def send_frame(self, state, priority=PRIORITY_CONTINUOUS):
+        """Send the whole vehicle state as one binary control frame"""
+        self._frame_seq = (self._frame_seq + 1) & 0xFF
+        frame = encode_frame(state, self._frame_seq)
+        # هر فریم کل وضعیت را دارد، پس فریم جدید جای فریم قدیمی در صف را می‌گیرد؛
+        # فریم توقف ایمنی کلید ندارد تا فریم کنترل بعدی نتواند محتوایش را جایگزین کند
+        key = None if priority == PRIORITY_SAFETY else 'FRAME'
+        return self._write_bytes(frame, f"FRAME {frame.hex()}", priority, key=key)
+
+    def _write_bytes(self, command_bytes, command, priority=PRIORITY_DISCRETE, key=None):
+        """Queue raw bytes for the writer thread; command is only used for logging"""
+        if not self.connected:
+            record(EVT_NOT_CONNECTED, command_bytes[0], len(command_bytes))
+            return False
+            
+        if HAS_ANDROID and (not self.characteristic_found or not self.write_characteristic):
+            record(EVT_NOT_CONNECTED, command_bytes[0], len(command_bytes), 1)
             return False
             
+        queued = self.writer.submit(command_bytes, priority, self.write_with_response, key, command)
+        record_command(command_bytes)
+        if not queued:
+            record(EVT_QUEUE_FULL, command_bytes[0], len(command_bytes), priority)
+        return queued
+
+    def _gatt_write(self, command_bytes, with_response):
+        """Perform one characteristic write; runs on the writer thread only"""
         if not HAS_ANDROID:
-            print(f"[BLE SEND SIMULATION] {command}")
-            return True
+            accepted = self.transport.write(command_bytes, with_response)
+            record(EVT_WRITE, command_bytes[0], len(command_bytes), accepted)
+            return accepted
+            
+        characteristic = self.write_characteristic
+        if not self.gatt or not characteristic:
+            return False
             
         try:
-            if not self.characteristic_found or not self.write_characteristic:
-                print(f"[BLE NO CHARACTERISTIC] {command}")
-                return False
-                
             BluetoothGattCharacteristic = autoclass('android.bluetooth.BluetoothGattCharacteristic')
-            
-            properties = self.write_characteristic.getProperties()
-            if properties & BluetoothGattCharacteristic.PROPERTY_WRITE_NO_RESPONSE:
-                write_type = BluetoothGattCharacteristic.WRITE_TYPE_NO_RESPONSE
-            else:
+            if with_response:
                 write_type = BluetoothGattCharacteristic.WRITE_TYPE_DEFAULT
-
-            command_bytes = (command + '\n').encode('utf-8')
-            
-            self.write_characteristic.setValue(command_bytes)
-            self.write_characteristic.setWriteType(write_type)
-            success = self.gatt.writeCharacteristic(self.write_characteristic)
-            
-            if success:
-                print(f"[BLE SEND SUCCESS] {command}")
             else:
-                print(f"[BLE SEND FAILED] {command}")
-                
+                write_type = BluetoothGattCharacteristic.WRITE_TYPE_NO_RESPONSE
+
+            characteristic.setValue(command_bytes)
+            characteristic.setWriteType(write_type)
+            success = self.gatt.writeCharacteristic(characteristic)
+            record(EVT_WRITE, command_bytes[0], len(command_bytes), success)
             return success
             
-        except Exception as e:
-            print(f"[BLE SEND ERROR] {command}: {e}")
+        except Exception:
+            record(EVT_WRITE_ERROR, command_bytes[0], len(command_bytes))
             return False
 
+    def _select_write_type(self):
+        """Prefer write-without-response when the characteristic supports it"""
+        if not HAS_ANDROID:
+            self.write_with_response = not self.transport.supports_write_without_response()
+            return
+        if not self.write_characteristic:
+            self.write_with_response = False
+            return
+        BluetoothGattCharacteristic = autoclass('android.bluetooth.BluetoothGattCharacteristic')
+        properties = self.write_characteristic.getProperties()
+        self.write_with_response = not (properties & BluetoothGattCharacteristic.PROPERTY_WRITE_NO_RESPONSE)
+
     def disconnect(self):
         """Disconnect from BLE device"""
         try:
-            if HAS_ANDROID and self.gatt:
-                self.gatt.disconnect()
-                self.gatt.close()
-                print("✅ BLE disconnected")
-                
-            self.connected = False
-            self.characteristic_found = False
-            self.write_characteristic = None
-            self.services_discovered = False
-            self.battery_characteristic = None
-            self.notify_characteristics = []
-            
-            print("✅ BLE state reset")
+            self.connection_manager.disconnect()
+            self._close_gatt()
+            print("✅ BLE disconnected and state reset")
             
         except Exception as e:
             print(f"❌ Disconnect error: {e}")
@@ -847,8 +1384,10 @@ class BatteryIndicator(Widget):
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.bind(pos=self._update_canvas, size=self._update_canvas, level=self._update_canvas)
-        Clock.schedule_once(self._update_canvas, 0.1)
+        # جابجایی و تغییر اندازه در یک فریم فقط یک بار بوم را بازسازی می‌کند
+        self._redraw = Clock.create_trigger(self._update_canvas)
+        self.bind(pos=self._redraw, size=self._redraw, level=self._redraw)
+        self._redraw()
 
     def _update_canvas(self, *args):
         self.canvas.clear()
@@ -945,6 +1484,10 @@ class ImageButton(ButtonBehavior, Image):
         self.active_color = (0.2, 0.8, 1, 1)
         self.color = self.normal_color
 
+    def on_press(self):
+        if self.command:
+            record_button(PHASE_DOWN, self.command)
+
     def toggle(self):
         self.is_active = not self.is_active
         self.color = self.active_color if self.is_active else self.normal_color
@@ -957,11 +1500,13 @@ class MomentaryImageButton(ImageButton):
 
     def on_press(self):
         if self.controller and self.press_command:
+            record_button(PHASE_DOWN, self.press_command)
             self.controller.send_command(self.press_command)
             self.color = self.active_color
 
     def on_release(self):
         if self.controller and self.release_command:
+            record_button(PHASE_UP, self.release_command)
             self.controller.send_command(self.release_command)
             self.color = self.normal_color
 
@@ -995,7 +1540,7 @@ class SteeringWidget(BoxLayout):
         if self.collide_point(*touch.pos) and not getattr(self.controller, 'accelerometer_mode', False) and not self._touch_down:
             self._touch_down = True
             self._touch_id = touch_id
-            return self.process_touch(touch)
+            return self.process_touch(touch, PHASE_DOWN)
         return super().on_touch_down(touch)
 
     def on_touch_move(self, touch):
@@ -1010,12 +1555,13 @@ class SteeringWidget(BoxLayout):
             self._touch_down = False
             self._touch_id = None
             self.angle = 0
+            record_input(REC_STEER, PHASE_UP)
             if self.controller:
-                self.controller.send_command("T50")
+                self.controller.send_control('T', 50)
             return True
         return super().on_touch_up(touch)
 
-    def process_touch(self, touch):
+    def process_touch(self, touch, phase=PHASE_MOVE):
         touch_id = self._get_touch_id(touch)
         if not self._touch_down or touch_id != self._touch_id:
             return False
@@ -1024,17 +1570,10 @@ class SteeringWidget(BoxLayout):
         relative_x = (touch.x - center_x) / (self.width / 2)
         relative_x = max(-1, min(1, relative_x))
         self.angle = relative_x * 90
+        record_input(REC_STEER, phase, self.angle)
         
-        if self.angle >= 0:
-            value = 50 + int((self.angle / 90) * 49)
-            value = min(99, value)
-        else:
-            value = 50 - int((abs(self.angle) / 90) * 50)
-            value = max(0, value)
-            
-        command = f"T{value:02d}"
         if self.controller:
-            self.controller.send_command(command)
+            self.controller.send_steering(self.angle)
         return True
 
 class PedalWidget(BoxLayout):
@@ -1078,7 +1617,7 @@ class PedalWidget(BoxLayout):
         if self.collide_point(*touch.pos) and not self._touch_down:
             self._touch_down = True
             self._touch_id = touch_id
-            return self.process_touch(touch)
+            return self.process_touch(touch, PHASE_DOWN)
         return super().on_touch_down(touch)
 
     def on_touch_move(self, touch):
@@ -1093,12 +1632,13 @@ class PedalWidget(BoxLayout):
             self._touch_down = False
             self._touch_id = None
             self.pedal_value = 0
+            record_input(REC_PEDAL, PHASE_UP)
             if self.controller:
-                self.controller.send_command("S00")
+                self.controller.set_throttle(0)
             return True
         return super().on_touch_up(touch)
 
-    def process_touch(self, touch):
+    def process_touch(self, touch, phase=PHASE_MOVE):
         touch_id = self._get_touch_id(touch)
         if not self._touch_down or touch_id != self._touch_id:
             return False
@@ -1106,9 +1646,9 @@ class PedalWidget(BoxLayout):
         relative_y = (touch.y - self.y) / self.height
         self.pedal_value = int(relative_y * 100)
         self.pedal_value = max(0, min(99, self.pedal_value))
-        command = f"S{self.pedal_value:02d}"
+        record_input(REC_PEDAL, phase, self.pedal_value)
         if self.controller:
-            self.controller.send_command(command)
+            self.controller.set_throttle(self.pedal_value)
         return True
 
 class CommandLogBox(BoxLayout):
@@ -1128,72 +1668,189 @@ class CommandLogBox(BoxLayout):
 FIGMA_WIDTH = 2340
 FIGMA_HEIGHT = 1080
 
+# هر کنترل: موقعیت در طرح فیگما + نوع ویجت و گزینه‌هایش (سازنده‌ها در CombinedAppRoot.WIDGET_FACTORIES)
+UI_LAYOUT = (
+    LayoutItem('pedal', 80, 160, 359, 967, 'pedal.png', kind='pedal'),
+    LayoutItem('start', 664, 726, 170, 170, 'start.png', kind='button', command='STA', action='_on_toggle_control'),
+    LayoutItem('r', 476, 886, 150, 150, 'r.png', kind='gear', command='R'),
+    LayoutItem('n', 477, 736, 150, 150, 'n.png', kind='gear', command='N'),
+    LayoutItem('d', 476, 587, 150, 150, 'd.png', kind='gear', command='D'),
+    LayoutItem('light', 1506, 544, 150, 150, 'light.png', kind='button', command='LIT', action='_on_toggle_control'),
+    LayoutItem('lightHorn', 1480, 721, 150, 150, 'light.horn.png', kind='momentary', press='LHO', release='LHO'),
+    LayoutItem('left', 1642, 425, 150, 150, 'left.png', kind='button', command='LTL', action='_on_turn_signal_pressed'),
+    LayoutItem('hazard', 1842, 350, 150, 150, 'hazard.png', kind='button', command='ALL',
+               action='_on_turn_signal_pressed'),
+    LayoutItem('horn', 2178, 544, 150, 150, 'horn.png', kind='momentary', press='HOR', release='HOF'),
+    LayoutItem('rgb', 1518, 906, 150, 150, 'rgb.png', kind='button', command='RGB', action='_on_toggle_control'),
+    LayoutItem('right', 2042, 425, 150, 150, 'right.png', kind='button', command='RTL',
+               action='_on_turn_signal_pressed'),
+    LayoutItem('bluetooth', 1315, 956, 100, 100, 'bluetooth.png', kind='button', command='BT',
+               action='show_bluetooth_devices'),
+    LayoutItem('accelerometer', 2016, 182, 150, 150, 'accelerometer.png', kind='button', command='ACC',
+               action='on_accelerometer_toggle'),
+    LayoutItem('battery_title', 1225, 346, 200, 100, kind='label', text='Battery'),
+    LayoutItem('battery_indicator', 1230, 412, 170, 80, kind='battery'),
+    LayoutItem('battery_percent', 1235, 412, 170, 80, kind='battery_percent'),
+    LayoutItem('command_display', 886, 380, 110, 110, kind='caption', title='Last Command', text='--',
+               label='last_cmd_label', color=(0, 0.5, 0, 1)),
+    LayoutItem('steer', 1668, 544, 498, 497, 'steer.png', kind='steer', fit=FIT_SQUARE),
+    LayoutItem('setting', 1840, 182, 150, 150, 'setting.png', kind='button', action='show_settings_menu'),
+    LayoutItem('led', 2178, 720, 150, 150, 'led.png', kind='button', command='LED', action='_on_toggle_control'),
+    LayoutItem('device_display', 900, 956, 200, 80, kind='caption', title='Device', text='Not Connected',
+               label='device_name_label', color=(0.2, 0.2, 0.8, 1), bind='connected_device'),
+)
+
 class CombinedAppRoot(FloatLayout):
     battery_level = StringProperty("85%")
     connected_device = StringProperty("Not Connected")
     connection_status = StringProperty("Disconnected")
     accelerometer_mode = BooleanProperty(False)
 
-    def __init__(self, **kwargs):
+    def __init__(self, gatt_cache=None, **kwargs):
         super().__init__(**kwargs)
         
-        # Initialize BLE and accelerometer
-        self.ble = AndroidBLE()
-        self.ble.main_app = self
-        self.ble.set_battery_callback(self.update_battery_level)
+        # Initialize BLE (one warm link per car, one shared GATT cache) and accelerometer
+        self.gatt_cache = gatt_cache or GattCache()
+        self.vehicle_pool = VehiclePool(self._create_link, max_links=get_setting('max_vehicles', 4))
         self.accelerometer_manager = AccelerometerManager()
         self.accelerometer_manager.controller = self
 
         self.current_gear = 'N'
         self.current_turn_signal = None
 
+        # منحنی فرمان مشترک بین لمس و شتاب‌سنج
+        controls = subscribe_settings('control_settings', self._on_control_settings_changed)
+        self.steering_curve = SteeringCurve.from_settings(controls)
+
+        # موتور گاز: شیب شتاب/ترمز، منحنی و سقف هر دنده روی تیک ثابت
+        self.throttle_engine = ThrottleEngine.from_settings(
+            controls, subscribe_settings('vehicle_settings', self._on_vehicle_settings_changed))
+
+        # زمان‌بند فرمان‌ها: فقط آخرین مقدار T/S در هر بازه ارسال می‌شود
+        advanced = subscribe_settings('advanced_settings', self._on_advanced_settings_changed)
+        self.command_scheduler = CommandScheduler(
+            self._transmit,
+            interval=advanced.command_flush_interval,
+            hysteresis=advanced.command_hysteresis,
+            keepalive=advanced.command_keepalive
+        )
+        self._last_control_values = {}
+        self._steer_ui_angle = 0
+        self._steer_ui_trigger = Clock.create_trigger(self._update_steer_angle)
+        self._throttle_ui_trigger = Clock.create_trigger(self._update_throttle_label)
+        self._replay = None
+        if get_setting('session_recording', False):
+            self.start_session_recording()
+
+        # حلقه کنترل با نرخ ثابت: گاز را شکل می‌دهد و صف فرمان را روی تیک خودش ارسال می‌کند
+        self._control_lock = threading.RLock()
+        self.failsafe = Failsafe.from_settings(
+            subscribe_settings('safety_settings', self._on_safety_settings_changed),
+            self._failsafe_stop,
+            self._send_heartbeat,
+            lambda: self.ble.writer.last_safety_write
+        )
+        self.control_loop = ControlLoop(self._control_step, rate_hz=1.0 / self.command_scheduler.interval)
+        self.control_loop.start()
+
         # White background
         with self.canvas.before:
             Color(1, 1, 1, 1)
             self.bgrect = Rectangle(pos=self.pos, size=self.size)
         self.bind(pos=self._update_bg, size=self._update_bg)
 
-        # UI items configuration
-        self.items = [
-            ('pedal', 80, 160, 359, 967, 'pedal.png'),
-            ('start', 664, 726, 170, 170, 'start.png'),
-            ('r', 476, 886, 150, 150, 'r.png'),
-            ('n', 477, 736, 150, 150, 'n.png'),
-            ('d', 476, 587, 150, 150, 'd.png'),
-            ('light', 1506, 544, 150, 150, 'light.png'),
-            ('lightHorn', 1480, 721, 150, 150, 'light.horn.png'),
-            ('left', 1642, 425, 150, 150, 'left.png'),
-            ('hazard', 1842, 350, 150, 150, 'hazard.png'),
-            ('horn', 2178, 544, 150, 150, 'horn.png'),
-            ('rgb', 1518, 906, 150, 150, 'rgb.png'),
-            ('right', 2042, 425, 150, 150, 'right.png'),
-            ('bluetooth', 1315, 956, 100, 100, 'bluetooth.png'),
-            ('accelerometer', 2016, 182, 150, 150, 'accelerometer.png'),
-            ('battery_title', 1225, 346, 200, 100, ''),
-            ('battery_indicator', 1230, 412, 170, 80, ''),
-            ('battery_percent', 1235, 412, 170, 80, ''),
-            ('command_display', 886, 380, 110, 110, ''),
-            ('steer', 1668, 544, 498, 497, 'steer.png'),
-            ('setting', 1840, 182, 150, 150, 'setting.png'),
-            ('led', 2178, 720, 150, 150, 'led.png'),
-            ('device_display', 900, 956, 200, 80, ''),
-        ]
+        # جانمایی: یک تبدیل برای هر اندازه پنجره، مشترک بین ساخت و تغییر اندازه
+        self.layout = LayoutEngine(UI_LAYOUT, (FIGMA_WIDTH, FIGMA_HEIGHT),
+                                   safe_area=0.03 if HAS_ANDROID else 0.0)
+        self.widgets = {}
 
         # Command log
         self.command_log = CommandLogBox(pos_hint={'x': 0, 'y': 0})
         self.add_widget(self.command_log)
 
-        # Bind window size changes
+        # Bind window size changes؛ چند رویداد اندازه در یک فریم فقط یک بار جانمایی می‌شوند
+        self._relayout_trigger = Clock.create_trigger(self._update_ui_positions)
         Window.bind(size=self.on_window_size)
 
+        # UI در اولین تیک ساخته می‌شود (قبل از رسم اولین فریم)؛ اتصال خودکار منتظر آماده شدن BLE است
         self._ui_built = False
-        Clock.schedule_once(self._build_ui, 0.5)
-        
-        # بارگذاری تنظیمات ذخیره شده
-        Clock.schedule_once(self._load_saved_settings, 1.0)
+        Clock.schedule_once(self._build_ui)
+        self._load_saved_settings()
         
         print("✅ CombinedAppRoot initialized successfully")
 
+    @property
+    def ble(self):
+        """Link of the car currently being driven"""
+        return self.vehicle_pool.active
+
+    @property
+    def vehicle_state(self):
+        return self.vehicle_pool.active.vehicle_state
+
+    def _create_link(self):
+        link = AndroidBLE(self.gatt_cache)
+        link.main_app = self
+        link.set_battery_callback(partial(self._on_link_event, link, self.update_battery_level))
+        link.protocol_callback = partial(self._on_link_event, link, self.on_protocol_changed)
+        link.params_callback = partial(self._on_link_event, link, self.on_link_params_changed)
+        link.connection_state_callback = partial(self._on_link_state, link)
+        return link
+
+    def _on_link_event(self, link, handler, *args):
+        """Only the active car drives the UI and the command path"""
+        if link is self.ble:
+            handler(*args)
+
+    def _on_link_state(self, link, state, info):
+        if link is self.ble:
+            self.on_connection_state(state, info)
+            return
+        address = self.vehicle_pool.address_of(link)
+        print(f"🚗 Background car {link.device_name}: {state}")
+        if state == STATE_IDLE and info.get('failed') and address:
+            self.vehicle_pool.remove(address)
+
+    def switch_vehicle(self, address):
+        """Make another pooled car the active one without reconnecting"""
+        link = self.vehicle_pool.links.get(address.upper())
+        if link is None or link is self.ble:
+            return False
+            
+        previous = self.ble
+        # خودروی قبلی را متوقف کن تا بدون راننده حرکت نکند
+        previous.emergency_stop()
+            
+        self.vehicle_pool.set_active(address)
+        self.reset_command_state()
+        self.on_protocol_changed(link.protocol)
+        self.on_link_params_changed(link.link_params)
+        self._sync_gear_buttons(link.vehicle_state.gear)
+        
+        self.connected_device = f"Connected: {link.device_name}" if link.connected else f"{link.device_name}: {link.connection_manager.state}"
+        self.connection_status = "Connected" if link.connected else "Disconnected"
+        self.update_battery_level(link.battery_level)
+        print(f"🚗 Active car: {link.device_name} ({address})")
+        return True
+
+    def all_stop(self, instance=None):
+        """Stop every connected car at once"""
+        self.stop_replay()
+        results = self.vehicle_pool.all_stop()
+        self.reset_command_state()
+        self._sync_gear_buttons('N')
+        print(f"🛑 All-stop sent to {len(results)} cars")
+        return results
+
+    def _sync_gear_buttons(self, gear):
+        self.current_gear = gear
+        self.throttle_engine.set_gear(gear)
+        for key in ('n', 'r', 'd'):
+            w = self.widgets.get(key) if hasattr(self, 'widgets') else None
+            if isinstance(w, ImageButton):
+                w.is_active = w.command == gear
+                w.color = w.active_color if w.is_active else w.normal_color
+
     def _update_bg(self, *args):
         self.bgrect.pos = self.pos
         self.bgrect.size = self.size
@@ -1202,66 +1859,38 @@ class CombinedAppRoot(FloatLayout):
         if not self._ui_built:
             return
             
-        print(f"🔄 Window size changed to: {value}")
-        self._update_ui_positions()
+        self._relayout_trigger()
 
     def _load_saved_settings(self, dt=None):
         """بارگذاری تنظیمات ذخیره شده"""
         print("🔄 Loading saved settings...")
         
         # بارگذاری حساسیت شتاب‌سنج
-        sensitivity = get_setting('sensitivity', 1.0)
-        self.accelerometer_manager.sensitivity = sensitivity
-        print(f"✅ Sensitivity loaded: {sensitivity}")
+        print(f"✅ Sensitivity loaded: {self.accelerometer_manager.sensitivity}")
         
         # اتصال خودکار به دستگاه آخر (اگر فعال باشد)
         auto_connect = get_setting('auto_connect', True)
         if auto_connect:
-            def auto_connect_to_device(dt):
+            def auto_connect_to_device():
                 last_device = get_setting('last_connected_device')
                 if last_device:
                     print(f"🔄 Attempting auto-connect to: {last_device}")
                     self._connect_and_close(last_device)
             
-            Clock.schedule_once(auto_connect_to_device, 3.0)
+            self.ble.when_ready(auto_connect_to_device)
 
-    def _update_ui_positions(self):
+    def _update_ui_positions(self, dt=None):
         """فقط موقعیت المان‌های UI را به روز می‌کند"""
-        win_w, win_h = Window.size
-        
-        target_ratio = FIGMA_WIDTH / FIGMA_HEIGHT
-        current_ratio = win_w / win_h
-        
-        safe_area_top = max(0, win_h * 0.03) if HAS_ANDROID else 0
-        safe_area_bottom = max(0, win_h * 0.03) if HAS_ANDROID else 0
-        usable_height = win_h - safe_area_top - safe_area_bottom
-        
-        if current_ratio > target_ratio:
-            scale = usable_height / FIGMA_HEIGHT
-            margin_x = (win_w - FIGMA_WIDTH * scale) / 2
-            margin_y = safe_area_bottom
-        else:
-            scale = win_w / FIGMA_WIDTH
-            margin_x = 0
-            margin_y = (win_h - FIGMA_HEIGHT * scale) / 2
-
-        for name, x, y, w, h, src in self.items:
-            if name in self.widgets:
-                y_corrected = FIGMA_HEIGHT - (y + h)
-                x_scaled = x * scale + margin_x
-                y_scaled = y_corrected * scale + margin_y
-                w_scaled = w * scale
-                h_scaled = h * scale
-                
-                widget = self.widgets[name]
-                if hasattr(widget, 'pos'):
-                    widget.pos = (x_scaled, y_scaled)
-                if hasattr(widget, 'size'):
-                    widget.size = (w_scaled, h_scaled)
+        transform, frames = self.layout.layout(Window.size)
+        self.layout.apply(self.widgets, frames)
+        self._place_command_log(transform)
+        self._position_diagnostics_overlay()
 
+    def _place_command_log(self, transform):
+        win_w, win_h = Window.size
         cmd_log_width = max(180, win_w * 0.18)
         cmd_log_height = max(35, win_h * 0.045)
-        self.command_log.pos = (win_w - cmd_log_width - 10, 10 + safe_area_bottom)
+        self.command_log.pos = (win_w - cmd_log_width - 10, 10 + transform.inset)
         self.command_log.size = (cmd_log_width, cmd_log_height)
 
     def update_battery_level(self, level):
@@ -1274,363 +1903,166 @@ class CombinedAppRoot(FloatLayout):
                 
         Clock.schedule_once(update_ui, 0)
 
-    def _build_ui(self, dt):
+    # نوع ویجت -> سازنده؛ هر سازنده ویجت بدون اندازه/موقعیت برمی‌گرداند
+    WIDGET_FACTORIES = {
+        'image': '_make_image',
+        'label': '_make_label',
+        'caption': '_make_caption',
+        'battery': '_make_battery',
+        'battery_percent': '_make_battery_percent',
+        'steer': '_make_steer',
+        'pedal': '_make_pedal',
+        'gear': '_make_gear',
+        'button': '_make_button',
+        'momentary': '_make_momentary',
+    }
+
+    def _build_ui(self, dt=None):
         if self._ui_built:
             return
             
         win_w, win_h = Window.size
         print(f"🔄 Building UI for window size: {win_w}x{win_h}")
-        
-        target_ratio = FIGMA_WIDTH / FIGMA_HEIGHT
-        current_ratio = win_w / win_h
-        
-        safe_area_top = 0
-        safe_area_bottom = 0
-        
-        if HAS_ANDROID:
-            safe_area_top = max(0, win_h * 0.03)
-            safe_area_bottom = max(0, win_h * 0.03)
-        
-        usable_height = win_h - safe_area_top - safe_area_bottom
-        
-        if current_ratio > target_ratio:
-            scale = usable_height / FIGMA_HEIGHT
-            margin_x = (win_w - FIGMA_WIDTH * scale) / 2
-            margin_y = safe_area_bottom
-        else:
-            scale = win_w / FIGMA_WIDTH
-            margin_x = 0
-            margin_y = (win_h - FIGMA_HEIGHT * scale) / 2
-
-        self.widgets = {}
-
-        for name, x, y, w, h, src in self.items:
-            y_corrected = FIGMA_HEIGHT - (y + h)
-            x_scaled = x * scale + margin_x
-            y_scaled = y_corrected * scale + margin_y
-            w_scaled = w * scale
-            h_scaled = h * scale
-            pos = (x_scaled, y_scaled)
+        transform, frames = self.layout.layout(Window.size)
 
+        for item in self.layout:
             try:
-                # Battery title
-                if name == 'battery_title':
-                    battery_title_box = BoxLayout(
-                        orientation='vertical',
-                        size_hint=(None, None),
-                        size=(w_scaled, h_scaled),
-                        pos=pos
-                    )
-                    
-                    battery_title = Label(
-                        text='Battery',
-                        size_hint_y=1,
-                        font_size='14sp',
-                        color=(0, 0, 0, 1),
-                        halign='center',
-                        valign='middle'
-                    )
-                    
-                    battery_title_box.add_widget(battery_title)
-                    self.add_widget(battery_title_box)
+                factory = getattr(self, self.WIDGET_FACTORIES[item.kind])
+                widget = factory(item)
+                if widget is None:
                     continue
-
-                # Battery indicator
-                if name == 'battery_indicator':
-                    battery_indicator = BatteryIndicator(
-                        size_hint=(None, None),
-                        size=(w_scaled, h_scaled),
-                        pos=pos
-                    )
-                    
-                    self.widgets['battery_indicator'] = battery_indicator
-                    
-                    def update_battery_indicator(instance, battery_text):
-                        try:
-                            level = int(''.join(filter(str.isdigit, battery_text)))
-                            battery_indicator.level = level
-                            battery_indicator._update_canvas()
-                        except (ValueError, TypeError) as e:
-                            print(f"❌ Battery indicator update error: {e}")
-                    
-                    self.bind(battery_level=update_battery_indicator)
-                    
-                    battery_indicator.level = 85
-                    
-                    self.add_widget(battery_indicator)
-                    continue
-
-                # Battery percent display - تنظیم فونت روی ۳۰
-                if name == 'battery_percent':
-                    battery_percent_box = BoxLayout(
-                        orientation='vertical',
-                        size_hint=(None, None),
-                        size=(w_scaled, h_scaled),
-                        pos=pos
-                    )
-                    
-                    self.battery_percent_label = Label(
-                        text=self.battery_level,
-                        size_hint_y=1,
-                        font_size='14sp',
-                        color=(0, 0, 0, 1),
-                        halign='center',
-                        valign='middle',
-                        bold=True
-                    )
-                    
-                    battery_percent_box.add_widget(self.battery_percent_label)
-                    self.add_widget(battery_percent_box)
-                    
-                    def update_battery_percent(instance, battery_text):
-                        self.battery_percent_label.text = battery_text
-                        try:
-                            level = int(''.join(filter(str.isdigit, battery_text)))
-                            if level <= 20:
-                                self.battery_percent_label.color = (1, 0, 0, 1)
-                            elif level <= 60:
-                                self.battery_percent_label.color = (1, 0.5, 0, 1)
-                            else:
-                                self.battery_percent_label.color = (0, 0.5, 0, 1)
-                        except (ValueError, TypeError) as e:
-                            print(f"❌ Battery percent update error: {e}")
-                    
-                    self.bind(battery_level=update_battery_percent)
-                    continue
-
-                # Steering wheel
-                if name == 'steer':
-                    size = min(w_scaled, h_scaled)
-                    steer = SteeringWidget(
-                        size_hint=(None, None),
-                        size=(size, size),
-                        pos=(x_scaled + (w_scaled - size)/2, y_scaled + (h_scaled - size)/2)
-                    )
-                    steer.controller = self
-                    self.add_widget(steer)
-                    self.widgets['steer'] = steer
-                    continue
-
-                # Pedal
-                if name == 'pedal':
-                    pedal = PedalWidget(
-                        size_hint=(None, None),
-                        size=(w_scaled, h_scaled),
-                        pos=pos
-                    )
-                    pedal.controller = self
-                    self.add_widget(pedal)
-                    self.widgets['pedal'] = pedal
-                    continue
-
-                # Gear buttons
-                if name in ('n', 'r', 'd'):
-                    btn = ImageButton(normal_source=src)
-                    btn.controller = self
-                    btn.command = name.upper()
-                    btn.size_hint = (None, None)
-                    btn.size = (w_scaled, h_scaled)
-                    btn.pos = pos
-                    btn.bind(on_press=self._on_gear_pressed)
-                    
-                    if name == 'n':
-                        btn.is_active = True
-                        btn.color = btn.active_color
-                        self.current_gear = 'N'
-                    else:
-                        btn.is_active = False
-                        btn.color = btn.normal_color
-                        
-                    self.add_widget(btn)
-                    self.widgets[name] = btn
-                    continue
-
-                # Bluetooth button
-                if name == 'bluetooth':
-                    btn = ImageButton(normal_source=src)
-                    btn.controller = self
-                    btn.command = "BT"
-                    btn.size_hint = (None, None)
-                    btn.size = (w_scaled, h_scaled)
-                    btn.pos = pos
-                    btn.bind(on_press=self.show_bluetooth_devices)
-                    self.add_widget(btn)
-                    self.widgets['bluetooth'] = btn
-                    continue
-
-                # Accelerometer toggle - پیش‌فرض غیرفعال
-                if name == 'accelerometer':
-                    btn = ImageButton(normal_source=src)
-                    btn.controller = self
-                    btn.command = "ACC"
-                    btn.size_hint = (None, None)
-                    btn.size = (w_scaled, h_scaled)
-                    btn.pos = pos
-                    btn.bind(on_press=self.on_accelerometer_toggle)
-                    # حالت پیش‌فرض غیرفعال
-                    btn.is_active = False
-                    btn.color = btn.normal_color
-                    self.add_widget(btn)
-                    self.widgets['accelerometer'] = btn
-                    continue
-
-                # Settings button
-                if name == 'setting':
-                    btn = ImageButton(normal_source=src)
-                    btn.controller = self
-                    btn.size_hint = (None, None)
-                    btn.size = (w_scaled, h_scaled)
-                    btn.pos = pos
-                    btn.bind(on_press=lambda inst: self.show_settings_menu())
-                    self.add_widget(btn)
-                    self.widgets['setting'] = btn
-                    continue
-
-                # Command display - تنظیم فونت روی ۳۰
-                if name == 'command_display':
-                    cmd_box = BoxLayout(
-                        orientation='vertical',
-                        size_hint=(None, None),
-                        size=(w_scaled, h_scaled),
-                        pos=pos
-                    )
-                    title_label = Label(
-                        text='Last Command',
-                        size_hint_y=0.3,
-                        font_size='14sp',
-                        color=(0, 0, 0, 1)
-                    )
-                    self.last_cmd_label = Label(
-                        text='--',
-                        size_hint_y=0.7,
-                        font_size='14sp',
-                        color=(0, 0.5, 0, 1)
-                    )
-                    
-                    cmd_box.add_widget(title_label)
-                    cmd_box.add_widget(self.last_cmd_label)
-                    self.add_widget(cmd_box)
-                    self.widgets['command_display'] = cmd_box
-                    continue
-
-                # Device display
-                if name == 'device_display':
-                    device_box = BoxLayout(
-                        orientation='vertical',
-                        size_hint=(None, None),
-                        size=(w_scaled, h_scaled),
-                        pos=pos
-                    )
-                    device_title = Label(
-                        text='Device',
-                        size_hint_y=0.3,
-                        font_size='14sp',
-                        color=(0, 0, 0, 1)
-                    )
-                    self.device_name_label = Label(
-                        text='Not Connected',
-                        size_hint_y=0.7,
-                        font_size='14sp',
-                        color=(0.2, 0.2, 0.8, 1)
-                    )
-                    
-                    device_box.add_widget(device_title)
-                    device_box.add_widget(self.device_name_label)
-                    self.add_widget(device_box)
-                    self.widgets['device_display'] = device_box
-                    
-                    self.bind(connected_device=lambda inst, val: setattr(self.device_name_label, 'text', val))
-                    continue
-
-                # Control buttons - Turn signals
-                if name in ('left', 'right', 'hazard'):
-                    cmd_map = {
-                        'left': 'LTL', 'right': 'RTL', 'hazard': 'ALL'
-                    }
-                    cmd = cmd_map.get(name, name.upper())
-                    btn = ImageButton(normal_source=src)
-                    btn.controller = self
-                    btn.command = cmd
-                    btn.size_hint = (None, None)
-                    btn.size = (w_scaled, h_scaled)
-                    btn.pos = pos
-                    btn.bind(on_press=self._on_turn_signal_pressed)
-                    self.add_widget(btn)
-                    self.widgets[name] = btn
-                    continue
-
-                # Other control buttons
-                if name in ('light', 'led', 'rgb', 'start'):
-                    cmd_map = {
-                        'light': 'LIT', 'led': 'LED', 'rgb': 'RGB', 
-                        'start': 'STA'
-                    }
-                    cmd = cmd_map.get(name, name.upper())
-                    btn = ImageButton(normal_source=src)
-                    btn.controller = self
-                    btn.command = cmd
-                    btn.size_hint = (None, None)
-                    btn.size = (w_scaled, h_scaled)
-                    btn.pos = pos
-                    btn.bind(on_press=self._on_toggle_control)
-                    self.add_widget(btn)
-                    self.widgets[name] = btn
-                    continue
-
-                # Horn button
-                if name == 'horn':
-                    btn = MomentaryImageButton(
-                        normal_source=src,
-                        press_command='HOR',
-                        release_command='HOF'
-                    )
-                    btn.controller = self
-                    btn.size_hint = (None, None)
-                    btn.size = (w_scaled, h_scaled)
-                    btn.pos = pos
-                    self.add_widget(btn)
-                    self.widgets[name] = btn
-                    continue
-
-                # Light horn button
-                if name == 'lightHorn':
-                    btn = MomentaryImageButton(
-                        normal_source=src,
-                        press_command='LHO',
-                        release_command='LHO'
-                    )
-                    btn.controller = self
-                    btn.size_hint = (None, None)
-                    btn.size = (w_scaled, h_scaled)
-                    btn.pos = pos
-                    self.add_widget(btn)
-                    self.widgets[name] = btn
-                    continue
-
-                # Generic image fallback
-                if os.path.exists(src):
-                    img = Image(
-                        source=src,
-                        size_hint=(None, None),
-                        size=(w_scaled, h_scaled),
-                        pos=pos,
-                        allow_stretch=True,
-                        keep_ratio=False
-                    )
-                    self.add_widget(img)
-                    self.widgets[name] = img
-
+                pos, size = frames[item.name]
+                widget.size_hint = (None, None)
+                widget.size = size
+                widget.pos = pos
+                self.add_widget(widget)
+                self.widgets[item.name] = widget
             except Exception as e:
-                print(f"❌ Error placing {name}: {e}")
+                print(f"❌ Error placing {item.name}: {e}")
 
-        cmd_log_width = max(180, win_w * 0.18)
-        cmd_log_height = max(35, win_h * 0.045)
-        self.command_log.pos = (win_w - cmd_log_width - 10, 10 + safe_area_bottom)
-        self.command_log.size = (cmd_log_width, cmd_log_height)
+        self._place_command_log(transform)
         
         self._ui_built = True
+        mark_startup(STAGE_BUILD)
         print(f"✅ UI built successfully for {win_w}x{win_h}")
 
+    def _make_image(self, item):
+        if not os.path.exists(item.src):
+            return None
+        return Image(source=item.src, allow_stretch=True, keep_ratio=False)
+
+    def _make_label(self, item):
+        box = BoxLayout(orientation='vertical')
+        box.add_widget(Label(
+            text=item.options['text'],
+            size_hint_y=1,
+            font_size='14sp',
+            color=(0, 0, 0, 1),
+            halign='center',
+            valign='middle'
+        ))
+        return box
+
+    def _make_caption(self, item):
+        """Title over a value label; the value label is kept on ``self.<label>``"""
+        options = item.options
+        box = BoxLayout(orientation='vertical')
+        value_label = Label(
+            text=options['text'],
+            size_hint_y=0.7,
+            font_size='14sp',
+            color=options['color']
+        )
+        box.add_widget(Label(
+            text=options['title'],
+            size_hint_y=0.3,
+            font_size='14sp',
+            color=(0, 0, 0, 1)
+        ))
+        box.add_widget(value_label)
+        setattr(self, options['label'], value_label)
+        if options.get('bind'):
+            self.bind(**{options['bind']: lambda inst, val: setattr(value_label, 'text', val)})
+        return box
+
+    def _make_battery(self, item):
+        battery_indicator = BatteryIndicator()
+
+        def update_battery_indicator(instance, battery_text):
+            try:
+                battery_indicator.level = int(''.join(filter(str.isdigit, battery_text)))
+            except (ValueError, TypeError) as e:
+                print(f"❌ Battery indicator update error: {e}")
+
+        self.bind(battery_level=update_battery_indicator)
+        battery_indicator.level = 85
+        return battery_indicator
+
+    def _make_battery_percent(self, item):
+        # Battery percent display - تنظیم فونت روی ۳۰
+        box = BoxLayout(orientation='vertical')
+        self.battery_percent_label = Label(
+            text=self.battery_level,
+            size_hint_y=1,
+            font_size='14sp',
+            color=(0, 0, 0, 1),
+            halign='center',
+            valign='middle',
+            bold=True
+        )
+        box.add_widget(self.battery_percent_label)
+
+        def update_battery_percent(instance, battery_text):
+            self.battery_percent_label.text = battery_text
+            try:
+                level = int(''.join(filter(str.isdigit, battery_text)))
+                if level <= 20:
+                    self.battery_percent_label.color = (1, 0, 0, 1)
+                elif level <= 60:
+                    self.battery_percent_label.color = (1, 0.5, 0, 1)
+                else:
+                    self.battery_percent_label.color = (0, 0.5, 0, 1)
+            except (ValueError, TypeError) as e:
+                print(f"❌ Battery percent update error: {e}")
+
+        self.bind(battery_level=update_battery_percent)
+        return box
+
+    def _make_steer(self, item):
+        steer = SteeringWidget()
+        steer.controller = self
+        return steer
+
+    def _make_pedal(self, item):
+        pedal = PedalWidget()
+        pedal.controller = self
+        return pedal
+
+    def _make_gear(self, item):
+        btn = ImageButton(normal_source=item.src)
+        btn.controller = self
+        btn.command = item.options['command']
+        btn.bind(on_press=self._on_gear_pressed)
+        btn.is_active = btn.command == self.current_gear
+        btn.color = btn.active_color if btn.is_active else btn.normal_color
+        return btn
+
+    def _make_button(self, item):
+        btn = ImageButton(normal_source=item.src)
+        btn.controller = self
+        btn.command = item.options.get('command', '')
+        btn.bind(on_press=getattr(self, item.options['action']))
+        return btn
+
+    def _make_momentary(self, item):
+        btn = MomentaryImageButton(
+            normal_source=item.src,
+            press_command=item.options['press'],
+            release_command=item.options['release']
+        )
+        btn.controller = self
+        return btn
+
     def _update_connection_status(self, instance, value):
         if hasattr(self, 'conn_status_label'):
             self.conn_status_label.text = value
@@ -1638,8 +2070,12 @@ class CombinedAppRoot(FloatLayout):
 
     # Control methods
     def send_command(self, command):
-        print(f"📡 Sending: {command}")
-        ok = self.ble.send_command(command)
+        parsed = split_command(command)
+        if parsed:
+            return self.send_control(*parsed)
+            
+        record(EVT_COMMAND, ord(command[0]) & 0xFF if command else 0)
+        ok = self.command_scheduler.submit(command)
         self.command_log.update_command(command)
         
         if hasattr(self, 'last_cmd_label'):
@@ -1647,6 +2083,141 @@ class CombinedAppRoot(FloatLayout):
             
         return ok
 
+    def send_control(self, channel, value):
+        """Send a continuous T/S value; unchanged values never reach the radio"""
+        with self._control_lock:
+            if self._last_control_values.get(channel) == value:
+                return True
+            self._last_control_values[channel] = value
+            ok = self.command_scheduler.submit_value(channel, value)
+        record(EVT_COMMAND, ord(channel), value)
+        
+        command = COMMAND_TEXT[channel][value]
+        self.command_log.update_command(command)
+        if hasattr(self, 'last_cmd_label'):
+            self.last_cmd_label.text = command
+        return ok
+
+    def on_write_dropped(self, key):
+        """A T/S value or frame never reached the car: queue the current value again"""
+        channels = CONTINUOUS_CHANNELS if key == 'FRAME' else (key,)
+        with self._control_lock:
+            for channel in channels:
+                value = self._last_control_values.get(channel)
+                if value is None:
+                    continue
+                self.command_scheduler.forget(channel)
+                self.command_scheduler.submit_value(channel, value)
+
+    def set_throttle(self, pedal_value):
+        """Pedal position 0..99; the shaped S value goes out on the control loop tick"""
+        self.throttle_engine.set_pedal(pedal_value)
+
+    def _control_step(self, dt):
+        """Control loop thread: advance the throttle ramp, then flush the latest T/S values"""
+        with self._control_lock:
+            value = self.throttle_engine.step(dt)
+            if value is not None:
+                self._last_control_values['S'] = value
+                self.command_scheduler.submit_value('S', value)
+                self._throttle_ui_trigger()
+            self.command_scheduler.flush()
+            link = self.ble
+            self.failsafe.tick(link.connected, link.writer.stalled_for(), link.notify_age())
+
+    def _send_heartbeat(self):
+        self.ble.send_heartbeat()
+
+    def _failsafe_stop(self, reason):
+        """Failsafe trip: stop on air first, then forget local control state"""
+        # پخش جلسه نباید بعد از توقف دوباره گاز بدهد
+        self.stop_replay()
+        with self._control_lock:
+            self.ble.emergency_stop()
+            self.reset_command_state()
+        Clock.schedule_once(lambda dt: self._on_failsafe_stop(reason))
+
+    def _on_failsafe_stop(self, reason):
+        self._sync_gear_buttons('N')
+        pedal = self.widgets.get('pedal') if hasattr(self, 'widgets') else None
+        if isinstance(pedal, PedalWidget):
+            pedal.pedal_value = 0
+        self.command_log.update_command(f"STOP ({reason})")
+
+    def _on_safety_settings_changed(self, safety):
+        self.failsafe.apply_settings(safety)
+
+    def stop_all_vehicles(self, timeout=0.2):
+        """Queue-jumping stop to every connected car and wait (bounded) until it is written"""
+        self.failsafe.trip(TRIP_PAUSE)
+        for link in self.vehicle_pool.links.values():
+            if link is not self.ble:
+                link.emergency_stop()
+        for link in self.vehicle_pool.links.values():
+            if link.connected:
+                link.writer.wait_idle(timeout)
+
+    def _update_throttle_label(self, dt=None):
+        command = COMMAND_TEXT['S'][self.throttle_engine.value]
+        self.command_log.update_command(command)
+        if hasattr(self, 'last_cmd_label'):
+            self.last_cmd_label.text = command
+
+    def send_steering(self, angle):
+        """Touch steering; goes through the same curve as tilt steering"""
+        return self.send_control('T', self.steering_curve.value(angle))
+
+    def _transmit(self, command):
+        """Hand a command to the link, packed into a frame when the device speaks binary"""
+        in_frame = self.vehicle_state.apply_command(command)
+        if in_frame and self.ble.protocol == PROTOCOL_BINARY:
+            return self.ble.send_frame(self.vehicle_state)
+        return self.ble.send_command(command)
+
+    def _transmit_frame(self, values):
+        """Batch sender for binary mode: all flushed channels go out in one frame"""
+        for channel, value in values.items():
+            self.vehicle_state.set_channel(channel, value)
+        return self.ble.send_frame(self.vehicle_state)
+
+    def on_protocol_changed(self, protocol):
+        self.command_scheduler.batch_sender = self._transmit_frame if protocol == PROTOCOL_BINARY else None
+        print(f"🔀 Command path using {protocol} protocol")
+
+    def on_link_params_changed(self, params):
+        self.set_connection_interval(params.interval_ms)
+
+    def set_connection_interval(self, interval_ms):
+        """Retune the flush rate to the negotiated connection interval"""
+        if self.command_scheduler.set_connection_interval(interval_ms):
+            self.control_loop.set_rate(1.0 / self.command_scheduler.interval)
+            print(f"⏱️ Command flush interval: {self.command_scheduler.interval * 1000:.1f} ms")
+
+    def _on_control_settings_changed(self, controls):
+        curve = SteeringCurve.from_settings(controls)
+        if curve.values != self.steering_curve.values:
+            self.steering_curve = curve
+            print(f"🎛️ Steering curve: {curve}")
+        self.throttle_engine.apply_settings(controls, get_snapshot('vehicle_settings'))
+
+    def _on_vehicle_settings_changed(self, vehicle):
+        self.throttle_engine.apply_settings(get_snapshot('control_settings'), vehicle)
+
+    def _on_advanced_settings_changed(self, advanced):
+        self.command_scheduler.hysteresis = advanced.command_hysteresis
+        self.command_scheduler.keepalive = advanced.command_keepalive
+
+    def reset_command_state(self):
+        """Forget pending and last-sent values so the next input always goes out"""
+        # قفل حلقه کنترل: هیچ مقدار قدیمی گاز بعد از پاک‌سازی ارسال نمی‌شود
+        with self._control_lock:
+            self.command_scheduler.clear()
+            self._last_control_values = {}
+            self.throttle_engine.stop()
+
+    def get_command_stats(self):
+        return self.command_scheduler.get_stats()
+
     def _on_gear_pressed(self, instance):
         for key in ('n', 'r', 'd'):
             w = self.widgets.get(key)
@@ -1657,6 +2228,7 @@ class CombinedAppRoot(FloatLayout):
         instance.is_active = True
         instance.color = instance.active_color
         self.current_gear = instance.command
+        self.throttle_engine.set_gear(instance.command)
         self.send_command(instance.command)
         print(f"🎛️ Gear changed to: {instance.command}")
 
@@ -1724,29 +2296,271 @@ class CombinedAppRoot(FloatLayout):
                 w = self.widgets.get('steer')
                 if w:
                     w.angle = 0
-                self.send_command("T50")
+                self.send_control('T', 50)
                 print("✅ Accelerometer deactivated")
 
     def update_steering_from_accelerometer(self, angle):
-        if self.accelerometer_mode:
-            Clock.schedule_once(lambda dt: self._update_steer_angle(angle))
-
-    def _update_steer_angle(self, angle):
+        """Called from the sensor worker once per control tick"""
+        if not self.accelerometer_mode:
+            return
+        value = self.steering_curve.value(angle)
+        # مقدار مستقیم از رشته worker وارد صف می‌شود؛ قفل حلقه کنترل نمی‌گذارد بعد از reset/failsafe مقدار کهنه برود
+        with self._control_lock:
+            if self._last_control_values.get('T') != value:
+                self._last_control_values['T'] = value
+                self.command_scheduler.submit_value('T', value)
+        self._steer_ui_angle = angle
+        self._steer_ui_trigger()
+
+    def _update_steer_angle(self, dt=None):
+        """UI side: at most once per frame, whatever the sensor rate"""
+        angle = self._steer_ui_angle
         w = self.widgets.get('steer')
         if w:
             w.angle = angle
             
-        if angle >= 0:
-            value = 50 + int((angle / 90) * 49)
-            value = min(99, value)
+        command = self.steering_curve.command(angle)
+        self.command_log.update_command(command)
+        if hasattr(self, 'last_cmd_label'):
+            self.last_cmd_label.text = command
+
+    # Diagnostics overlay
+    def set_latency_test(self, active):
+        if active:
+            self.ble.start_latency_test()
+            self.show_diagnostics_overlay()
         else:
-            value = 50 - int((abs(angle) / 90) * 50)
-            value = max(0, value)
+            self.ble.stop_latency_test()
+            self.hide_diagnostics_overlay()
+
+    # Session recording / replay
+    def sessions_dir(self):
+        return os.path.join(App.get_running_app().user_data_dir, 'sessions')
+
+    def start_session_recording(self):
+        filename = f"session_{time.strftime('%Y%m%d_%H%M%S')}.rcs"
+        try:
+            return get_recorder().start(os.path.join(self.sessions_dir(), filename))
+        except Exception as e:
+            print(f"❌ Session recording error: {e}")
+            return None
+
+    def stop_session_recording(self):
+        return get_recorder().stop()
+
+    def last_session_path(self):
+        try:
+            names = sorted(n for n in os.listdir(self.sessions_dir()) if n.endswith('.rcs'))
+        except OSError:
+            return None
+        return os.path.join(self.sessions_dir(), names[-1]) if names else None
+
+    def replay_session(self, path=None, speed=1.0):
+        """Feed a recorded session back through the same handlers the touches went through.
+
+        On the desktop the live link is the simulated car, so the replay
+        drives the UI. On Android the live link is a real car: the session
+        is replayed headless through ReplayPipeline on its own SimTransport.
+        """
+        path = path or self.stop_session_recording() or self.last_session_path()
+        if not path:
+            print("❌ No recorded session to replay")
+            return None
+        self.stop_replay()
+        try:
+            session = Session(path)
+        except Exception as e:
+            print(f"❌ Session open error: {e}")
+            return None
+            
+        if HAS_ANDROID:
+            return self._replay_simulated(session, speed)
+            
+        # ترد پخش فقط زمان‌بندی می‌کند؛ کار UI روی ترد Kivy انجام می‌شود و بعد از توقف اجرا نمی‌شود
+        replay = SessionReplay(session, {}, speed)
+        ui = lambda fn: (lambda channel, payload: Clock.schedule_once(
+            lambda dt: self._replay_active(replay) and fn(channel, payload)))
+        replay.handlers = {
+            REC_STEER: ui(self._replay_steer),
+            REC_PEDAL: ui(self._replay_pedal),
+            REC_BUTTON: ui(self._replay_button),
+            REC_ACCEL: lambda channel, v: self.accelerometer_manager.update_values(v[0], v[1], v[2]),
+            REC_ROTATION: lambda channel, v: self.accelerometer_manager.update_rotation(*v),
+        }
+        
+        def on_done(stats):
+            session.close()
+            # بعد از رویدادهای UI که هنوز در صف Clock هستند
+            Clock.schedule_once(lambda dt: get_recorder().resume())
+            print(f"⏹️ Replay finished: {stats}")
+            
+        # پخش از همان مسیرهای ورودی می‌گذرد؛ ضبط‌کننده تا پایان پخش خودش را ضبط نمی‌کند
+        get_recorder().pause()
+        self._replay = replay
+        replay.start(on_done)
+        print(f"▶️ Replaying {len(session)} events ({session.duration:.1f} s) from {path}")
+        return replay
+
+    def _replay_simulated(self, session, speed):
+        """Replay through a private simulated car; the real link is never touched"""
+        groups = ('control_settings', 'accelerometer_settings', 'vehicle_settings', 'advanced_settings')
+        pipeline = ReplayPipeline(SimTransport.from_settings(get_snapshot('advanced_settings')),
+                                  {group: get_snapshot(group) for group in groups})
+        address = next(iter(pipeline.transport.cars))
+        replay = SessionReplay(session, pipeline.handlers(), speed, on_time=pipeline.advance)
+        
+        def prepare():
+            if pipeline.connect(address):
+                return True
+            print("❌ Simulated car for replay did not connect")
+            return False
             
-        self.send_command(f"T{value:02d}")
+        def on_done(stats):
+            pipeline.close()
+            session.close()
+            print(f"⏹️ Simulated replay finished: {stats} {pipeline.get_stats()['link']}")
+            
+        self._replay = replay
+        replay.start(on_done, prepare)
+        print(f"▶️ Replaying {len(session)} events ({session.duration:.1f} s) on a simulated car")
+        return replay
+
+    def stop_replay(self):
+        """Stop a running replay; events it already queued for the UI are discarded"""
+        replay = self._replay
+        if replay is None or replay.cancelled:
+            return False
+        replay.stop()
+        print("⏹️ Replay stopped")
+        return True
+
+    def _replay_active(self, replay):
+        return replay is not None and replay is self._replay and not replay.cancelled
+
+    def _replay_steer(self, phase, values):
+        w = self.widgets.get('steer')
+        if phase == PHASE_UP:
+            if w:
+                w.angle = 0
+            self.send_control('T', 50)
+            return
+        if w:
+            w.angle = values[0]
+        self.send_steering(values[0])
+
+    def _replay_pedal(self, phase, values):
+        value = 0 if phase == PHASE_UP else int(values[0])
+        pedal = self.widgets.get('pedal')
+        if isinstance(pedal, PedalWidget):
+            pedal.pedal_value = value
+        self.set_throttle(value)
+
+    def _replay_button(self, phase, data):
+        """Press the button that sent this command, so its UI handler runs as well"""
+        command = data.decode('utf-8', errors='replace')
+        for w in self.widgets.values():
+            if not isinstance(w, ImageButton):
+                continue
+            if isinstance(w, MomentaryImageButton):
+                if command in (w.press_command, w.release_command):
+                    w.dispatch('on_release' if phase == PHASE_UP else 'on_press')
+                    return
+            elif w.command == command:
+                w.dispatch('on_press')
+                return
+        self.send_command(command)
+
+    def export_latency_report(self):
+        """Save the current latency histogram and raw samples as JSON"""
+        probe = self.ble.latency_probe
+        if not probe:
+            print("❌ No latency data to export")
+            return None
+            
+        filename = f"latency_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        path = os.path.join(App.get_running_app().user_data_dir, filename)
+        try:
+            probe.export(path, extra={
+                'device': self.ble.device_name,
+                'protocol': self.ble.protocol,
+                'mtu': self.ble.link_params.mtu,
+                'connection_priority': self.ble.link_params.priority,
+            })
+            print(f"✅ Latency report exported: {path}")
+            return path
+        except Exception as e:
+            print(f"❌ Latency export error: {e}")
+            return None
+
+    def show_diagnostics_overlay(self):
+        if not hasattr(self, 'diagnostics_label'):
+            self.diagnostics_label = Label(
+                text='',
+                size_hint=(None, None),
+                font_size='12sp',
+                color=(0, 0, 0, 1),
+                halign='left',
+                valign='top'
+            )
+        if not self.diagnostics_label.parent:
+            self.add_widget(self.diagnostics_label)
+        self._position_diagnostics_overlay()
+        
+        if not getattr(self, '_diagnostics_event', None):
+            self._diagnostics_event = Clock.schedule_interval(self._refresh_diagnostics, 0.5)
+        self._refresh_diagnostics(0)
+
+    def hide_diagnostics_overlay(self):
+        if getattr(self, '_diagnostics_event', None):
+            self._diagnostics_event.cancel()
+            self._diagnostics_event = None
+        if hasattr(self, 'diagnostics_label') and self.diagnostics_label.parent:
+            self.remove_widget(self.diagnostics_label)
+
+    def _position_diagnostics_overlay(self):
+        if not hasattr(self, 'diagnostics_label'):
+            return
+        win_w, win_h = Window.size
+        self.diagnostics_label.size = (win_w * 0.5, max(60, win_h * 0.1))
+        self.diagnostics_label.text_size = self.diagnostics_label.size
+        self.diagnostics_label.pos = (10, win_h - self.diagnostics_label.height - 10)
+
+    def _diagnostic_lines(self):
+        manager = self.ble.connection_manager
+        lines = [f"Link: {manager.state}  connect {self._format_ms(manager.timings['last_connect_ms'])}"
+                 f"  reconnect {self._format_ms(manager.timings['last_reconnect_ms'])}"]
+        if len(self.vehicle_pool) > 1:
+            pool = self.vehicle_pool.aggregate_stats()
+            lines.append(f"Cars: {pool['connected']}/{pool['cars']} connected  "
+                         f"{pool['writes_per_second']:.0f} writes/s  {pool['totals'].get('bytes', 0)} bytes")
+        lines.append(self.control_loop.summary())
+        failsafe = self.failsafe.get_stats()
+        lines.append(f"Failsafe: {'TRIPPED (' + failsafe['tripped'] + ')' if failsafe['tripped'] else 'armed'}"
+                     f"  stop last {self._format_ms(failsafe['stop_last_ms'])}"
+                     f"  max {self._format_ms(failsafe['stop_max_ms'])}  HB {failsafe['heartbeats']}")
+        if self.accelerometer_manager.is_active:
+            sensor = self.accelerometer_manager.get_sensor_stats()
+            lines.append(f"Sensor: {sensor['sample_rate']:.0f} Hz ({sensor['mode']})  "
+                         f"batch max {sensor['max_batch']}  overruns {sensor['overruns']}")
+        if self.ble.latency_probe:
+            lines.append(self.ble.latency_probe.summary())
+        lines.append(f"Startup: {get_timeline().summary()}")
+        return lines
+
+    @staticmethod
+    def _format_ms(value):
+        return f"{value:.0f} ms" if value is not None else "--"
+
+    def _refresh_diagnostics(self, dt):
+        self.diagnostics_label.text = '\n'.join(self._diagnostic_lines())
 
     # Bluetooth UI
     def show_bluetooth_devices(self, instance=None):
+        from kivy.uix.button import Button
+        from kivy.uix.popup import Popup
+        from kivy.uix.scrollview import ScrollView
+        from kivy.uix.togglebutton import ToggleButton
+
         content = BoxLayout(orientation='vertical', spacing=10, padding=10)
         title = Label(text='Bluetooth BLE Devices', size_hint_y=0.12, font_size='18sp')
         content.add_widget(title)
@@ -1758,6 +2572,24 @@ class CombinedAppRoot(FloatLayout):
         scroll.add_widget(self.device_list)
         content.add_widget(scroll)
         
+        # خودروهای متصل: جابجایی فوری بین آن‌ها و توقف همگانی
+        if len(self.vehicle_pool):
+            cars = BoxLayout(size_hint_y=0.15, spacing=5)
+            for address, link in self.vehicle_pool.links.items():
+                car_btn = ToggleButton(
+                    text=f"{link.device_name}\n{link.connection_manager.state}",
+                    state='down' if link is self.ble else 'normal',
+                    group='active_car',
+                    halign='center',
+                    font_size='13sp'
+                )
+                car_btn.bind(on_press=lambda inst, addr=address: self.switch_vehicle(addr))
+                cars.add_widget(car_btn)
+            stop_btn = Button(text='ALL STOP', background_color=(1, 0, 0, 1), font_size='14sp', bold=True)
+            stop_btn.bind(on_press=self.all_stop)
+            cars.add_widget(stop_btn)
+            content.add_widget(cars)
+        
         btns = BoxLayout(size_hint_y=0.2, spacing=10)
         scan_btn = Button(
             text='Scan Again', 
@@ -1774,6 +2606,7 @@ class CombinedAppRoot(FloatLayout):
         
         popup = Popup(title='Select BLE Device', content=content, size_hint=(0.85, 0.8))
         close_btn.bind(on_press=lambda x: popup.dismiss())
+        popup.bind(on_dismiss=lambda x: self.ble.stop_scan(notify=False))
         
         btns.add_widget(scan_btn)
         btns.add_widget(close_btn)
@@ -1793,7 +2626,13 @@ class CombinedAppRoot(FloatLayout):
         Clock.schedule_once(lambda dt: self._update_device_list(devices))
 
     def _update_device_list(self, devices):
+        from kivy.uix.button import Button
+
         self.device_list.clear_widgets()
+        if not devices and self.ble.scanning:
+            loading = Label(text='Scanning for BLE devices...', size_hint_y=None, height=60, font_size='16sp')
+            self.device_list.add_widget(loading)
+            return
         if not devices:
             no_devices = Label(
                 text='No BLE devices found\nMake sure Bluetooth is enabled', 
@@ -1807,8 +2646,9 @@ class CombinedAppRoot(FloatLayout):
             return
             
         for dev in devices:
+            rssi = self.ble.get_scan_rssi(dev)
             btn = Button(
-                text=dev, 
+                text=f"{dev}   {rssi} dBm" if rssi is not None else dev, 
                 size_hint_y=None, 
                 height=70,
                 text_size=(None, None),
@@ -1831,36 +2671,81 @@ class CombinedAppRoot(FloatLayout):
         if hasattr(self, 'bt_popup'):
             self.bt_popup.dismiss()
         
+        address = addr.split('(')[-1].split(')')[0] if '(' in addr else addr
+        link = self.vehicle_pool.acquire(address)
+        if link is None:
+            self.show_connection_message(f"Maximum of {self.vehicle_pool.max_links} cars already connected.", "error")
+            return
+            
+        if link is not self.ble:
+            self.switch_vehicle(address)
+        if link.connected:
+            return
+        
         self.connection_status = "Connecting..."
         self.connected_device = f"Connecting: {addr.split(' ')[0]}"
-        
-        success = self.ble.connect(addr)
-        
-        if success:
+        self._pending_connect_addr = addr
+        
+        # نتیجه اتصال از طریق on_connection_state می‌رسد؛ UI منتظر نمی‌ماند
+        link.connect(addr)
+
+    def on_connection_state(self, state, info):
+        """React to connection manager transitions (always on the Kivy thread)"""
+        if state == STATE_CONNECTING:
+            self.connection_status = "Connecting..."
+        elif state == STATE_DISCOVERING:
+            self.connection_status = "Discovering Services"
+        elif state == STATE_BACKOFF:
+            self.connection_status = f"Reconnecting ({info.get('attempt')}/{self.ble.connection_manager.reconnect_attempts})..."
+            self.connected_device = f"Reconnecting: {self.ble.device_name}"
+            if get_snapshot('safety_settings').auto_brake_on_disconnect:
+                # ورودی راننده را صفر کن تا بعد از اتصال مجدد گاز قبلی ادامه پیدا نکند
+                self.reset_command_state()
+                self._on_failsafe_stop(TRIP_DISCONNECT)
+        elif state == STATE_READY:
             self.connection_status = "Connected"
-            self.connected_device = f"Connected: {addr.split(' ')[0]}"
-            print(f"✅ Connected to: {addr}")
-            
-            if get_setting('auto_connect', True):
-                set_setting('last_connected_device', addr)
-            
-            if not HAS_ANDROID:
-                # شبیه‌سازی باتری برای محیط غیر اندروید
-                def simulate_battery():
-                    self.ble.battery_level = 85
-                    if self.ble.battery_update_callback:
-                        self.ble.battery_update_callback(85)
+            self.connected_device = f"Connected: {self.ble.device_name}"
+            if info.get('initial'):
+                addr = getattr(self, '_pending_connect_addr', None)
+                print(f"✅ Connected to: {addr}")
+                if mark_startup(STAGE_CONNECTED) is not None:
+                    print(f"⏱️ Startup: {get_timeline().summary()}")
+                if addr and get_setting('auto_connect', True):
+                    set_setting('last_connected_device', addr)
                 
-                Clock.schedule_once(lambda dt: simulate_battery(), 1)
-                
-            self.show_connection_message("Connected successfully!", "success")
-        else:
-            self.connection_status = "Connection Failed"
+                if not HAS_ANDROID:
+                    # شبیه‌سازی باتری برای محیط غیر اندروید
+                    def simulate_battery():
+                        self.ble.battery_level = 85
+                        if self.ble.battery_update_callback:
+                            self.ble.battery_update_callback(85)
+                    
+                    Clock.schedule_once(lambda dt: simulate_battery(), 1)
+                    
+                self.show_connection_message("Connected successfully!", "success")
+            else:
+                print(f"✅ Reconnected in {self.ble.connection_manager.timings['last_reconnect_ms']:.0f} ms")
+                if get_snapshot('safety_settings').auto_brake_on_disconnect:
+                    # اولین چیزی که خودرو بعد از قطع می‌شنود فرمان توقف است
+                    self.failsafe.trip(TRIP_DISCONNECT)
+        elif state == STATE_IDLE:
             self.connected_device = "Not Connected"
-            print(f"❌ Failed to connect to: {addr}")
-            self.show_connection_message("Connection failed! Check device availability and range.", "error")
+            self.reset_command_state()
+            if info.get('failed'):
+                # خودروی ناموفق جای خود را در استخر آزاد می‌کند
+                address = self.vehicle_pool.address_of(self.ble)
+                if address:
+                    self.vehicle_pool.release(address)
+                self.connection_status = "Connection Failed"
+                print(f"❌ Failed to connect to: {self.ble.device_name} ({info.get('reason')})")
+                self.show_connection_message("Connection failed! Check device availability and range.", "error")
+            else:
+                self.connection_status = "Disconnected"
 
     def show_connection_message(self, message, msg_type):
+        from kivy.uix.button import Button
+        from kivy.uix.popup import Popup
+
         content = BoxLayout(orientation='vertical', spacing=15, padding=25)
         
         color = (0, 0.7, 0, 1) if msg_type == "success" else (1, 0, 0, 1)
@@ -1899,7 +2784,12 @@ class CombinedAppRoot(FloatLayout):
         popup.open()
 
     # Settings menu
-    def show_settings_menu(self):
+    def show_settings_menu(self, instance=None):
+        from kivy.uix.button import Button
+        from kivy.uix.popup import Popup
+        from kivy.uix.slider import Slider
+        from kivy.uix.togglebutton import ToggleButton
+
         saved_sensitivity = get_setting('sensitivity', 1.0)
         auto_connect = get_setting('auto_connect', True)
         battery_warning = get_setting('battery_warning_level', 20)
@@ -1921,7 +2811,6 @@ class CombinedAppRoot(FloatLayout):
         def on_sensitivity_change(instance, value):
             self.accelerometer_manager.set_sensitivity(value)
             sens_label.text = f'Sensitivity: {value:.1f}'
-            set_setting('sensitivity', value)
             
         slider.bind(value=on_sensitivity_change)
         sens_layout.add_widget(slider)
@@ -1969,24 +2858,103 @@ class CombinedAppRoot(FloatLayout):
         
         content.add_widget(toggles_layout)
         
+        # حالت سنسور: مصرف کم (دسته‌بندی) / متعادل / مسابقه (سریع‌ترین نرخ)
+        sensor_layout = BoxLayout(orientation='horizontal', size_hint_y=0.1, spacing=10)
+        current_mode = self.accelerometer_manager.accel_settings.sensor_mode
+        for mode, text in (('low_power', 'Low Power'), ('balanced', 'Balanced'), ('racing', 'Racing')):
+            mode_btn = ToggleButton(
+                text=text,
+                group='sensor_mode',
+                state='down' if mode == current_mode else 'normal',
+                allow_no_selection=False,
+                font_size='16sp'
+            )
+            mode_btn.bind(on_press=lambda inst, m=mode: self.accelerometer_manager.set_sensor_mode(m))
+            sensor_layout.add_widget(mode_btn)
+        content.add_widget(sensor_layout)
+        
+        # ابزار تشخیصی: تست تأخیر رفت‌وبرگشت
+        diagnostics_layout = BoxLayout(orientation='horizontal', size_hint_y=0.1, spacing=10)
+        latency_running = bool(self.ble._ping_event)
+        latency_switch = ToggleButton(
+            text='Latency Test: ON' if latency_running else 'Latency Test: OFF',
+            state='down' if latency_running else 'normal',
+            size_hint_x=0.6,
+            font_size='16sp'
+        )
+        
+        def on_latency_toggle(instance):
+            active = instance.state == 'down'
+            instance.text = 'Latency Test: ON' if active else 'Latency Test: OFF'
+            self.set_latency_test(active)
+        
+        latency_switch.bind(on_press=on_latency_toggle)
+        export_btn = Button(text='Export', size_hint_x=0.4, font_size='16sp')
+        export_btn.bind(on_press=lambda x: self.export_latency_report())
+        diagnostics_layout.add_widget(latency_switch)
+        diagnostics_layout.add_widget(export_btn)
+        content.add_widget(diagnostics_layout)
+        
+        # ضبط جلسه رانندگی و پخش دوباره آخرین جلسه
+        session_layout = BoxLayout(orientation='horizontal', size_hint_y=0.1, spacing=10)
+        recording = get_recorder().active
+        record_switch = ToggleButton(
+            text='Record Session: ON' if recording else 'Record Session: OFF',
+            state='down' if recording else 'normal',
+            size_hint_x=0.6,
+            font_size='16sp'
+        )
+        
+        def on_record_toggle(instance):
+            active = instance.state == 'down'
+            instance.text = 'Record Session: ON' if active else 'Record Session: OFF'
+            if active:
+                self.start_session_recording()
+            else:
+                self.stop_session_recording()
+        
+        record_switch.bind(on_press=on_record_toggle)
+        replaying = self._replay is not None and self._replay.running
+        replay_btn = Button(text='Stop Replay' if replaying else 'Replay Last', size_hint_x=0.4, font_size='16sp')
+        
+        def on_replay_press(instance):
+            if self._replay is not None and self._replay.running:
+                self.stop_replay()
+                instance.text = 'Replay Last'
+            elif self.replay_session():
+                instance.text = 'Stop Replay'
+        
+        replay_btn.bind(on_press=on_replay_press)
+        session_layout.add_widget(record_switch)
+        session_layout.add_widget(replay_btn)
+        content.add_widget(session_layout)
+        
         btns = BoxLayout(size_hint_y=0.2, spacing=10)
         
+        calibrate_btn = Button(
+            text='Calibrate',
+            size_hint_x=0.3,
+            font_size='16sp'
+        )
+        calibrate_btn.bind(on_press=lambda x: self.accelerometer_manager.calibrate())
+        
         reset_btn = Button(
             text='Reset to Default', 
-            size_hint_x=0.5,
+            size_hint_x=0.4,
             font_size='16sp'
         )
         reset_btn.bind(on_press=lambda x: self._reset_settings(slider, sens_label, battery_slider, battery_label, auto_connect_switch))
         
         close_btn = Button(
             text='Close', 
-            size_hint_x=0.5,
+            size_hint_x=0.3,
             font_size='16sp'
         )
         
         popup = Popup(title='Settings', content=content, size_hint=(0.85, 0.7))
         close_btn.bind(on_press=lambda x: popup.dismiss())
         
+        btns.add_widget(calibrate_btn)
         btns.add_widget(reset_btn)
         btns.add_widget(close_btn)
         content.add_widget(btns)
@@ -2009,25 +2977,65 @@ class CombinedAppRoot(FloatLayout):
         
         print("✅ All settings reset to default")
 
+mark_startup(STAGE_IMPORT)
+
 # App class
 class BluetoothRC(App):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.settings_manager = SettingsManager()
+        # تله‌متری باینری؛ log_level سطح، data_logging ذخیره در فایل و log_console چاپ را کنترل می‌کنند
+        self.telemetry = get_telemetry()
+        self.telemetry.apply_settings(
+            self.settings_manager.subscribe('advanced_settings', self._on_advanced_settings_changed),
+            self.telemetry_path()
+        )
+    
+    def telemetry_path(self):
+        return os.path.join(self.user_data_dir, 'telemetry.bin')
+    
+    def gatt_cache_path(self):
+        return os.path.join(self.user_data_dir, 'ble_gatt_cache.json')
+    
+    def _on_advanced_settings_changed(self, advanced):
+        self.telemetry.apply_settings(advanced, self.telemetry_path())
     
     def build(self):
         self.title = "Bluetooth RC Car Controller"
         print("🚀 Starting Bluetooth RC Car Controller...")
-        return CombinedAppRoot()
+        setup_fullscreen()
+        set_landscape()
+        Window.bind(on_flip=self._on_first_frame)
+        return CombinedAppRoot(gatt_cache=GattCache(self.gatt_cache_path()))
+
+    def _on_first_frame(self, window):
+        Window.unbind(on_flip=self._on_first_frame)
+        mark_startup(STAGE_FIRST_FRAME)
+        print(f"⏱️ First frame at {Window.size[0]}x{Window.size[1]}: {get_timeline().summary()}")
 
     def on_pause(self):
         root = self.root
+        if hasattr(root, 'stop_replay'):
+            root.stop_replay()
         if hasattr(root, 'accelerometer_manager'):
             root.accelerometer_manager.stop()
+        if hasattr(root, 'reset_command_state'):
+            root.reset_command_state()
+        if hasattr(root, 'control_loop'):
+            root.control_loop.stop()
         if hasattr(root, 'ble'):
-            root.ble.disconnect()
+            root.ble.stop_latency_test()
+            root.ble.stop_scan(notify=False)
+        if hasattr(root, 'stop_all_vehicles'):
+            # قبل از قطع اتصال، فرمان توقف باید واقعاً ارسال شده باشد
+            root.stop_all_vehicles()
+        if hasattr(root, 'vehicle_pool'):
+            root.vehicle_pool.disconnect_all()
         if hasattr(root, '_reset_turn_signals'):
             root._reset_turn_signals()
+        self.settings_manager.flush()
+        self.telemetry.flush()
+        get_recorder().flush()
         print("⏸️ App paused")
         return True
 
@@ -2037,6 +3045,8 @@ class BluetoothRC(App):
             Window.fullscreen = 'auto'
         if hasattr(root, 'accelerometer_manager') and getattr(root, 'accelerometer_mode', False):
             root.accelerometer_manager.start()
+        if hasattr(root, 'control_loop'):
+            root.control_loop.start()
         if hasattr(root, '_reset_turn_signals'):
             root._reset_turn_signals()
         print("▶️ App resumed")
@@ -2045,10 +3055,25 @@ class BluetoothRC(App):
     def on_stop(self):
         """تمیز کردن منابع هنگام بسته شدن اپلیکیشن"""
         root = self.root
+        if hasattr(root, 'stop_replay'):
+            root.stop_replay()
         if hasattr(root, 'accelerometer_manager'):
             root.accelerometer_manager.stop()
-        if hasattr(root, 'ble'):
-            root.ble.disconnect()
+        # اول حلقه کنترل تا هیچ T/S دیگری وارد صف نشود، بعد توقف روی هوا، آخر قطع اتصال
+        if hasattr(root, 'control_loop'):
+            root.control_loop.stop()
+            print(f"📊 {root.control_loop.summary()}")
+        if hasattr(root, 'stop_all_vehicles'):
+            root.stop_all_vehicles()
+        if hasattr(root, 'vehicle_pool'):
+            print(f"📊 Writer stats: {root.vehicle_pool.aggregate_stats()['totals']}")
+            root.vehicle_pool.shutdown()
+        if hasattr(root, 'command_scheduler'):
+            print(f"📊 Command stats: {root.get_command_stats()}")
+        self.settings_manager.flush()
+        print(f"📊 Telemetry: {self.telemetry.get_stats()}")
+        self.telemetry.stop()
+        get_recorder().stop()
         print("🛑 App stopped - resources cleaned up")
         return True
 
@@ -0,0 +1,156 @@
+import threading
+import time
+
+from telemetry import record, EVT_SENSOR_ERROR
+
+SAMPLE_ACCEL = 0
+SAMPLE_ROTATION = 1
+
+# حالت‌های نمونه‌برداری: (دوره نمونه‌برداری µs، حداکثر تأخیر گزارش µs، تیک worker s)
+# دوره 0 یعنی سریع‌ترین نرخ سنسور؛ تأخیر گزارش > 0 یعنی دسته‌بندی سخت‌افزاری در FIFO
+SENSOR_MODES = {
+    'racing': (0, 0, 0.01),
+    'balanced': (20000, 0, 0.02),
+    'low_power': (66667, 250000, 0.066),
+}
+
+
+def sensor_timing(accel):
+    """(period_us, max_report_latency_us, tick) for an accelerometer_settings snapshot"""
+    if accel.sensor_mode in SENSOR_MODES:
+        return SENSOR_MODES[accel.sensor_mode]
+    # حالت custom: مقادیر دستی تنظیمات
+    return accel.sensor_period_us, accel.sensor_max_latency_us, accel.sensor_tick
+
+
+class SampleRing:
+    """Fixed-size single-producer / single-consumer ring of sensor samples.
+
+    The sensor callback only stores a tuple and bumps ``head``; the worker
+    only moves ``tail``. Each index has a single writer and int assignment
+    is atomic under the GIL, so no lock is taken on either side. When the
+    producer laps the consumer the oldest samples are skipped and counted
+    as overruns.
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self.overruns = 0
+
+    def push(self, sample):
+        head = self.head
+        self._slots[head % self.capacity] = sample
+        self.head = head + 1
+
+    def drain(self):
+        """All samples pushed since the last drain, oldest first"""
+        head = self.head
+        tail = self.tail
+        if head - tail > self.capacity:
+            self.overruns += head - tail - self.capacity
+            tail = head - self.capacity
+        batch = [self._slots[i % self.capacity] for i in range(tail, head)]
+        self.tail = head
+        return batch
+
+    def __len__(self):
+        return min(self.capacity, self.head - self.tail)
+
+
+class SensorWorker:
+    """Consumes the sample ring in batches at a fixed tick on its own thread.
+
+    ``process_fn(batch)`` turns one batch into a value (or None when there
+    is nothing new); ``publish_fn(value)`` is then called once per tick.
+    """
+
+    def __init__(self, ring, process_fn, publish_fn, tick=0.02, clock=time.monotonic):
+        self.ring = ring
+        self.process_fn = process_fn
+        self.publish_fn = publish_fn
+        self.tick = tick
+        self.clock = clock
+        self._running = False
+        self._wake = threading.Event()
+        self._thread = None
+        self._rate_samples = 0
+        self._rate_since = clock()
+        self.sample_rate = 0.0
+        self.stats = {
+            'ticks': 0,
+            'samples': 0,
+            'published': 0,
+            'idle_ticks': 0,
+            'late_ticks': 0,
+            'max_batch': 0,
+            'errors': 0,
+        }
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run, name='sensor-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=1.0):
+        self._running = False
+        self._wake.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def _run(self):
+        deadline = self.clock()
+        while self._running:
+            deadline += self.tick
+            self.run_once()
+            delay = deadline - self.clock()
+            if delay > 0:
+                self._wake.wait(delay)
+            else:
+                # عقب افتادیم؛ تیک‌های از دست‌رفته را جبران نکن
+                self.stats['late_ticks'] += 1
+                deadline = self.clock()
+
+    def run_once(self):
+        batch = self.ring.drain()
+        self.stats['ticks'] += 1
+        if not batch:
+            self.stats['idle_ticks'] += 1
+            return None
+        self.stats['samples'] += len(batch)
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+        try:
+            value = self.process_fn(batch)
+            if value is not None:
+                self.publish_fn(value)
+                self.stats['published'] += 1
+            return value
+        except Exception:
+            self.stats['errors'] += 1
+            record(EVT_SENSOR_ERROR, value=self.stats['errors'])
+            return None
+
+    def get_stats(self):
+        """Worker stats plus the sample rate (Hz) measured since the previous call"""
+        now = self.clock()
+        samples = self.stats['samples']
+        if now > self._rate_since:
+            self.sample_rate = (samples - self._rate_samples) / (now - self._rate_since)
+        self._rate_samples = samples
+        self._rate_since = now
+
+        stats = dict(self.stats)
+        stats['sample_rate'] = self.sample_rate
+        stats['overruns'] = self.ring.overruns
+        stats['backlog'] = len(self.ring)
+        return stats
@@ -0,0 +1,409 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+from ble_writer import BLEWriter, ConnectionParameters, command_priority, PRIORITY_CONTINUOUS
+from command_scheduler import CommandScheduler
+from settings_schema import build_snapshot
+from steering_curve import SteeringCurve, PAYLOAD_BY_TEXT
+from steering_filters import SteeringPipeline
+from throttle_engine import ThrottleEngine
+
+# نوع رکوردها
+REC_STEER = 1       # channel: phase, a: angle (degrees)
+REC_PEDAL = 2       # channel: phase, a: pedal 0..99
+REC_ACCEL = 3       # a, b, c: x, y, z
+REC_ROTATION = 4    # a, b, c, d: quaternion x, y, z, w
+REC_BUTTON = 5      # channel: phase, data: command the button sent
+REC_COMMAND = 6     # channel: payload length, data: payload as handed to the writer
+
+PHASE_DOWN = 0
+PHASE_MOVE = 1
+PHASE_UP = 2
+
+# رکوردهایی که به جای چهار عدد، بایت خام نگه می‌دارند
+BYTE_KINDS = (REC_BUTTON, REC_COMMAND)
+
+# هر دو قالب 28 بایت هستند تا فایل با اندیس مستقیم خوانده شود
+VALUE_RECORD = struct.Struct('<dBB2x4f')
+BYTES_RECORD = struct.Struct('<dBB2x16s')
+RECORD_SIZE = VALUE_RECORD.size
+SESSION_MAGIC = b'RCSN'
+SESSION_VERSION = 1
+# magic, version, record size, wall clock at start
+SESSION_HEADER = struct.Struct('<4sHHd')
+
+
+class SessionRecorder:
+    """Append-only recorder of input events and outgoing commands.
+
+    Every record has the same size and a timestamp relative to ``start``,
+    so a session file can be memory-mapped and indexed directly
+    (``Session``). ``record`` and ``record_bytes`` are no-ops while the
+    recorder is inactive or paused and are safe to call from any thread.
+    ``pause``/``resume`` nest, so overlapping replays each hold their own
+    pause.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.path = None
+        self.count = 0
+        self._file = None
+        self._origin = 0.0
+        self._paused = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return self._file is not None
+
+    def start(self, path):
+        self.stop()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        f = open(path, 'wb', buffering=65536)
+        f.write(SESSION_HEADER.pack(SESSION_MAGIC, SESSION_VERSION, RECORD_SIZE, time.time()))
+        with self._lock:
+            self.path = path
+            self.count = 0
+            self._origin = self.clock()
+            self._file = f
+        print(f"⏺️ Session recording: {path}")
+        return path
+
+    def stop(self):
+        with self._lock:
+            f = self._file
+            self._file = None
+        if f is None:
+            return None
+        f.close()
+        print(f"⏹️ Session recorded: {self.count} events -> {self.path}")
+        return self.path
+
+    def pause(self):
+        """Stop taking events (e.g. while a replay drives the same input paths)"""
+        with self._lock:
+            self._paused += 1
+
+    def resume(self):
+        with self._lock:
+            self._paused = max(0, self._paused - 1)
+
+    @property
+    def paused(self):
+        return self._paused > 0
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def record(self, kind, channel=0, a=0.0, b=0.0, c=0.0, d=0.0):
+        if self._file is None or self._paused:
+            return
+        data = VALUE_RECORD.pack(self.clock() - self._origin, kind, channel, a, b, c, d)
+        self._append(data)
+
+    def record_bytes(self, kind, channel, data):
+        if self._file is None or self._paused:
+            return
+        self._append(BYTES_RECORD.pack(self.clock() - self._origin, kind, channel, bytes(data[:16])))
+
+    def _append(self, data):
+        with self._lock:
+            if self._file is not None:
+                self._file.write(data)
+                self.count += 1
+
+
+class Session:
+    """Read-only, memory-mapped view of a recorded session.
+
+    Items are ``(t, kind, channel, payload)`` where payload is a 4-tuple of
+    floats, or bytes for ``BYTE_KINDS``. A partly written last record (the
+    app was killed mid-write) is ignored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size, wall = SESSION_HEADER.unpack_from(self._map, 0)
+        if magic != SESSION_MAGIC or size != RECORD_SIZE:
+            self.close()
+            raise ValueError(f"not a session file: {path}")
+        self.version = version
+        self.started_at = wall
+        self._count = (len(self._map) - SESSION_HEADER.size) // RECORD_SIZE
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        offset = SESSION_HEADER.size + i * RECORD_SIZE
+        kind = self._map[offset + 8]
+        if kind in BYTE_KINDS:
+            t, kind, channel, data = BYTES_RECORD.unpack_from(self._map, offset)
+            return t, kind, channel, data.rstrip(b'\0') if kind == REC_BUTTON else data[:channel]
+        t, kind, channel, a, b, c, d = VALUE_RECORD.unpack_from(self._map, offset)
+        return t, kind, channel, (a, b, c, d)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    @property
+    def duration(self):
+        return self[-1][0] if self._count else 0.0
+
+    def counts(self):
+        counts = {}
+        for i in range(self._count):
+            kind = self._map[SESSION_HEADER.size + i * RECORD_SIZE + 8]
+            counts[kind] = counts.get(kind, 0) + 1
+        return counts
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SessionReplay:
+    """Feeds a session back through ``handlers`` ({kind: fn(channel, payload)}).
+
+    ``speed`` 1.0 replays in real time, 2.0 twice as fast, 0 as fast as
+    possible. ``on_time(t)`` is called with the session time before every
+    event, so a headless pipeline can run its control ticks on session
+    time. Kinds without a handler are skipped. ``stop()`` is final: a
+    stopped replay never delivers another event, even if it had not
+    started yet.
+    """
+
+    def __init__(self, session, handlers, speed=1.0, on_time=None, clock=time.perf_counter):
+        self.session = session
+        self.handlers = handlers
+        self.speed = speed
+        self.on_time = on_time
+        self.clock = clock
+        self._running = False
+        self._cancelled = False
+        self._thread = None
+        self.stats = {'events': 0, 'skipped': 0, 'lag_max_ms': 0.0, 'wall_s': 0.0}
+
+    def run(self):
+        """Replay on the calling thread; returns the stats"""
+        self._running = not self._cancelled
+        start = self.clock()
+        for t, kind, channel, payload in self.session:
+            if self._cancelled:
+                break
+            if self.speed > 0:
+                due = start + t / self.speed
+                delay = due - self.clock()
+                if delay > 0:
+                    time.sleep(delay)
+                    if self._cancelled:
+                        break
+                else:
+                    self.stats['lag_max_ms'] = max(self.stats['lag_max_ms'], -delay * 1000.0)
+            handler = self.handlers.get(kind)
+            if handler is None:
+                self.stats['skipped'] += 1
+                continue
+            if self.on_time:
+                self.on_time(t)
+            handler(channel, payload)
+            self.stats['events'] += 1
+        self._running = False
+        self.stats['wall_s'] = self.clock() - start
+        return self.stats
+
+    def start(self, on_done=None, prepare=None):
+        """Replay on a thread; ``prepare()`` runs there first and may return False to skip the replay"""
+        self._running = True
+
+        def target():
+            if prepare is None or prepare():
+                stats = self.run()
+            else:
+                self._running = False
+                stats = self.stats
+            if on_done:
+                on_done(stats)
+        self._thread = threading.Thread(target=target, name='session-replay', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._cancelled = True
+        self._running = False
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+
+class ReplayPipeline:
+    """Headless copy of the app's send path, for replays and load tests.
+
+    touch / tilt / pedal / button events -> SteeringCurve, SteeringPipeline
+    and ThrottleEngine -> CommandScheduler -> BLEWriter -> ``transport``
+    (a ``SimTransport``). Control ticks run on session time through
+    ``advance(t)``, so the commands generated do not depend on replay
+    speed; the writer and the simulated link run on the real clock, as in
+    the app. Only the text protocol is driven.
+    """
+
+    def __init__(self, transport, settings=None):
+        settings = settings or {}
+        snapshot = lambda group: settings.get(group) or build_snapshot(group, {})
+        controls = snapshot('control_settings')
+        advanced = snapshot('advanced_settings')
+        self.transport = transport
+        self.steering_curve = SteeringCurve.from_settings(controls)
+        self.tilt = SteeringPipeline.from_settings(controls, snapshot('accelerometer_settings'))
+        self.throttle = ThrottleEngine.from_settings(controls, snapshot('vehicle_settings'))
+        self.params = ConnectionParameters()
+        self.writer = BLEWriter(
+            transport.write,
+            max_queue=advanced.ble_write_queue_size,
+            write_timeout=advanced.ble_write_timeout,
+            rate=advanced.ble_write_rate,
+            params=self.params
+        )
+        self.scheduler = CommandScheduler(
+            self.transmit,
+            interval=advanced.command_flush_interval,
+            hysteresis=advanced.command_hysteresis,
+            keepalive=advanced.command_keepalive
+        )
+        self.mtu = advanced.ble_mtu_size
+        self.with_response = False
+        self._now = None
+        self._connected = threading.Event()
+        transport.on_connected = self._connected.set
+        transport.on_mtu_changed = self._on_mtu_changed
+        transport.on_write_complete = self.writer.on_write_complete
+
+    def connect(self, address, priority='high', timeout=2.0):
+        """Open the simulated link and wait until it is usable"""
+        self._connected.clear()
+        self.transport.open(address)
+        if not self._connected.wait(timeout):
+            return False
+        self.transport.set_priority(priority)
+        self.params.priority = priority
+        self.scheduler.set_connection_interval(self.params.interval_ms)
+        self.transport.request_mtu(self.mtu)
+        self.with_response = not self.transport.supports_write_without_response()
+        self.writer.start()
+        return True
+
+    def _on_mtu_changed(self, mtu, success):
+        if success:
+            self.params.mtu = mtu
+
+    def close(self, timeout=1.0):
+        self.writer.wait_idle(timeout)
+        self.writer.stop()
+        self.transport.close()
+
+    def transmit(self, command):
+        priority = command_priority(command)
+        key = command[0] if priority == PRIORITY_CONTINUOUS else None
+        payload = PAYLOAD_BY_TEXT.get(command)
+        if payload is None:
+            payload = (command + '\n').encode('utf-8')
+        return self.writer.submit(payload, priority, self.with_response, key, command)
+
+    def advance(self, t):
+        """Run the control ticks due up to session time ``t``"""
+        if self._now is None:
+            self._now = t
+        interval = self.scheduler.interval
+        while self._now + interval <= t:
+            self._now += interval
+            value = self.throttle.step(interval)
+            if value is not None:
+                self.scheduler.submit_value('S', value)
+            self.scheduler.flush()
+
+    def handlers(self):
+        return {
+            REC_STEER: self.on_steer,
+            REC_PEDAL: self.on_pedal,
+            REC_ACCEL: self.on_accel,
+            REC_ROTATION: self.on_rotation,
+            REC_BUTTON: self.on_button,
+        }
+
+    def on_steer(self, phase, values):
+        value = 50 if phase == PHASE_UP else self.steering_curve.value(values[0])
+        self.scheduler.submit_value('T', value)
+
+    def on_pedal(self, phase, values):
+        self.throttle.set_pedal(0 if phase == PHASE_UP else int(values[0]))
+
+    def on_accel(self, channel, values):
+        angle = self.tilt.process(values[0], values[1], values[2], self._now or 0.0)
+        if angle is not None:
+            self.scheduler.submit_value('T', self.steering_curve.value(angle))
+
+    def on_rotation(self, channel, values):
+        self.tilt.feed_rotation(*values)
+
+    def on_button(self, phase, data):
+        command = data.decode('utf-8', errors='replace')
+        if command in ('N', 'D', 'R'):
+            self.throttle.set_gear(command)
+        self.scheduler.submit(command)
+
+    def get_stats(self):
+        return {
+            'scheduler': self.scheduler.get_stats(),
+            'writer': self.writer.get_stats(),
+            'link': self.transport.get_stats(),
+        }
+
+
+# ضبط‌کننده مشترک برنامه؛ نقاط ورودی فقط record_input / record_command را صدا می‌زنند
+_recorder = SessionRecorder()
+
+
+def get_recorder():
+    return _recorder
+
+
+def record_input(kind, channel=0, a=0.0, b=0.0, c=0.0, d=0.0):
+    if _recorder._file is not None:
+        _recorder.record(kind, channel, a, b, c, d)
+
+
+def record_button(phase, command):
+    if _recorder._file is not None:
+        _recorder.record_bytes(REC_BUTTON, phase, command.encode('utf-8'))
+
+
+def record_command(payload):
+    if _recorder._file is not None:
+        _recorder.record_bytes(REC_COMMAND, min(len(payload), 16), payload)
@@ -1,42 +1,198 @@
-from kivy.storage.jsonstore import JsonStore
+import json
+import os
+import threading
+
 from kivy.app import App
 
+from settings_schema import SCHEMA, FIELDS, build_snapshot, migrate_legacy
+
+
 class SettingsManager:
-    def __init__(self):
-        self.store = JsonStore('rc_car_settings.json')
-    
-    def get(self, key, default=None):
+    """Settings kept in memory and written to disk behind the UI thread.
+
+    Values live in the groups described by ``settings_schema.SCHEMA`` (the
+    same sections as the shipped ``rc_car_settings.json``); flat keys such
+    as ``'sensitivity'`` are resolved to their group. Keys that are not in
+    the schema are stored at the top level as ``{key: {"value": v}}``.
+
+    ``set`` only updates the in-memory dict and arms a flush timer; every
+    change made within ``flush_delay`` seconds ends up in a single write.
+    The file is written to a temporary path and renamed over the old one,
+    so a crash mid-write never leaves a truncated settings file.
+
+    Hot paths read immutable snapshots (``snapshot(group)``) as plain
+    attributes; ``subscribe(group, callback)`` hands out a fresh snapshot
+    whenever a value in that group actually changes.
+    """
+
+    def __init__(self, path='rc_car_settings.json', flush_delay=0.5):
+        self.path = path
+        self.flush_delay = flush_delay
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        self._timer = None
+        self._snapshots = {}
+        self._subscribers = {}
+        self.stats = {'sets': 0, 'unchanged': 0, 'rejected': 0, 'flushes': 0, 'errors': 0}
+        self._data = self._load()
+
+    def _load(self):
         try:
-            return self.store.get(key)['value']
-        except KeyError:
-            return default
-    
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                migrated = migrate_legacy(data)
+                if migrated:
+                    print(f"🔄 Migrated legacy settings: {migrated}")
+                    self._dirty = True
+                return data
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"❌ Settings load error: {e}")
+        return {}
+
+    def get(self, key, default=None):
+        """Stored value of ``key``; ``default`` when nothing is stored.
+
+        Schema keys with no explicit ``default`` fall back to the schema default.
+        """
+        if key in FIELDS:
+            group, field = FIELDS[key]
+            if default is not None:
+                section = self._data.get(group)
+                if not isinstance(section, dict) or key not in section:
+                    return default
+            return getattr(self.snapshot(group), field.name)
+        entry = self._data.get(key)
+        if isinstance(entry, dict):
+            return entry.get('value', default)
+        return default
+
     def set(self, key, value):
-        self.store.put(key, value=value)
-    
+        with self._lock:
+            if key in FIELDS:
+                group, field = FIELDS[key]
+                try:
+                    value = field.coerce(value)
+                except (TypeError, ValueError) as e:
+                    print(f"❌ Invalid value for {key}: {value!r} ({e})")
+                    self.stats['rejected'] += 1
+                    return
+                section = self._data.get(group)
+                if not isinstance(section, dict):
+                    section = self._data[group] = {}
+                if key in section and section[key] == value:
+                    self.stats['unchanged'] += 1
+                    return
+                section[key] = value
+                self._snapshots.pop(group, None)
+            else:
+                group = None
+                entry = self._data.get(key)
+                if isinstance(entry, dict) and 'value' in entry and entry['value'] == value:
+                    self.stats['unchanged'] += 1
+                    return
+                self._data[key] = {'value': value}
+            self._mark_dirty()
+
+        if group is not None:
+            self._notify(group)
+
+    def _mark_dirty(self):
+        """Caller holds the lock"""
+        self._dirty = True
+        self.stats['sets'] += 1
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def snapshot(self, group):
+        """Immutable snapshot of a settings group; cached until a value in it changes"""
+        snap = self._snapshots.get(group)
+        if snap is None:
+            with self._lock:
+                section = self._data.get(group)
+                snap = build_snapshot(group, section if isinstance(section, dict) else {})
+                self._snapshots[group] = snap
+        return snap
+
+    def subscribe(self, group, callback):
+        """Call ``callback(snapshot)`` whenever a value in ``group`` changes; returns the current snapshot"""
+        if group not in SCHEMA:
+            raise KeyError(f"Unknown settings group: {group}")
+        self._subscribers.setdefault(group, []).append(callback)
+        return self.snapshot(group)
+
+    def unsubscribe(self, group, callback):
+        callbacks = self._subscribers.get(group, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def _notify(self, group):
+        snap = self.snapshot(group)
+        for callback in list(self._subscribers.get(group, [])):
+            try:
+                callback(snap)
+            except Exception as e:
+                print(f"❌ Settings subscriber error ({group}): {e}")
+
+    def flush(self):
+        """Write pending changes now; safe to call from any thread"""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return False
+                payload = json.dumps(self._data)
+                self._dirty = False
+
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                self.stats['flushes'] += 1
+                return True
+            except Exception as e:
+                print(f"❌ Settings write error: {e}")
+                self.stats['errors'] += 1
+                with self._lock:
+                    self._dirty = True
+                return False
+
     def get_all_settings(self):
         """دریافت تمام تنظیمات"""
         settings = {}
-        for key in self.store.keys():
-            settings[key] = self.get(key)
+        for group in SCHEMA:
+            settings.update(self.snapshot(group).as_dict())
+        for key in list(self._data.keys()):
+            if key not in SCHEMA:
+                settings[key] = self.get(key)
         return settings
-    
+
     def reset_to_defaults(self):
         """بازنشانی تمام تنظیمات به حالت پیش‌فرض"""
         default_settings = {
             'sensitivity': 1.0,
-            'accelerometer_mode': False,
             'auto_connect': True,
             'steering_sensitivity': 1.0,
             'battery_warning_level': 20
         }
-        
+
         for key, value in default_settings.items():
             self.set(key, value)
-        
+
         print("✅ All settings reset to default")
         return default_settings
 
+
 # دسترسی سریع به تنظیمات
 def get_setting(key, default=None):
     app = App.get_running_app()
@@ -47,4 +203,17 @@ def get_setting(key, default=None):
 def set_setting(key, value):
     app = App.get_running_app()
     if hasattr(app, 'settings_manager'):
-        app.settings_manager.set(key, value)
\ No newline at end of file
+        app.settings_manager.set(key, value)
+
+def get_snapshot(group):
+    app = App.get_running_app()
+    if hasattr(app, 'settings_manager'):
+        return app.settings_manager.snapshot(group)
+    return build_snapshot(group, {})
+
+def subscribe_settings(group, callback):
+    """Subscribe to a group's changes; returns the current snapshot"""
+    app = App.get_running_app()
+    if hasattr(app, 'settings_manager'):
+        return app.settings_manager.subscribe(group, callback)
+    return build_snapshot(group, {})
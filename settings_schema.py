@@ -0,0 +1,220 @@
+from collections import OrderedDict
+
+
+class Field:
+    """One typed setting inside a group"""
+
+    __slots__ = ('name', 'type', 'default')
+
+    def __init__(self, name, type, default):
+        self.name = name
+        self.type = type
+        self.default = default
+
+    def coerce(self, value):
+        """Convert ``value`` to the field type; raises ValueError/TypeError if it does not fit"""
+        if value is None:
+            return self.default
+        if self.type is bool:
+            if isinstance(value, str):
+                return value.strip().lower() in ('1', 'true', 'yes', 'on')
+            return bool(value)
+        if self.type is int:
+            return int(round(float(value)))
+        if self.type is float:
+            return float(value)
+        if self.type is str:
+            return str(value)
+        if self.type is list:
+            return list(value)
+        if self.type is dict:
+            return dict(value)
+        return value
+
+
+# گروه‌ها دقیقاً مطابق بخش‌های rc_car_settings.json
+SCHEMA = OrderedDict([
+    ('app_config', (
+        Field('version', str, '1.0.0'),
+        Field('app_name', str, 'Bluetooth RC'),
+        Field('last_updated', str, ''),
+    )),
+    ('bluetooth_settings', (
+        Field('auto_connect', bool, True),
+        Field('last_connected_device', str, ''),
+        Field('scan_duration', float, 10.0),
+        Field('scan_max_devices', int, 0),
+        Field('scan_name_filters', list, ['esp32', 'arduino', 'car', 'ble', 'rc']),
+        Field('scan_service_uuids', list, []),
+        Field('connection_timeout', float, 10.0),
+        Field('reconnect_attempts', int, 3),
+        Field('connection_priority', str, 'high'),
+        Field('max_vehicles', int, 4),
+        Field('device_protocols', dict, {}),
+    )),
+    ('control_settings', (
+        Field('sensitivity', float, 1.0),
+        Field('steering_sensitivity', float, 1.0),
+        Field('steering_deadzone', float, 5.0),
+        Field('max_steering_angle', float, 90.0),
+        Field('steering_curve', str, 'linear'),
+        Field('steering_expo', float, 0.0),
+        Field('pedal_sensitivity', float, 1.0),
+        Field('throttle_curve', str, 'linear'),
+        Field('throttle_expo', float, 0.0),
+        Field('reverse_speed_limit', int, 50),
+    )),
+    ('vehicle_settings', (
+        Field('max_speed', int, 100),
+        Field('acceleration_rate', float, 0.5),
+        Field('deceleration_rate', float, 0.7),
+        Field('turn_signal_timeout', float, 10.0),
+        Field('hazard_light_timeout', float, 0.0),
+    )),
+    ('safety_settings', (
+        Field('battery_warning_level', int, 20),
+        Field('battery_critical_level', int, 10),
+        Field('low_battery_alert', bool, True),
+        Field('connection_lost_alert', bool, True),
+        Field('overheat_protection', bool, True),
+        Field('auto_brake_on_disconnect', bool, True),
+        Field('heartbeat_interval', float, 0.25),
+        Field('stall_timeout', float, 0.5),
+        Field('notify_timeout', float, 0.0),
+    )),
+    ('ui_settings', (
+        Field('theme', str, 'light'),
+        Field('language', str, 'en'),
+        Field('font_size', str, 'medium'),
+        Field('haptic_feedback', bool, True),
+        Field('sound_effects', bool, True),
+        Field('command_confirmation', bool, False),
+        Field('show_battery_percentage', bool, True),
+    )),
+    ('accelerometer_settings', (
+        Field('enabled', bool, False),
+        Field('calibration_x', float, 0.0),
+        Field('calibration_y', float, 0.0),
+        Field('calibration_z', float, 0.0),
+        Field('smoothing_factor', float, 0.8),
+        Field('invert_x_axis', bool, False),
+        Field('invert_y_axis', bool, False),
+        Field('steering_filter', str, 'ema'),
+        Field('one_euro_min_cutoff', float, 1.0),
+        Field('one_euro_beta', float, 0.05),
+        Field('use_rotation_vector', bool, False),
+        Field('complementary_alpha', float, 0.98),
+        Field('sensor_mode', str, 'balanced'),
+        Field('sensor_period_us', int, 20000),
+        Field('sensor_max_latency_us', int, 0),
+        Field('sensor_tick', float, 0.02),
+    )),
+    ('advanced_settings', (
+        Field('debug_mode', bool, False),
+        Field('log_level', str, 'INFO'),
+        Field('data_logging', bool, False),
+        Field('log_console', bool, False),
+        Field('session_recording', bool, False),
+        Field('performance_mode', bool, False),
+        Field('ble_mtu_size', int, 512),
+        Field('command_delay', float, 0.1),
+        Field('command_flush_interval', float, 0.03),
+        Field('command_hysteresis', int, 0),
+        Field('command_keepalive', float, 0.0),
+        Field('ble_write_queue_size', int, 32),
+        Field('ble_write_timeout', float, 0.5),
+        Field('ble_write_rate', float, 60.0),
+        Field('simulate_binary_protocol', bool, False),
+        Field('sim_connect_delay', float, 0.3),
+        Field('sim_latency_ms', float, 20.0),
+        Field('sim_jitter_ms', float, 5.0),
+        Field('sim_loss_rate', float, 0.0),
+        Field('sim_max_mtu', int, 247),
+        Field('sim_packets_per_event', int, 4),
+        Field('sim_tx_buffer', int, 16),
+        Field('sim_write_with_response', bool, False),
+        Field('sim_battery_drain', float, 1.0),
+        Field('sim_battery_interval', float, 5.0),
+        Field('sim_watchdog_timeout', float, 0.0),
+        Field('sim_seed', int, 0),
+        Field('latency_window', int, 256),
+        Field('latency_timeout', float, 1.0),
+        Field('latency_ping_interval', float, 0.2),
+    )),
+])
+
+# نام هر فیلد -> (گروه، فیلد) ؛ نام فیلدها در کل اسکیما یکتا هستند
+FIELDS = {}
+for _group, _fields in SCHEMA.items():
+    for _field in _fields:
+        if _field.name in FIELDS:
+            raise ValueError(f"Duplicate setting name: {_field.name}")
+        FIELDS[_field.name] = (_group, _field)
+
+
+class SettingsSnapshot:
+    """Immutable view of one settings group, read as plain attributes"""
+
+    __slots__ = ()
+    group = None
+
+    def __init__(self, values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+def _snapshot_class(group, fields):
+    class_name = ''.join(part.title() for part in group.split('_'))
+    return type(class_name, (SettingsSnapshot,), {
+        '__slots__': tuple(field.name for field in fields),
+        'group': group,
+    })
+
+
+SNAPSHOT_CLASSES = {group: _snapshot_class(group, fields) for group, fields in SCHEMA.items()}
+
+
+def build_snapshot(group, section):
+    """Snapshot of ``group`` from its stored section dict, with defaults for missing or bad values"""
+    values = {}
+    for field in SCHEMA[group]:
+        try:
+            values[field.name] = field.coerce(section.get(field.name, field.default))
+        except (TypeError, ValueError):
+            values[field.name] = field.default
+    return SNAPSHOT_CLASSES[group](values)
+
+
+def migrate_legacy(data):
+    """Move old flat JsonStore entries ({key: {"value": v}}) into their groups.
+
+    Returns the names of the migrated keys; ``data`` is changed in place.
+    """
+    migrated = []
+    for key in list(data.keys()):
+        entry = data[key]
+        if key in SCHEMA or key not in FIELDS:
+            continue
+        if not isinstance(entry, dict) or 'value' not in entry:
+            continue
+        group, _ = FIELDS[key]
+        section = data.get(group)
+        if not isinstance(section, dict):
+            section = data[group] = {}
+        section[key] = entry['value']
+        del data[key]
+        migrated.append(key)
+    return migrated
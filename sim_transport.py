@@ -0,0 +1,642 @@
+import heapq
+import math
+import random
+import threading
+import time
+
+from ble_writer import ATT_DEFAULT_MTU, ATT_HEADER_SIZE, CONNECTION_INTERVALS_MS
+from control_frame import FrameDecoder, FRAME_SYNC, VehicleState, PROTOCOL_PROBE, PROTOCOL_BINARY_REPLY
+from failsafe import HEARTBEAT_COMMAND
+from latency_probe import PING_PREFIX, SimulatedLinkModel
+
+BATTERY_UUID = '00002a19-0000-1000-8000-00805f9b34fb'
+NOTIFY_UUID = 'simulated'
+
+# دستگاه‌هایی که اسکن دسکتاپ پیدا می‌کند
+DEFAULT_DEVICES = (
+    ("ESP32_Car_01", "AA:BB:CC:DD:EE:FF"),
+    ("Arduino_BLE", "11:22:33:44:55:66"),
+    ("Raspberry_Pi", "CC:DD:EE:FF:11:22"),
+    ("SmartDevice_123", "DD:EE:FF:11:22:33"),
+)
+
+
+class _Event:
+    __slots__ = ('when', 'seq', 'fn', 'args', 'cancelled')
+
+    def __init__(self, when, seq, fn, args):
+        self.when = when
+        self.seq = seq
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualScheduler:
+    """Deterministic event queue on virtual time.
+
+    Nothing runs on its own: ``advance(seconds)`` runs every event that
+    falls due, in time order, with ``now()`` set to each event's time.
+    Together with a seeded ``rng`` a whole session replays identically.
+    """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._heap = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def now(self):
+        return self._now
+
+    def call_later(self, delay, fn, *args):
+        with self._lock:
+            self._seq += 1
+            event = _Event(self.now() + max(0.0, delay), self._seq, fn, args)
+            heapq.heappush(self._heap, event)
+        self._wake()
+        return event
+
+    def call_at(self, when, fn, *args):
+        return self.call_later(when - self.now(), fn, *args)
+
+    def _wake(self):
+        pass
+
+    def _pop_due(self, until):
+        with self._lock:
+            while self._heap and self._heap[0].cancelled:
+                heapq.heappop(self._heap)
+            if self._heap and self._heap[0].when <= until:
+                return heapq.heappop(self._heap)
+        return None
+
+    def advance(self, seconds):
+        target = self._now + seconds
+        while True:
+            event = self._pop_due(target)
+            if event is None:
+                break
+            self._now = max(self._now, event.when)
+            event.fn(*event.args)
+        self._now = target
+
+    def stop(self):
+        with self._lock:
+            self._heap = []
+
+
+class ThreadScheduler(VirtualScheduler):
+    """Same queue on the real clock, run by one daemon thread"""
+
+    def __init__(self, clock=time.monotonic):
+        super().__init__()
+        self.clock = clock
+        self._cond = threading.Condition(self._lock)
+        self._thread = None
+
+    def now(self):
+        return self.clock()
+
+    def _wake(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sim-gatt', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0].cancelled:
+                    if self._heap:
+                        heapq.heappop(self._heap)
+                    else:
+                        self._cond.wait()
+                delay = self._heap[0].when - self.clock()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                event = heapq.heappop(self._heap)
+            try:
+                event.fn(*event.args)
+            except Exception as e:
+                print(f"❌ Simulator event error: {e}")
+
+    def advance(self, seconds):
+        raise RuntimeError("ThreadScheduler runs on the real clock")
+
+
+_default_scheduler = None
+
+
+def default_scheduler():
+    """One real-time scheduler thread shared by every simulated link"""
+    global _default_scheduler
+    if _default_scheduler is None:
+        _default_scheduler = ThreadScheduler()
+    return _default_scheduler
+
+
+class VirtualCar:
+    """Firmware model of one car: parses what the app writes and answers like the board.
+
+    Text commands and binary frames update a ``VehicleState``; pings are
+    echoed and the binary probe is answered when ``supports_binary`` is
+    set. The battery drains at ``idle_drain`` plus ``drain`` × throttle
+    percent per minute. With ``watchdog_timeout`` > 0 the car cuts the
+    throttle when nothing arrives for that long, like the firmware
+    heartbeat watchdog.
+    """
+
+    def __init__(self, name, address, supports_binary=False, write_without_response=True, battery=100.0,
+                 drain=1.0, idle_drain=0.05, watchdog_timeout=0.0, rssi=-60):
+        self.name = name
+        self.address = address
+        self.supports_binary = supports_binary
+        self.write_without_response = write_without_response
+        self.battery = battery
+        self.drain = drain
+        self.idle_drain = idle_drain
+        self.watchdog_timeout = watchdog_timeout
+        self.rssi = rssi
+        self.notify = None
+        self.state = VehicleState()
+        self.decoder = FrameDecoder()
+        self.log = None
+        self.last_rx = None
+        self.stopped_at = None
+        self._line = bytearray()
+        self._updated = None
+        self.stats = {
+            'writes': 0,
+            'bytes': 0,
+            'commands': 0,
+            'frames': 0,
+            'pings': 0,
+            'heartbeats': 0,
+            'unknown': 0,
+            'watchdog_stops': 0,
+        }
+
+    @property
+    def battery_level(self):
+        return max(0, min(100, int(math.ceil(self.battery))))
+
+    def receive(self, payload, now):
+        """One write as it reaches the firmware"""
+        self.tick(now)
+        self.last_rx = now
+        self.stats['writes'] += 1
+        self.stats['bytes'] += len(payload)
+
+        if payload[:1] == bytes((FRAME_SYNC,)) and not self._line:
+            for frame in self.decoder.feed(payload):
+                self.stats['frames'] += 1
+                throttle = self.state.throttle
+                self.state.steering = frame['steering']
+                self.state.throttle = frame['throttle']
+                self.state.gear = frame['gear']
+                self.state.flags = frame['flags']
+                self._check_stopped(throttle, now)
+            return
+
+        self._line.extend(payload)
+        while b'\n' in self._line:
+            raw, _, rest = bytes(self._line).partition(b'\n')
+            self._line = bytearray(rest)
+            line = raw.decode('utf-8', errors='replace').strip()
+            if line:
+                self._handle_line(line, now)
+
+    def _handle_line(self, line, now):
+        if self.log is not None:
+            self.log(line)
+        if line.startswith(PING_PREFIX):
+            self.stats['pings'] += 1
+            self._notify(line.encode('utf-8'))
+        elif line == PROTOCOL_PROBE:
+            if self.supports_binary:
+                self._notify(PROTOCOL_BINARY_REPLY.encode('utf-8'))
+        elif line == HEARTBEAT_COMMAND:
+            self.stats['heartbeats'] += 1
+        else:
+            throttle = self.state.throttle
+            if self.state.apply_command(line):
+                self.stats['commands'] += 1
+                self._check_stopped(throttle, now)
+            else:
+                self.stats['unknown'] += 1
+
+    def _check_stopped(self, previous_throttle, now):
+        if previous_throttle and not self.state.throttle:
+            self.stopped_at = now
+
+    def _notify(self, data, uuid=NOTIFY_UUID):
+        if self.notify:
+            self.notify(uuid, data)
+
+    def tick(self, now):
+        """Battery drain and firmware watchdog up to ``now``"""
+        if self._updated is not None and now > self._updated:
+            rate = self.idle_drain + self.drain * self.state.throttle / 99.0
+            self.battery = max(0.0, self.battery - rate * (now - self._updated) / 60.0)
+        self._updated = now
+
+        if (self.watchdog_timeout > 0 and self.state.throttle and self.last_rx is not None
+                and now - self.last_rx > self.watchdog_timeout):
+            self.state.throttle = 0
+            self.stopped_at = now
+            self.stats['watchdog_stops'] += 1
+
+    def send_battery(self):
+        self._notify(bytes((self.battery_level,)), BATTERY_UUID)
+
+    def reset_link(self):
+        """Firmware side of a disconnect: forget partial input, stop the motor"""
+        self._line = bytearray()
+        self.decoder = FrameDecoder()
+        self.state.throttle = 0
+
+
+class FakeGattServer:
+    """The radio link and GATT server of one connected car.
+
+    Traffic only moves at connection events, one every ``interval_ms``.
+    Each event carries up to ``packets_per_event`` packets in each
+    direction. ``link.delay()`` is drawn per packet: None means the packet
+    was lost on air and is retransmitted at the next event (the link layer
+    never drops silently); a value is the stack/firmware processing time
+    added on arrival. After ``supervision_events`` events in a row without
+    a single packet getting through the link is declared lost.
+
+    Writes without response wait in a ``tx_buffer``-packet stack buffer
+    and are refused while it is full; only one write with response may be
+    outstanding and it is acknowledged at the event after the car got it.
+    Values longer than MTU - 3 are refused, as the Android stack does.
+    """
+
+    def __init__(self, car, scheduler, interval_ms=45.0, mtu=ATT_DEFAULT_MTU, max_mtu=247, packets_per_event=4,
+                 tx_buffer=16, link=None, battery_interval=5.0, supervision_events=40,
+                 on_notify=None, on_write_complete=None, on_link_lost=None):
+        self.car = car
+        self.scheduler = scheduler
+        self.interval = interval_ms / 1000.0
+        self.mtu = mtu
+        self.max_mtu = max_mtu
+        self.packets_per_event = packets_per_event
+        self.tx_buffer = tx_buffer
+        self.link = link or SimulatedLinkModel(0.0, 0.0, 0.0)
+        self.battery_interval = battery_interval
+        self.supervision_events = supervision_events
+        self.on_notify = on_notify
+        self.on_write_complete = on_write_complete
+        self.on_link_lost = on_link_lost
+        self.connected = False
+        self._lock = threading.Lock()
+        self._tx = []
+        self._rx = []
+        self._awaiting_ack = False
+        self._ack_due = False
+        self._dead_events = 0
+        self._next_battery = 0.0
+        self._car_free_at = 0.0
+        self._app_free_at = 0.0
+        self._event = None
+        self.stats = {
+            'events': 0,
+            'tx_packets': 0,
+            'rx_packets': 0,
+            'retransmits': 0,
+            'refused': 0,
+            'oversize': 0,
+            'acks': 0,
+            'max_tx_depth': 0,
+        }
+
+    def start(self):
+        self.connected = True
+        self.car.notify = self.notify
+        self._next_battery = self.scheduler.now()
+        self._event = self.scheduler.call_later(self.interval, self._connection_event)
+
+    def stop(self):
+        with self._lock:
+            self.connected = False
+            self._tx = []
+            self._rx = []
+            if self._event:
+                self._event.cancel()
+                self._event = None
+        if self.car.notify == self.notify:
+            self.car.notify = None
+        self.car.reset_link()
+
+    def set_interval(self, interval_ms):
+        """Takes effect from the next connection event"""
+        self.interval = interval_ms / 1000.0
+
+    def negotiate_mtu(self, requested):
+        self.mtu = max(ATT_DEFAULT_MTU, min(requested, self.max_mtu))
+        return self.mtu
+
+    def write(self, payload, with_response):
+        """Hand one value to the stack; False means the stack refused it"""
+        with self._lock:
+            if not self.connected:
+                return False
+            if len(payload) > self.mtu - ATT_HEADER_SIZE:
+                self.stats['oversize'] += 1
+                return False
+            if with_response:
+                if self._awaiting_ack:
+                    self.stats['refused'] += 1
+                    return False
+                self._awaiting_ack = True
+            elif len(self._tx) >= self.tx_buffer:
+                self.stats['refused'] += 1
+                return False
+            self._tx.append((bytes(payload), with_response))
+            self.stats['max_tx_depth'] = max(self.stats['max_tx_depth'], len(self._tx))
+        return True
+
+    def notify(self, uuid, data):
+        """Queue a notification from the car"""
+        with self._lock:
+            if self.connected:
+                self._rx.append((uuid, bytes(data)))
+
+    def _air(self):
+        """Processing delay of one transmission, or None if it was lost"""
+        delay = self.link.delay()
+        if delay is None:
+            self.stats['retransmits'] += 1
+        return delay
+
+    def _connection_event(self):
+        now = self.scheduler.now()
+        self.car.tick(now)
+        if self.battery_interval > 0 and now >= self._next_battery:
+            self._next_battery = now + self.battery_interval
+            self.car.send_battery()
+
+        to_car = []
+        to_app = []
+        ack = False
+        attempted = delivered = 0
+        with self._lock:
+            if not self.connected:
+                return
+            self.stats['events'] += 1
+            budget = self.packets_per_event
+
+            if self._ack_due:
+                attempted += 1
+                if self._air() is not None:
+                    self._ack_due = False
+                    self._awaiting_ack = False
+                    ack = True
+                    delivered += 1
+                budget -= 1
+
+            while self._tx and budget > 0:
+                budget -= 1
+                attempted += 1
+                delay = self._air()
+                if delay is None:
+                    break
+                payload, with_response = self._tx.pop(0)
+                self._car_free_at = max(now + delay, self._car_free_at)
+                to_car.append((self._car_free_at, payload))
+                self._ack_due = self._ack_due or with_response
+                self.stats['tx_packets'] += 1
+                delivered += 1
+
+            budget = self.packets_per_event
+            while self._rx and budget > 0:
+                budget -= 1
+                attempted += 1
+                delay = self._air()
+                if delay is None:
+                    break
+                uuid, data = self._rx.pop(0)
+                self._app_free_at = max(now + delay, self._app_free_at)
+                to_app.append((self._app_free_at, uuid, data))
+                self.stats['rx_packets'] += 1
+                delivered += 1
+
+            if attempted and not delivered:
+                self._dead_events += 1
+            elif delivered:
+                self._dead_events = 0
+            lost = self._dead_events >= self.supervision_events
+            if not lost:
+                self._event = self.scheduler.call_later(self.interval, self._connection_event)
+
+        for when, payload in to_car:
+            self.scheduler.call_at(when, self._deliver_to_car, payload)
+        for when, uuid, data in to_app:
+            if self.on_notify:
+                self.scheduler.call_at(when, self.on_notify, uuid, data)
+        if ack:
+            self.stats['acks'] += 1
+            if self.on_write_complete:
+                self.on_write_complete(True)
+        if lost:
+            print(f"❌ Simulated link lost: {self.car.name}")
+            self.stop()
+            if self.on_link_lost:
+                self.on_link_lost()
+
+    def _deliver_to_car(self, payload):
+        if self.connected:
+            self.car.receive(payload, self.scheduler.now())
+
+
+class SimTransport:
+    """Desktop/CI transport: scan, connect and write against in-process virtual cars.
+
+    It has the same shape as the Android GATT path in ``AndroidBLE``:
+    ``open`` starts a connection attempt, ``write`` hands a value to the
+    stack and returns whether it was accepted, and everything else comes
+    back through callbacks, called on the scheduler thread:
+
+    on_connected(), on_disconnected(), on_mtu_changed(mtu, success),
+    on_notify(uuid, data), on_battery(data), on_write_complete(success)
+
+    Nothing here needs Kivy. With a ``VirtualScheduler`` and a seeded
+    ``rng`` a session is fully deterministic.
+    """
+
+    def __init__(self, cars=None, scheduler=None, connect_delay=0.3, max_mtu=247, packets_per_event=4,
+                 tx_buffer=16, latency_ms=0.0, jitter_ms=0.0, loss_rate=0.0, battery_interval=5.0, rng=None):
+        self.rng = rng or random.Random()
+        self.cars = {car.address: car for car in (cars or default_cars())}
+        self.scheduler = scheduler or default_scheduler()
+        self.connect_delay = connect_delay
+        self.max_mtu = max_mtu
+        self.packets_per_event = packets_per_event
+        self.tx_buffer = tx_buffer
+        self.link = SimulatedLinkModel(latency_ms, jitter_ms, loss_rate, self.rng)
+        self.battery_interval = battery_interval
+        self.interval_ms = CONNECTION_INTERVALS_MS['balanced']
+        self.server = None
+        self._scan_events = []
+        self._connect_event = None
+        self.on_connected = None
+        self.on_disconnected = None
+        self.on_mtu_changed = None
+        self.on_notify = None
+        self.on_battery = None
+        self.on_write_complete = None
+
+    @classmethod
+    def from_settings(cls, advanced, scheduler=None):
+        """Build from an advanced_settings snapshot"""
+        seed = advanced.sim_seed
+        transport = cls(scheduler=scheduler, rng=random.Random(seed) if seed else None)
+        transport.apply_settings(advanced)
+        return transport
+
+    def apply_settings(self, advanced):
+        """Takes effect from the next connection"""
+        self.connect_delay = advanced.sim_connect_delay
+        self.max_mtu = advanced.sim_max_mtu
+        self.packets_per_event = advanced.sim_packets_per_event
+        self.tx_buffer = advanced.sim_tx_buffer
+        self.link.latency_ms = advanced.sim_latency_ms
+        self.link.jitter_ms = advanced.sim_jitter_ms
+        self.link.loss_rate = advanced.sim_loss_rate
+        self.battery_interval = advanced.sim_battery_interval
+        for car in self.cars.values():
+            car.supports_binary = advanced.simulate_binary_protocol
+            car.write_without_response = not advanced.sim_write_with_response
+            car.drain = advanced.sim_battery_drain
+            car.watchdog_timeout = advanced.sim_watchdog_timeout
+
+    @property
+    def connected(self):
+        return self.server is not None and self.server.connected
+
+    @property
+    def car(self):
+        return self.server.car if self.server else None
+
+    def scan(self, on_result):
+        """Advertise every virtual car once, staggered like a real scan"""
+        self.stop_scan()
+        for i, car in enumerate(self.cars.values()):
+            rssi = max(-100, min(-30, car.rssi + self.rng.randint(-15, 15)))
+            self._scan_events.append(self.scheduler.call_later(0.15 * (i + 1), on_result, car.name, car.address, rssi))
+
+    def stop_scan(self):
+        for event in self._scan_events:
+            event.cancel()
+        self._scan_events = []
+
+    def open(self, address, auto_connect=False):
+        """Start one connection attempt; an unknown address just never connects"""
+        self.close()
+        car = self.cars.get(address)
+        if car is None:
+            print(f"⚠️ No virtual car at {address}")
+            return True
+        self._connect_event = self.scheduler.call_later(self.connect_delay, self._link_up, car)
+        return True
+
+    def _link_up(self, car):
+        self._connect_event = None
+        self.server = FakeGattServer(
+            car, self.scheduler,
+            interval_ms=self.interval_ms,
+            max_mtu=self.max_mtu,
+            packets_per_event=self.packets_per_event,
+            tx_buffer=self.tx_buffer,
+            link=self.link,
+            battery_interval=self.battery_interval,
+            on_notify=self._on_server_notify,
+            on_write_complete=self.on_write_complete,
+            on_link_lost=self._on_link_lost
+        )
+        self.server.start()
+        if self.on_connected:
+            self.on_connected()
+
+    def close(self):
+        """Tear down without reporting a disconnect, like BluetoothGatt.close()"""
+        if self._connect_event:
+            self._connect_event.cancel()
+            self._connect_event = None
+        if self.server:
+            self.server.stop()
+            self.server = None
+        self.interval_ms = CONNECTION_INTERVALS_MS['balanced']
+
+    def drop_link(self):
+        """Scripted link loss: the app sees an unexpected disconnect"""
+        if self.server:
+            self.server.stop()
+            self._on_link_lost()
+
+    def _on_link_lost(self):
+        self.server = None
+        if self.on_disconnected:
+            self.on_disconnected()
+
+    def request_mtu(self, mtu):
+        """The answer arrives at the next connection event, like onMtuChanged"""
+        server = self.server
+        if not server:
+            return False
+        negotiated = server.negotiate_mtu(mtu)
+        if self.on_mtu_changed:
+            self.scheduler.call_later(server.interval, self.on_mtu_changed, negotiated, True)
+        return True
+
+    def set_priority(self, priority):
+        self.interval_ms = CONNECTION_INTERVALS_MS.get(priority, CONNECTION_INTERVALS_MS['balanced'])
+        if self.server:
+            self.server.set_interval(self.interval_ms)
+        return True
+
+    def supports_write_without_response(self):
+        car = self.car
+        return car.write_without_response if car else True
+
+    def write(self, payload, with_response=False):
+        server = self.server
+        if not server:
+            return False
+        return server.write(payload, with_response)
+
+    def _on_server_notify(self, uuid, data):
+        if uuid == BATTERY_UUID:
+            if self.on_battery:
+                self.on_battery(data)
+        elif self.on_notify:
+            self.on_notify(uuid, data)
+
+    def get_stats(self):
+        server = self.server
+        if not server:
+            return {'connected': False}
+        stats = dict(server.stats)
+        stats.update(
+            connected=server.connected,
+            car=server.car.name,
+            interval_ms=server.interval * 1000.0,
+            mtu=server.mtu,
+            battery=server.car.battery_level,
+            car_stats=dict(server.car.stats)
+        )
+        return stats
+
+
+def default_cars():
+    return [VirtualCar(name, address, rssi=-45 - 10 * i) for i, (name, address) in enumerate(DEFAULT_DEVICES)]
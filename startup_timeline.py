@@ -0,0 +1,52 @@
+import time
+
+from telemetry import record, EVT_STARTUP
+
+# مراحل راه‌اندازی به ترتیب زمانی مورد انتظار
+STAGE_IMPORT = 'import'
+STAGE_BUILD = 'build'
+STAGE_FIRST_FRAME = 'first_frame'
+STAGE_BLE_READY = 'ble_ready'
+STAGE_CONNECTED = 'connected'
+
+STAGES = (STAGE_IMPORT, STAGE_BUILD, STAGE_FIRST_FRAME, STAGE_BLE_READY, STAGE_CONNECTED)
+
+
+class StartupTimeline:
+    """Milliseconds from launch to each startup stage.
+
+    The origin is taken when this module is imported, which main.py does
+    before any Kivy import. Each stage is marked once; later marks of the
+    same stage (e.g. reconnects) are ignored. Every mark is also recorded
+    as an EVT_STARTUP telemetry event.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.origin = clock()
+        self.marks = {}
+
+    def mark(self, stage):
+        if stage in self.marks:
+            return None
+        elapsed_ms = (self.clock() - self.origin) * 1000.0
+        self.marks[stage] = elapsed_ms
+        record(EVT_STARTUP, STAGES.index(stage), int(elapsed_ms))
+        return elapsed_ms
+
+    def elapsed(self, stage):
+        return self.marks.get(stage)
+
+    def summary(self):
+        return '  '.join(f"{stage} {self.marks[stage]:.0f} ms" for stage in STAGES if stage in self.marks)
+
+
+_timeline = StartupTimeline()
+
+
+def get_timeline():
+    return _timeline
+
+
+def mark_startup(stage):
+    return _timeline.mark(stage)
@@ -0,0 +1,103 @@
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    np = None
+    HAS_NUMPY = False
+
+CURVE_LINEAR = 'linear'
+CURVE_EXPO = 'expo'
+CURVE_S = 's_curve'
+
+# بازه زاویه ویجت فرمان (درجه)
+ANGLE_RANGE = 90.0
+
+# متن و بایت‌های آماده همه فرمان‌های پیوسته؛ در مسیر داغ فقط ایندکس گرفته می‌شود
+COMMAND_TEXT = {channel: tuple(f"{channel}{value:02d}" for value in range(100)) for channel in ('T', 'S')}
+COMMAND_PAYLOAD = {channel: tuple((text + '\n').encode('utf-8') for text in texts)
+                   for channel, texts in COMMAND_TEXT.items()}
+PAYLOAD_BY_TEXT = {text: payload
+                   for channel in COMMAND_TEXT
+                   for text, payload in zip(COMMAND_TEXT[channel], COMMAND_PAYLOAD[channel])}
+
+
+def shape(u, curve=CURVE_LINEAR, expo=0.0):
+    """Response curve on a normalized input in [-1, 1]; works on floats and NumPy arrays.
+
+    expo:    (1 - e) * u + e * u^3          (soft centre, full-speed ends)
+    s_curve: (1 - e) * u + e * smoothstep   (soft centre and soft ends)
+    """
+    if curve == CURVE_EXPO:
+        return (1.0 - expo) * u + expo * u * u * u
+    if curve == CURVE_S:
+        a = abs(u)
+        return (1.0 - expo) * u + expo * u * a * (3.0 - 2.0 * a)
+    return u
+
+
+def steering_value(y):
+    """Normalized steering in [-1, 1] -> T value 0..99 (50 = straight); same rounding as the original"""
+    if y >= 0:
+        return min(99, 50 + int(y * 49))
+    return max(0, 50 - int(-y * 50))
+
+
+class SteeringCurve:
+    """Precomputed angle -> T value table shared by touch and tilt steering.
+
+    The table covers the widget's ±90° range in ``resolution`` steps per
+    degree; inputs beyond ``max_angle`` saturate at full lock. ``value``,
+    ``command`` and ``payload`` are plain index lookups.
+    """
+
+    def __init__(self, curve=CURVE_LINEAR, expo=0.0, max_angle=ANGLE_RANGE, resolution=10):
+        self.curve = curve
+        self.expo = max(0.0, min(1.0, expo))
+        self.max_angle = max(1.0, min(ANGLE_RANGE, max_angle))
+        self.resolution = resolution
+        self.size = int(2 * ANGLE_RANGE * resolution) + 1
+        self.values = self._build()
+        texts = COMMAND_TEXT['T']
+        payloads = COMMAND_PAYLOAD['T']
+        self.commands = [texts[value] for value in self.values]
+        self.payloads = [payloads[value] for value in self.values]
+
+    @classmethod
+    def from_settings(cls, controls):
+        """Build from a control_settings snapshot"""
+        return cls(controls.steering_curve, controls.steering_expo, controls.max_steering_angle)
+
+    def _build(self):
+        if HAS_NUMPY:
+            angles = np.linspace(-ANGLE_RANGE, ANGLE_RANGE, self.size)
+            y = shape(np.clip(angles / self.max_angle, -1.0, 1.0), self.curve, self.expo)
+            positive = np.minimum(99, 50 + np.floor(np.maximum(y, 0.0) * 49))
+            negative = np.maximum(0, 50 - np.floor(np.maximum(-y, 0.0) * 50))
+            return np.where(y >= 0, positive, negative).astype(int).tolist()
+
+        values = []
+        for i in range(self.size):
+            angle = -ANGLE_RANGE + i / self.resolution
+            u = max(-1.0, min(1.0, angle / self.max_angle))
+            values.append(steering_value(shape(u, self.curve, self.expo)))
+        return values
+
+    def index(self, angle):
+        i = int((angle + ANGLE_RANGE) * self.resolution + 0.5)
+        if i < 0:
+            return 0
+        if i >= self.size:
+            return self.size - 1
+        return i
+
+    def value(self, angle):
+        return self.values[self.index(angle)]
+
+    def command(self, angle):
+        return self.commands[self.index(angle)]
+
+    def payload(self, angle):
+        return self.payloads[self.index(angle)]
+
+    def __repr__(self):
+        return f"SteeringCurve({self.curve!r}, expo={self.expo}, max_angle={self.max_angle})"
@@ -0,0 +1,219 @@
+import math
+import time
+
+FILTER_NONE = 'none'
+FILTER_EMA = 'ema'
+FILTER_ONE_EURO = 'one_euro'
+
+# شتاب گرانش؛ بردار واحد چرخش را به واحد شتاب‌سنج (m/s²) می‌برد تا کالیبراسیون یکسان اعمال شود
+STANDARD_GRAVITY = 9.80665
+
+
+def tilt_angle(x, y, z):
+    """Sideways tilt in degrees of a gravity vector (same formula as the original steering)"""
+    return -math.degrees(math.atan2(x, math.sqrt(y * y + z * z)))
+
+
+def quaternion_gravity(qx, qy, qz, qw):
+    """World 'up' expressed in device axes, from a rotation-vector quaternion"""
+    return (
+        2.0 * (qx * qz - qw * qy),
+        2.0 * (qy * qz + qw * qx),
+        1.0 - 2.0 * (qx * qx + qy * qy),
+    )
+
+
+class ExponentialFilter:
+    """y = s * y_prev + (1 - s) * x ; ``smoothing`` 0 passes the input straight through"""
+
+    def __init__(self, smoothing=0.8):
+        self.smoothing = max(0.0, min(0.99, smoothing))
+        self.value = None
+
+    def reset(self):
+        self.value = None
+
+    def __call__(self, x, t=None):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value = self.smoothing * self.value + (1.0 - self.smoothing) * x
+        return self.value
+
+
+class OneEuroFilter:
+    """One-euro filter (Casiez et al.): strong smoothing when still, little lag when moving fast.
+
+    ``min_cutoff`` (Hz) sets the jitter removed at rest, ``beta`` how fast
+    the cutoff rises with speed.
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.derivative = 0.0
+        self.last_t = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2.0 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, x, t):
+        if self.value is None or t <= self.last_t:
+            if self.value is None:
+                self.value = x
+            self.last_t = t
+            return self.value
+        dt = t - self.last_t
+        self.last_t = t
+
+        a_d = self._alpha(self.d_cutoff, dt)
+        self.derivative = a_d * (x - self.value) / dt + (1.0 - a_d) * self.derivative
+
+        cutoff = self.min_cutoff + self.beta * abs(self.derivative)
+        a = self._alpha(cutoff, dt)
+        self.value = a * x + (1.0 - a) * self.value
+        return self.value
+
+
+class ComplementaryFilter:
+    """Fuses the rotation-vector angle (smooth, may drift) with the accelerometer angle (noisy, no drift).
+
+    Changes of the rotation-vector angle are integrated as they arrive; each
+    accelerometer sample then pulls the result towards the absolute tilt by
+    ``1 - alpha``.
+    """
+
+    def __init__(self, alpha=0.98):
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self._gyro_angle = None
+        self._gyro_delta = 0.0
+
+    def update_gyro(self, angle):
+        if self._gyro_angle is not None:
+            self._gyro_delta += angle - self._gyro_angle
+        self._gyro_angle = angle
+
+    def __call__(self, accel_angle, t=None):
+        if self.value is None:
+            self.value = accel_angle
+        else:
+            predicted = self.value + self._gyro_delta
+            self.value = self.alpha * predicted + (1.0 - self.alpha) * accel_angle
+        self._gyro_delta = 0.0
+        return self.value
+
+
+def apply_deadzone(angle, deadzone, max_angle=90.0):
+    """Zero inside ±deadzone, rescaled outside so the output still reaches ±max_angle without a jump"""
+    if deadzone <= 0:
+        return angle
+    magnitude = abs(angle)
+    if magnitude <= deadzone:
+        return 0.0
+    scaled = (magnitude - deadzone) * max_angle / (max_angle - deadzone)
+    return math.copysign(min(max_angle, scaled), angle)
+
+
+class SteeringPipeline:
+    """Raw accelerometer sample -> steering angle in degrees (±max_angle).
+
+    calibration/inversion -> orientation -> tilt (× sensitivity) ->
+    [complementary fusion] -> smoothing filter -> deadzone
+    """
+
+    def __init__(self, calibration=(0.0, 0.0, 0.0), invert_x=False, invert_y=False, sensitivity=1.0,
+                 max_angle=90.0, deadzone=0.0, smoothing=None, fusion=None, clock=time.monotonic):
+        self.calibration = calibration
+        self.invert_x = invert_x
+        self.invert_y = invert_y
+        self.sensitivity = sensitivity
+        self.max_angle = max_angle
+        self.deadzone = deadzone
+        self.smoothing = smoothing
+        self.fusion = fusion
+        self.clock = clock
+        self.landscape = True
+        self.raw_angle = 0.0
+
+    @classmethod
+    def from_settings(cls, controls, accel, clock=time.monotonic):
+        """Build from control_settings / accelerometer_settings snapshots"""
+        if accel.steering_filter == FILTER_ONE_EURO:
+            smoothing = OneEuroFilter(accel.one_euro_min_cutoff, accel.one_euro_beta)
+        elif accel.steering_filter == FILTER_EMA:
+            smoothing = ExponentialFilter(accel.smoothing_factor)
+        else:
+            smoothing = None
+        fusion = ComplementaryFilter(accel.complementary_alpha) if accel.use_rotation_vector else None
+        return cls(
+            calibration=(accel.calibration_x, accel.calibration_y, accel.calibration_z),
+            invert_x=accel.invert_x_axis,
+            invert_y=accel.invert_y_axis,
+            sensitivity=controls.sensitivity,
+            max_angle=controls.max_steering_angle,
+            deadzone=controls.steering_deadzone,
+            smoothing=smoothing,
+            fusion=fusion,
+            clock=clock,
+        )
+
+    def reset(self):
+        for stage in (self.smoothing, self.fusion):
+            if stage is not None:
+                stage.reset()
+
+    def _orient(self, x, y, z):
+        cx, cy, cz = self.calibration
+        x -= cx
+        y -= cy
+        z -= cz
+        if self.invert_x:
+            x = -x
+        if self.invert_y:
+            y = -y
+        if self.landscape:
+            return -y, x, z
+        return x, y, z
+
+    def _scale(self, angle):
+        return max(-self.max_angle, min(self.max_angle, angle * self.sensitivity * 2))
+
+    def feed_rotation(self, qx, qy, qz, qw):
+        """TYPE_GAME_ROTATION_VECTOR sample; only used when fusion is enabled.
+
+        The gravity direction goes through the same calibration, inversion
+        and orientation as an accelerometer sample, so both fusion inputs
+        share one frame.
+        """
+        if self.fusion is not None:
+            gx, gy, gz = quaternion_gravity(qx, qy, qz, qw)
+            oriented = self._orient(gx * STANDARD_GRAVITY, gy * STANDARD_GRAVITY, gz * STANDARD_GRAVITY)
+            self.fusion.update_gyro(self._scale(tilt_angle(*oriented)))
+
+    def process(self, x, y, z, t=None):
+        if t is None:
+            t = self.clock()
+        angle = self._scale(tilt_angle(*self._orient(x, y, z)))
+        self.raw_angle = angle
+        if self.fusion is not None:
+            angle = self.fusion(angle, t)
+        if self.smoothing is not None:
+            angle = self.smoothing(angle, t)
+        return apply_deadzone(angle, self.deadzone, self.max_angle)
+
+
+def calibration_offsets(x, y, z):
+    """Offsets that make the current (resting) sample read as 'flat': gravity on +z only"""
+    norm = math.sqrt(x * x + y * y + z * z)
+    return x, y, z - norm
@@ -0,0 +1,207 @@
+import itertools
+import os
+import struct
+import threading
+import time
+
+# نوع رویدادها؛ معنی channel/value/status برای هر نوع در EVENTS آمده است
+EVT_WRITE = 1
+EVT_WRITE_ERROR = 2
+EVT_COMMAND = 3
+EVT_NOT_CONNECTED = 4
+EVT_QUEUE_FULL = 5
+EVT_NOTIFY = 6
+EVT_BATTERY = 7
+EVT_STATE = 8
+EVT_SENSOR_ERROR = 9
+EVT_LOOP_ERROR = 10
+EVT_STARTUP = 11
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING, 'ERROR': ERROR}
+
+# type -> (name, level, meaning of channel / value / status)
+EVENTS = {
+    EVT_WRITE: ('write', DEBUG, 'first payload byte / length / 1 accepted, 0 refused'),
+    EVT_WRITE_ERROR: ('write_error', ERROR, 'first payload byte / length / -'),
+    EVT_COMMAND: ('command', DEBUG, 'first character / numeric value / -'),
+    EVT_NOT_CONNECTED: ('not_connected', INFO, 'first payload byte / length / 0 no link, 1 no characteristic'),
+    EVT_QUEUE_FULL: ('queue_full', WARNING, 'first payload byte / length / priority'),
+    EVT_NOTIFY: ('notify', DEBUG, '- / length / -'),
+    EVT_BATTERY: ('battery', INFO, '- / level % / -'),
+    EVT_STATE: ('state', INFO, 'state index / ms in previous state / -'),
+    EVT_SENSOR_ERROR: ('sensor_error', ERROR, '- / errors so far / -'),
+    EVT_LOOP_ERROR: ('loop_error', ERROR, '- / errors so far / -'),
+    EVT_STARTUP: ('startup', INFO, 'stage index / ms since launch / -'),
+}
+
+# timestamp (monotonic s), type, channel, value, status + 1 pad byte = 16 bytes
+RECORD = struct.Struct('<dBBiBx')
+FILE_MAGIC = b'RCTL'
+FILE_VERSION = 1
+# magic, version, record size, monotonic origin, wall clock at origin
+FILE_HEADER = struct.Struct('<4sHHdd')
+
+
+def format_record(record):
+    timestamp, event, channel, value, status = record
+    name = EVENTS[event][0] if event in EVENTS else str(event)
+    channel_text = chr(channel) if 32 < channel < 127 else str(channel)
+    return f"[{timestamp:.3f}] {name} {channel_text} {value} {status}"
+
+
+def read_file(path):
+    """(header dict, records) from a persisted telemetry file"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, size, origin, wall = FILE_HEADER.unpack_from(data, 0)
+    if magic != FILE_MAGIC or size != RECORD.size:
+        raise ValueError(f"not a telemetry file: {path}")
+    records = [RECORD.unpack_from(data, offset)
+               for offset in range(FILE_HEADER.size, len(data) - size + 1, size)]
+    return {'version': version, 'origin': origin, 'wall': wall}, records
+
+
+class Telemetry:
+    """Fixed-size binary event records in a preallocated ring.
+
+    ``record(event, channel, value, status)`` packs one 16-byte record into
+    the ring and nothing else: no string is formatted on the hot path.
+    Events below ``level`` are dropped at the door. Slots are claimed from
+    an ``itertools.count``, which is atomic under the GIL, so any thread
+    may record without a lock.
+
+    With a ``path`` set, a background thread appends new records to that
+    file every ``flush_interval`` seconds; records overwritten before they
+    were flushed are counted as dropped. ``console`` echoes every record as
+    one formatted line, for desktop debugging only.
+    """
+
+    def __init__(self, capacity=4096, level=INFO, path=None, console=False, flush_interval=2.0,
+                 clock=time.monotonic):
+        self.capacity = capacity
+        self.clock = clock
+        self.flush_interval = flush_interval
+        self._buf = bytearray(capacity * RECORD.size)
+        self._counter = itertools.count()
+        self._levels = [0] * 256
+        for event, (_, event_level, _) in EVENTS.items():
+            self._levels[event] = event_level
+        self.level = level
+        self.console = console
+        self.count = 0
+        self.path = None
+        self._flushed = 0
+        self.dropped = 0
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.set_path(path)
+
+    @classmethod
+    def from_settings(cls, advanced, path=None):
+        """Build from an advanced_settings snapshot"""
+        telemetry = cls()
+        telemetry.apply_settings(advanced, path)
+        return telemetry
+
+    def apply_settings(self, advanced, path=None):
+        self.level = LEVELS.get(advanced.log_level.upper(), INFO)
+        self.console = advanced.log_console
+        self.set_path(path if advanced.data_logging else None)
+
+    def record(self, event, channel=0, value=0, status=0):
+        if self._levels[event] < self.level:
+            return
+        i = next(self._counter)
+        now = self.clock()
+        RECORD.pack_into(self._buf, (i % self.capacity) * RECORD.size, now, event, channel, value, status)
+        # دو ترد هم‌زمان ممکن است count را یک واحد عقب بگذارند؛ رکورد بعدی جبران می‌کند
+        self.count = i + 1
+        if self.console:
+            print(format_record((now, event, channel, value, status)))
+
+    def records(self, start=0):
+        """Records from index ``start`` on that are still in the ring, oldest first"""
+        end = self.count
+        start = max(start, end - self.capacity)
+        size = RECORD.size
+        return [RECORD.unpack_from(self._buf, (i % self.capacity) * size) for i in range(start, end)]
+
+    def tail(self, n=20):
+        return [format_record(record) for record in self.records(self.count - n)]
+
+    # Persistence
+    def set_path(self, path):
+        if path == self.path:
+            return
+        self.flush()
+        self.path = path
+        if path:
+            self._flushed = self.count
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+                self._thread.start()
+        else:
+            self._wake.set()
+
+    def _run(self):
+        while self.path:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+        self._thread = None
+
+    def flush(self):
+        """Append unflushed records to the file; safe to call from any thread"""
+        with self._flush_lock:
+            path = self.path
+            end = self.count
+            if not path or end <= self._flushed:
+                return 0
+            if end - self._flushed > self.capacity:
+                self.dropped += end - self._flushed - self.capacity
+            records = self.records(self._flushed)
+            self._flushed = end
+            try:
+                new_file = not os.path.exists(path)
+                with open(path, 'ab') as f:
+                    if new_file:
+                        f.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, RECORD.size, self.clock(), time.time()))
+                    f.write(b''.join(RECORD.pack(*record) for record in records))
+                return len(records)
+            except Exception as e:
+                print(f"❌ Telemetry write error: {e}")
+                return 0
+
+    def stop(self):
+        self.set_path(None)
+
+    def get_stats(self):
+        counts = {}
+        for record in self.records():
+            name = EVENTS[record[1]][0] if record[1] in EVENTS else str(record[1])
+            counts[name] = counts.get(name, 0) + 1
+        return {
+            'recorded': self.count,
+            'in_ring': min(self.count, self.capacity),
+            'dropped': self.dropped,
+            'persisting': bool(self.path),
+            'by_event': counts,
+        }
+
+
+# ضبط‌کننده مشترک برنامه؛ ماژول‌ها فقط record را صدا می‌زنند
+_telemetry = Telemetry()
+
+
+def get_telemetry():
+    return _telemetry
+
+
+def record(event, channel=0, value=0, status=0):
+    _telemetry.record(event, channel, value, status)
@@ -0,0 +1,41 @@
+from ble_writer import BLEWriter, PRIORITY_CONTINUOUS, PRIORITY_DISCRETE
+
+
+def _refused_batch(retries_by_key):
+    """Queue one text command per key, batch them into a single write and have the stack refuse it"""
+    dropped = []
+    writer = BLEWriter(lambda payload, with_response: False, max_retries=3, on_dropped=dropped.append)
+    writer._running = True
+    for key, retries in retries_by_key.items():
+        writer.submit(f"{key}10\n".encode(), PRIORITY_CONTINUOUS, False, key, f"{key}10")
+        writer._keyed[key].retries = retries
+    item = writer._next_item()
+    assert len(item.parts) == len(retries_by_key)
+    writer._write(item)
+    requeued = {queued.key: queued.retries for queued in writer._heap}
+    return requeued, dropped
+
+
+def test_refused_batch_keeps_each_part_retry_count():
+    requeued, dropped = _refused_batch({'T': 0, 'S': 2})
+    assert requeued == {'T': 1, 'S': 3}
+    assert dropped == []
+
+
+def test_exhausted_part_is_dropped_without_taking_fresh_parts_with_it():
+    requeued, dropped = _refused_batch({'T': 3, 'S': 0})
+    assert requeued == {'S': 1}
+    assert dropped == ['T']
+
+
+def test_refused_write_is_retried_until_the_budget_runs_out():
+    dropped = []
+    writer = BLEWriter(lambda payload, with_response: False, max_retries=2, on_dropped=dropped.append)
+    writer._running = True
+    writer.submit(b'LIT\n', PRIORITY_DISCRETE, False, 'L', 'LIT')
+    attempts = 0
+    while writer._heap:
+        writer._write(writer._next_item())
+        attempts += 1
+    assert attempts == 3
+    assert dropped == ['L']
@@ -0,0 +1,89 @@
+from steering_curve import shape, CURVE_LINEAR
+
+
+class ThrottleEngine:
+    """Shapes the raw pedal position into the S value actually sent, one control tick at a time.
+
+    pedal 0..99 -> × pedal_sensitivity -> response curve -> gear cap
+    (D/N: max_speed, R: reverse_speed_limit) -> rate limit. Rates are in
+    full scale per second (0 = no limit); ``acceleration_rate`` applies
+    while the output rises, ``deceleration_rate`` while it falls.
+    """
+
+    def __init__(self, acceleration_rate=0.5, deceleration_rate=0.7, max_speed=100, reverse_limit=50,
+                 sensitivity=1.0, curve=CURVE_LINEAR, expo=0.0):
+        self.gear = 'N'
+        self.pedal = 0
+        self.target = 0.0
+        self.current = 0.0
+        self.value = 0
+        self.configure(acceleration_rate, deceleration_rate, max_speed, reverse_limit, sensitivity, curve, expo)
+
+    @classmethod
+    def from_settings(cls, controls, vehicle):
+        """Build from control_settings / vehicle_settings snapshots"""
+        engine = cls()
+        engine.apply_settings(controls, vehicle)
+        return engine
+
+    def apply_settings(self, controls, vehicle):
+        self.configure(vehicle.acceleration_rate, vehicle.deceleration_rate, vehicle.max_speed,
+                       controls.reverse_speed_limit, controls.pedal_sensitivity,
+                       controls.throttle_curve, controls.throttle_expo)
+
+    def configure(self, acceleration_rate, deceleration_rate, max_speed, reverse_limit, sensitivity, curve, expo):
+        self.acceleration_rate = acceleration_rate
+        self.deceleration_rate = deceleration_rate
+        self.max_speed = max(0, min(100, max_speed))
+        self.reverse_limit = max(0, min(100, reverse_limit))
+        self.sensitivity = sensitivity
+        self.curve = curve
+        self.expo = max(0.0, min(1.0, expo))
+        self._update_target()
+
+    def gear_cap(self, gear=None):
+        """Largest output for a gear, as a fraction of full scale"""
+        gear = gear or self.gear
+        if gear == 'R':
+            return min(self.max_speed, self.reverse_limit) / 100.0
+        return self.max_speed / 100.0
+
+    def set_gear(self, gear):
+        self.gear = gear
+        self._update_target()
+
+    def set_pedal(self, pedal):
+        """Raw pedal position 0..99"""
+        self.pedal = max(0, min(99, pedal))
+        self._update_target()
+
+    def _update_target(self):
+        u = min(1.0, self.pedal / 99.0 * self.sensitivity)
+        self.target = min(self.gear_cap(), shape(u, self.curve, self.expo))
+
+    def stop(self):
+        """Drop to zero immediately (safety paths bypass the ramp)"""
+        self.pedal = 0
+        self.target = 0.0
+        self.current = 0.0
+        self.value = 0
+
+    @property
+    def settled(self):
+        return self.current == self.target
+
+    def step(self, dt):
+        """Advance the ramp by ``dt`` seconds; returns the new S value, or None if it did not change"""
+        delta = self.target - self.current
+        if delta > 0:
+            rate = self.acceleration_rate
+            self.current = self.target if rate <= 0 else min(self.target, self.current + rate * dt)
+        elif delta < 0:
+            rate = self.deceleration_rate
+            self.current = self.target if rate <= 0 else max(self.target, self.current - rate * dt)
+
+        value = int(round(self.current * 99))
+        if value == self.value:
+            return None
+        self.value = value
+        return value
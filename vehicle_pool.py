@@ -0,0 +1,126 @@
+import time
+from collections import OrderedDict
+
+from ble_writer import PRIORITY_SAFETY
+
+# فرمان‌های توقف کامل که به همه خودروها ارسال می‌شود
+ALL_STOP_COMMANDS = ('S00', 'T50', 'N')
+
+
+class VehiclePool:
+    """Keeps warm BLE links to several cars, keyed by address, with one active car.
+
+    Every link is a full AndroidBLE instance with its own GATT handle,
+    writer thread and reconnect state machine, so switching the active car
+    is just a pointer swap. ``link_factory()`` creates a new, unconnected
+    link.
+    """
+
+    def __init__(self, link_factory, max_links=4, clock=time.monotonic):
+        self.link_factory = link_factory
+        self.max_links = max_links
+        self.clock = clock
+        self.links = OrderedDict()
+        self.active = link_factory()
+        self._last_totals = None
+        self._last_totals_at = None
+
+    def __len__(self):
+        return len(self.links)
+
+    def address_of(self, link):
+        for address, candidate in self.links.items():
+            if candidate is link:
+                return address
+        return None
+
+    def acquire(self, address):
+        """Link for ``address``: the existing one, the idle active one, or a new one (None if full)"""
+        address = address.upper()
+        if address in self.links:
+            return self.links[address]
+
+        if self.address_of(self.active) is None:
+            # لینک فعال هنوز به خودرویی وصل نشده؛ همان را استفاده کن
+            link = self.active
+        elif len(self.links) >= self.max_links:
+            return None
+        else:
+            link = self.link_factory()
+        self.links[address] = link
+        return link
+
+    def set_active(self, address):
+        link = self.links.get(address.upper())
+        if link is not None:
+            self.active = link
+        return link
+
+    def remove(self, address):
+        """Disconnect a car and drop it from the pool"""
+        link = self.links.pop(address.upper(), None)
+        if link is None:
+            return
+        link.disconnect()
+        if link is self.active:
+            # یک لینک دیگر را فعال کن یا لینک خالی را برای اتصال بعدی نگه دار
+            if self.links:
+                self.active = next(reversed(self.links.values()))
+            else:
+                self.active = link
+                return
+        link.writer.stop()
+
+    def release(self, address):
+        """Forget an address; the active link object itself is kept for the next connection"""
+        link = self.links.pop(address.upper(), None)
+        if link is not None and link is not self.active:
+            link.disconnect()
+            link.writer.stop()
+
+    def broadcast(self, command, priority=PRIORITY_SAFETY):
+        """Send one command to every connected car; returns {address: queued}"""
+        return {address: link.send_command(command, priority)
+                for address, link in self.links.items() if link.connected}
+
+    def all_stop(self):
+        """Queue-jumping stop (ALL_STOP_COMMANDS) to every connected car"""
+        return {address: link.emergency_stop() for address, link in self.links.items() if link.connected}
+
+    def disconnect_all(self):
+        for link in self.links.values():
+            link.disconnect()
+
+    def shutdown(self):
+        self.disconnect_all()
+        stopped = set()
+        for link in list(self.links.values()) + [self.active]:
+            if id(link) not in stopped:
+                link.writer.stop()
+                stopped.add(id(link))
+
+    def aggregate_stats(self):
+        """Summed writer stats across cars, per-car stats and writes/s since the last call"""
+        per_link = {address: link.writer.get_stats() for address, link in self.links.items()}
+        totals = {}
+        for stats in per_link.values():
+            for key, value in stats.items():
+                if key == 'max_depth':
+                    totals[key] = max(totals.get(key, 0), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+
+        now = self.clock()
+        rate = 0.0
+        if self._last_totals is not None and now > self._last_totals_at:
+            rate = (totals.get('written', 0) - self._last_totals.get('written', 0)) / (now - self._last_totals_at)
+        self._last_totals = totals
+        self._last_totals_at = now
+
+        return {
+            'cars': len(self.links),
+            'connected': sum(1 for link in self.links.values() if link.connected),
+            'totals': totals,
+            'writes_per_second': rate,
+            'per_car': per_link,
+        }